@@ -0,0 +1,44 @@
+#!/usr/bin/python
+
+"""Compare getInterval() called per pair with getIntervals() on arrays
+
+	python benchmarks/batch_intervals.py [number_of_pairs]
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import numpy	# loaded here so that the timings exclude importing it
+import spoff
+
+def randomPitches(count, seed):
+	generator = random.Random(seed)
+	return [spoff.SpoffPitch(generator.randint(-7, 13), 1, generator.randint(2, 6))
+	        for n in range(count)]
+
+def main(count=20000):
+	sources = randomPitches(count, 1)
+	dests = randomPitches(count, 2)
+
+	start = time.time()
+	expected = [spoff.getInterval(s, d) for (s, d) in zip(sources, dests)]
+	perPair = time.time() - start
+
+	start = time.time()
+	arrays = spoff.pitches2arrays(sources) + spoff.pitches2arrays(dests)
+	convert = time.time() - start
+	start = time.time()
+	intervals = spoff.getIntervals(*arrays)
+	batch = time.time() - start
+	assert spoff.arrays2intervals(*intervals) == expected
+
+	print('%d pairs' % count)
+	print('getInterval per pair:   %8.2f ms' % (perPair * 1e3))
+	print('getIntervals on arrays: %8.2f ms (+%.2f ms building arrays)' % (batch * 1e3, convert * 1e3))
+
+if __name__ == "__main__":
+	main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+"""Compare building a document row by row, as the populatedocument()
+aggregate does, with spoff.buildDocument(), and render both
+
+	python benchmarks/build_document.py [work_id ...]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import spoff
+from fakedb import loadDump, FakePlpy
+
+def addScoreNoteToDocument(cond, GD, doc, note):
+	# the body of addscorenotetodocument(), the aggregate's state function
+	if cond==False:
+		GD[doc] = {}
+		GD[doc]["noteData"] = {}
+	if note["work_id"] not in GD[doc]["noteData"].keys():
+		GD[doc]["noteData"][note["work_id"]] = {}
+	GD[doc]["noteData"][note.pop("work_id")][note.pop("note_id")] = note
+	return True
+
+def main(work_ids=tuple(range(15))):
+	data = loadDump(tables=['score_notes', 'note_groups', 'note_groups__score_notes'])
+	plpy = FakePlpy(data)
+	rows = plpy.execute(spoff.scoreNoteQuery, [list(work_ids)])
+
+	GD = {}
+	start = time.time()
+	cond = False
+	for row in rows:
+		cond = addScoreNoteToDocument(cond, GD, 'inv', dict(row))
+	aggregate = time.time() - start
+
+	start = time.time()
+	doc = spoff.documentFromRows(rows)
+	columnar = time.time() - start
+
+	assert spoff.doc2lilypond(doc, plpy) == spoff.doc2lilypond(GD['inv'], plpy)
+	print('%d notes in %d works' % (len(rows), len(work_ids)))
+	print('per-row aggregate:  %8.2f ms' % (aggregate * 1e3))
+	print('documentFromRows:   %8.2f ms' % (columnar * 1e3))
+
+if __name__ == "__main__":
+	main([int(arg) for arg in sys.argv[1:]] or tuple(range(15)))
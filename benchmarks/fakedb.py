@@ -0,0 +1,125 @@
+"""Enough of the musicdb database and of plpy to run the renderer offline
+
+The tables are read from the COPY sections of musicdb_dump.txt by
+spoff.store.copySections(), with every value left as the text PL/Python
+hands over for composite and array columns (e.g. '(13,4)', '{22,85,1}')
+and NULL as None.
+"""
+import os
+
+from spoff.store import copySections, unescape
+
+DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'musicdb_dump.txt')
+
+_integerColumns = set(['work_id', 'note_id', 'voice', 'id', 'note_group_id',
+                       'score_note_work_id', 'score_note_note_id'])
+
+def loadDump(path=DUMP, tables=None):
+	"""Return {table name: list of row dictionaries} for the COPY sections
+	of the dump, or just those named in tables"""
+	data = {}
+	with open(path) as lines:
+		for name, columns, types, fields in copySections(lines, tables):
+			rows = data.setdefault(name, [])
+			integers = _integerColumns.intersection(columns)
+			for values in fields:
+				row = dict(zip(columns, [None if v == '\\N' else unescape(v) for v in values]))
+				for column in integers:
+					if row[column] is not None:
+						row[column] = int(row[column])
+				rows.append(row)
+	return data
+
+def populateDocument(score_notes, work_ids):
+	"""The document built by populatedocument() for the given works"""
+	noteData = {}
+	for row in score_notes:
+		if row['work_id'] in work_ids:
+			note = dict(row)
+			noteData.setdefault(note.pop('work_id'), {})[note.pop('note_id')] = note
+	return {'noteData': noteData}
+
+class FakePlpy(object):
+	"""Answers the score_notes query made by spoff.buildDocument() and the
+	note group queries made by spoff.doc2lilypond() by scanning the tables,
+	as the database does (the query columns of note_groups__score_notes
+	are not indexed), and counts the calls.
+
+	With indexed true, the queries by work_id look the rows up by work
+	instead, as if there were indexes on work_id; use this when the time
+	taken to answer the queries is not of interest. An indexed FakePlpy
+	also serves copies of the corpus: work workStride * n + w is the nth
+	copy of work w (see workIds()), with its note groups renumbered to
+	match, without the copies being held in memory."""
+
+	def __init__(self, data, indexed=False, copies=1):
+		self.score_notes = data.get('score_notes', [])
+		self.links = data['note_groups__score_notes']
+		self.groups = dict((g['id'], g) for g in data['note_groups'])
+		self.executeCount = 0
+		self.notesByWork = None
+		self.linksByWork = None
+		self.workStride = max([row['work_id'] for row in self.score_notes] or [0]) + 1
+		self.groupStride = max(self.groups or [0]) + 1
+		self.copies = copies
+		if indexed or copies != 1:
+			self.notesByWork = {}
+			for row in self.score_notes:
+				self.notesByWork.setdefault(row['work_id'], []).append(row)
+			self.linksByWork = {}
+			for link in self.links:
+				self.linksByWork.setdefault(link['score_note_work_id'], []).append(link)
+
+	def workIds(self):
+		"""The work_ids of every work in every copy of the corpus"""
+		works = sorted(self.notesByWork if self.notesByWork is not None
+		               else set(row['work_id'] for row in self.score_notes))
+		return [copy * self.workStride + work_id
+		        for copy in range(self.copies) for work_id in works]
+
+	def prepare(self, query, types=None):
+		return query
+
+	def _groupRows(self, links, work_id=None, groupOffset=0):
+		rows = []
+		for link in links:
+			group = self.groups[link['note_group_id']]
+			rows.append({'work_id': link['score_note_work_id'] if work_id is None else work_id,
+			             'note_id': link['score_note_note_id'],
+			             'id': group['id'] + groupOffset, 'type': group['type'],
+			             'comment': group['comment'], 'value': group['value']})
+		return rows
+
+	def execute(self, plan, args=()):
+		self.executeCount += 1
+		if 'from score_notes' in plan:
+			if self.notesByWork is None:
+				work_ids = set(args[0])
+				rows = [dict(row) for row in self.score_notes if row['work_id'] in work_ids]
+			else:
+				rows = []
+				for work_id in set(args[0]):
+					for row in self.notesByWork.get(work_id % self.workStride, ()):
+						row = dict(row)
+						row['work_id'] = work_id
+						rows.append(row)
+			rows.sort(key=lambda row: (row['work_id'], row['note_id']))
+			return rows
+		if 'any($1)' in plan:
+			if self.linksByWork is None:
+				work_ids = set(args[0])
+				rows = self._groupRows([link for link in self.links
+				                        if link['score_note_work_id'] in work_ids])
+			else:
+				rows = []
+				for work_id in set(args[0]):
+					rows.extend(self._groupRows(self.linksByWork.get(work_id % self.workStride, ()),
+						work_id, work_id // self.workStride * self.groupStride))
+			rows.sort(key=lambda row: (row['work_id'], row['note_id'], row['id']))
+			return rows
+		if 'score_note_note_id = $1' in plan:
+			note_id, work_id = args
+			return self._groupRows([link for link in self.links
+			                        if link['score_note_note_id'] == note_id
+			                        and link['score_note_work_id'] == work_id])
+		raise ValueError('FakePlpy: unexpected query %r' % plan)
@@ -0,0 +1,42 @@
+--
+-- Time building the score_notes onset and duration indexes.
+--
+-- Run once before applying sql/sort_keys.sql (the btree operator classes
+-- call the plpythonu comparetime()) and once after (everything is SQL):
+--
+--   psql musicdb -f benchmarks/index_build.sql
+--
+-- The notes are copied :copies times (default 10) into a scratch table
+-- so that the timings are not lost in the noise.
+--
+
+\set ON_ERROR_STOP on
+\if :{?copies}
+\else
+\set copies 10
+\endif
+
+BEGIN;
+
+CREATE TEMP TABLE bench_notes ON COMMIT DROP AS
+    SELECT n.*
+      FROM score_notes AS n, generate_series(1, :copies) AS copy;
+
+\timing on
+
+CREATE INDEX bench_notes__onset_index ON bench_notes USING btree (onset);
+CREATE INDEX bench_notes__duration_index ON bench_notes USING btree (duration);
+SELECT count(*) FROM (SELECT onset FROM bench_notes ORDER BY onset) AS sorted;
+
+\timing off
+SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'spoff_time_key') AS have_keys \gset
+\if :have_keys
+\echo 'Expression indexes on the sort keys:'
+\timing on
+CREATE INDEX bench_notes__onset_key_index ON bench_notes USING btree (spoff_time_key(onset));
+CREATE INDEX bench_notes__duration_key_index ON bench_notes USING btree (spoff_time_key(duration));
+SELECT count(*) FROM (SELECT onset FROM bench_notes ORDER BY spoff_time_key(onset)) AS sorted;
+\timing off
+\endif
+
+ROLLBACK;
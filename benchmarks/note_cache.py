@@ -0,0 +1,45 @@
+#!/usr/bin/python
+
+"""Compare the start-up cost of getting the notes of every work from the
+dump (as text rows, and through spoff.store) with opening a
+spoff.cache file, and check that all three render the same
+
+	python benchmarks/note_cache.py [cache file]
+"""
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import spoff
+from spoff import cache, store
+from fakedb import DUMP, loadDump
+
+def timed(label, function):
+	start = time.time()
+	result = function()
+	print('%-28s %8.2f ms' % (label, (time.time() - start) * 1e3))
+	return result
+
+def main(path=None):
+	path = path or os.path.join(tempfile.gettempdir(), 'spoff-notes.cache')
+	rows = timed('loadDump score_notes', lambda: loadDump(tables=['score_notes'])['score_notes'])
+	corpus = timed('store.load', lambda: store.load(DUMP))
+	work_ids = sorted(corpus.notes_by_work)
+	timed('writeCache', lambda: cache.writeCache(path, cache.fetchScoreNotes(corpus.plpy, work_ids)))
+	notes = timed('NoteCache', lambda: cache.NoteCache(path, plpy=corpus.plpy))
+	timed('NoteCache, unverified', lambda: cache.NoteCache(path, verify=False)).close()
+	timed('rows of every work', lambda: [notes.rows(work_id) for work_id in work_ids])
+	timed('pitchArrays', notes.pitchArrays)
+	print('%d notes, %d bytes' % (len(rows), os.path.getsize(path)))
+
+	for work_id in work_ids:
+		expected = spoff.doc2lilypond(spoff.buildDocument(corpus.plpy, [work_id]), corpus.plpy)
+		assert spoff.doc2lilypond(spoff.buildDocument(notes.plpy, [work_id]), notes.plpy) == expected
+	notes.close()
+
+if __name__ == "__main__":
+	main(*sys.argv[1:])
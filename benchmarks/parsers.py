@@ -0,0 +1,38 @@
+#!/usr/bin/python
+
+"""Per-call timings of the text parsers and the lilypond conversions
+
+The arguments are the ones SQL queries and doc2lilypond() pass over and
+over again: interval and pitch names, and composite values as text.
+
+	python benchmarks/parsers.py [number_of_calls]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import spoff
+
+def cases():
+	"""Yield (name, function, arguments) for each parser"""
+	yield 'text2interval', spoff.text2interval, ('M6',)
+	yield 'text2pitch', spoff.text2pitch, ('F#4',)
+	yield 'scale', spoff.scale, ('EbM',)
+	yield 'spoff_pitch2lily', spoff.spoff_pitch2lily, ('(8,1,4)',)
+	yield 'spoff_time2lily', spoff.spoff_time2lily, ('(3,2)',)
+
+def perCall(function, args, number):
+	"""Best of three runs of number calls, in microseconds per call"""
+	timer = timeit.Timer(lambda: function(*args))
+	return min(timer.repeat(3, number)) / number * 1e6
+
+def main(number=20000):
+	print('%-20s %12s' % ('parser', 'us per call'))
+	for name, function, args in cases():
+		print('%-20s %12.3f' % (name, perCall(function, args, number)))
+
+if __name__ == "__main__":
+	main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+
+"""Per-call timings of the spoff pitch, interval and time primitives
+
+Each primitive is timed twice: with the dictionaries which plpythonu
+passes for composite values, and with the compact SpoffPitch,
+SpoffInterval and SpoffScoreTime types. Run from the top of the source
+tree:
+
+	python benchmarks/primitives.py [number_of_calls]
+"""
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import spoff
+
+def pitchDict(text):
+	return dict(zip(('pitch', 'divisions_per_semitone', 'octave'), spoff.text2pitch(text)))
+
+def intervalDict(text):
+	return dict(zip(('interval', 'divisions_per_semitone', 'octave'), spoff.text2interval(text)))
+
+def timeDict(numerator, denominator):
+	return {'crotchet_numerator': numerator, 'crotchet_denominator': denominator}
+
+def cases():
+	"""Yield (name, function, dictionary arguments) for each primitive"""
+	yield 'getInterval', spoff.getInterval, (pitchDict('Eb4'), pitchDict('F#5'))
+	yield 'lessThanPitch', spoff.lessThanPitch, (pitchDict('Ab4'), pitchDict('G#4'))
+	yield 'greaterThanPitch', spoff.greaterThanPitch, (pitchDict('Ab4'), pitchDict('G#4'))
+	yield 'equatePitch', spoff.equatePitch, (pitchDict('C#5'), pitchDict('Db5'))
+	yield 'addInterval', spoff.addInterval, (pitchDict('G4'), intervalDict('M3'))
+	yield 'equateIntervalType', spoff.equateIntervalType, (intervalDict('1+M3'), intervalDict('M3'))
+	yield 'lessThanTime', spoff.lessThanTime, (timeDict(13, 4), timeDict(7, 2))
+	yield 'equateTime', spoff.equateTime, (timeDict(13, 4), timeDict(7, 2))
+
+def compact(value):
+	"""Convert a dictionary argument to the corresponding compact type"""
+	if 'pitch' in value:
+		return spoff.asPitch(value)
+	elif 'interval' in value:
+		return spoff.asInterval(value)
+	return spoff.asScoreTime(value)
+
+def perCall(function, args, number):
+	"""Best of three runs of number calls, in microseconds per call"""
+	timer = timeit.Timer(lambda: function(*args))
+	return min(timer.repeat(3, number)) / number * 1e6
+
+def main(number=100000):
+	print('%-20s %12s %12s' % ('primitive', 'dict (us)', 'compact (us)'))
+	for name, function, args in cases():
+		dictTime = perCall(function, args, number)
+		compactTime = perCall(function, [compact(arg) for arg in args], number)
+		print('%-20s %12.3f %12.3f' % (name, dictTime, compactTime))
+
+if __name__ == "__main__":
+	main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+"""Time doc2lilypond() rendering inventions from musicdb_dump.txt offline
+
+	python benchmarks/render.py [--processes N] [work_id ...]
+
+Prints the render time, the number of queries made through plpy and,
+from a second, traced, run, the time spent in each phase, with the
+fragment cache off and the note groups fetched as for a new document;
+then the time to render again from the cache and the kept note
+groups. With
+--processes, also times rendering the works in a pool of N processes
+and checks that the output is the same.
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import spoff
+from fakedb import loadDump, populateDocument, FakePlpy
+
+def main(work_ids=(0,), processes=None):
+	data = loadDump(tables=['score_notes', 'note_groups', 'note_groups__score_notes'])
+	doc = populateDocument(data['score_notes'], work_ids)
+	plpy = FakePlpy(data)
+	notes = sum(len(notes) for notes in doc['noteData'].values())
+
+	cacheSize = spoff.setFragmentCacheSize(0)
+	start = time.time()
+	lily = spoff.doc2lilypond(doc, plpy)
+	elapsed = time.time() - start
+
+	print('works %s: %d notes, %d characters of lilypond' % (
+		', '.join(str(w) for w in work_ids), notes, len(lily)))
+	print('doc2lilypond: %8.2f ms, %d queries' % (elapsed * 1e3, plpy.executeCount))
+
+	previous = spoff.setTraceLevel(spoff.TRACE_TIMING)
+	spoff.resetTrace()
+	doc.pop('noteGroups')
+	spoff.doc2lilypond(doc, plpy)
+	spoff.setTraceLevel(previous)
+	phases = {}
+	for row in spoff.traceSummary():
+		phases[row['phase']] = phases.get(row['phase'], 0) + row['seconds']
+	for phase in sorted(phases):
+		print('  %-14s %8.2f ms' % (phase, phases[phase] * 1e3))
+
+	spoff.setFragmentCacheSize(cacheSize)
+	spoff.doc2lilypond(doc, plpy)
+	start = time.time()
+	cached = spoff.doc2lilypond(doc, plpy)
+	elapsed = time.time() - start
+	assert cached == lily
+	print('from the fragment cache: %8.2f ms, %d hits' % (elapsed * 1e3,
+		spoff.fragmentCache.hits))
+
+	if processes:
+		start = time.time()
+		pooled = spoff.doc2lilypond(doc, plpy, processes)
+		elapsed = time.time() - start
+		assert pooled == lily
+		print('%d processes:  %8.2f ms' % (processes, elapsed * 1e3))
+
+if __name__ == "__main__":
+	arguments = sys.argv[1:]
+	processes = None
+	if arguments[:1] == ['--processes']:
+		processes = int(arguments[1])
+		arguments = arguments[2:]
+	main([int(arg) for arg in arguments] or (0,), processes)
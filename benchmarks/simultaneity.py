@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+"""Compare a nested loop over the overlap predicates of intervals.sql with
+the sweep in timedIntervals(), on two randomly generated parts
+
+	python benchmarks/simultaneity.py [notes_per_part]
+"""
+from __future__ import print_function
+from fractions import Fraction
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import spoff
+
+def randomPart(count, seed):
+	generator = random.Random(seed)
+	notes = []
+	onset = Fraction(0)
+	for note_id in range(count):
+		duration = Fraction(1, generator.choice([1, 2, 4, 8]))
+		notes.append({'work_id': 0, 'note_id': note_id,
+		              'pitch': spoff.SpoffPitch(generator.randint(-7, 13), 1, generator.randint(2, 6)),
+		              'onset': spoff.SpoffScoreTime(onset.numerator, onset.denominator),
+		              'duration': spoff.SpoffScoreTime(duration.numerator, duration.denominator)})
+		onset += duration
+	return notes
+
+def nestedLoop(top, bottom):
+	pairs = []
+	for t in top:
+		tOnset = Fraction(*t['onset'])
+		tEnd = tOnset + Fraction(*t['duration'])
+		for b in bottom:
+			bOnset = Fraction(*b['onset'])
+			bEnd = bOnset + Fraction(*b['duration'])
+			if bOnset == tOnset or (bOnset < tOnset and bEnd > tOnset) or (tOnset <= bOnset < tEnd):
+				pairs.append((t['note_id'], b['note_id'], spoff.getInterval(t['pitch'], b['pitch'])))
+	return pairs
+
+def main(count=500):
+	top = randomPart(count, 1)
+	bottom = randomPart(count, 2)
+
+	start = time.time()
+	expected = nestedLoop(top, bottom)
+	nested = time.time() - start
+
+	start = time.time()
+	pairs = [(row['source_note_id'], row['dest_note_id'], (row['value'], 1, row['octave']))
+	         for row in spoff.timedIntervals(top, bottom)]
+	sweep = time.time() - start
+	assert sorted(pairs) == sorted(expected)
+
+	print('%d notes per part, %d overlapping pairs' % (count, len(pairs)))
+	print('nested loop:    %8.2f ms' % (nested * 1e3))
+	print('timedIntervals: %8.2f ms' % (sweep * 1e3))
+
+if __name__ == "__main__":
+	main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+"""Benchmark suite over the Bach inventions in musicdb_dump.txt
+
+Runs without Postgresql: the tables are read from the dump's COPY
+sections and the database calls are answered by fakedb.FakePlpy. Each
+workload is run on the corpus copied 1, 10 and 100 times over, and the
+time per item (note, pair or pitch) is compared with the stored baseline
+in benchmarks/baseline.json, so that a regression, or a workload which
+stops scaling linearly, shows up:
+
+	python benchmarks/suite.py [--scales 1,10,100] [--workloads getInterval,...]
+	python benchmarks/suite.py --save	# store the results as the baseline
+
+Exits with status 1 if any workload is slower than its baseline by more
+than the tolerance (default 25%). The baseline is only meaningful on the
+machine and Python it was recorded with, which it records.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import spoff
+from fakedb import loadDump, FakePlpy
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+class Corpus(object):
+	"""The inventions, copied copies times over"""
+
+	def __init__(self, data, copies):
+		self.copies = copies
+		self.plpy = FakePlpy(data, copies=copies)
+		self.work_ids = self.plpy.workIds()
+		# the score_notes rows of each part of each work, in onset order
+		self.parts = []
+		for work_id in self.work_ids[:len(self.work_ids) // copies]:
+			rows = self.plpy.execute(spoff.scoreNoteQuery, [[work_id]])
+			for part_id in sorted(set(row['part_id'] for row in rows)):
+				part = [row for row in rows if row['part_id'] == part_id]
+				part.sort(key=lambda row: spoff.scoreTimeKey(spoff.asScoreTime(row['onset'])))
+				self.parts.append(part)
+		# and the notes of all the copies, as the compact types
+		pitches = [spoff.asPitch(row['pitch']) for part in self.parts for row in part]
+		onsets = [spoff.asScoreTime(row['onset']) for part in self.parts for row in part]
+		self.pitches = [p for p in pitches if p is not None] * copies
+		self.onsets = onsets * copies
+
+	def notes(self):
+		return len(self.onsets)
+
+def pairs(values):
+	return list(zip(values[:-1], values[1:]))
+
+#
+# Workloads: each takes a Corpus and returns (items, unit, run), where
+# run() does the work being timed
+#
+
+def getIntervalWorkload(corpus):
+	melodic = pairs(corpus.pitches)
+	def run():
+		getInterval = spoff.getInterval
+		for source, dest in melodic:
+			getInterval(source, dest)
+	return len(melodic), 'pair', run
+
+def pitchTextWorkload(corpus):
+	pitches = corpus.pitches
+	def run():
+		text2pitch = spoff.text2pitch
+		pitch2text = spoff.pitch2text
+		for pitch in pitches:
+			text2pitch(pitch2text(pitch))
+	return len(pitches), 'pitch', run
+
+def lessThanPitchWorkload(corpus):
+	melodic = pairs(corpus.pitches)
+	def run():
+		lessThanPitch = spoff.lessThanPitch
+		for source, dest in melodic:
+			lessThanPitch(source, dest)
+	return len(melodic), 'pair', run
+
+def lessThanTimeWorkload(corpus):
+	successive = pairs(corpus.onsets)
+	def run():
+		lessThanTime = spoff.lessThanTime
+		for t1, t2 in successive:
+			lessThanTime(t1, t2)
+	return len(successive), 'pair', run
+
+def timedIntervalsWorkload(corpus):
+	# intervals.sql: the vertical intervals between the two parts of each work
+	works = [corpus.parts[i:i + 2] for i in range(0, len(corpus.parts), 2)] * corpus.copies
+	def run():
+		for top, bottom in works:
+			for row in spoff.timedIntervals(bottom, top):
+				pass
+	return corpus.notes(), 'note', run
+
+def buildDocumentWorkload(corpus):
+	def run():
+		for work_id in corpus.work_ids:
+			spoff.buildDocument(corpus.plpy, [work_id])
+	return corpus.notes(), 'note', run
+
+def doc2lilypondWorkload(corpus):
+	# rendering from scratch: without the fragment cache, every run after
+	# the first would come from it
+	def run():
+		cacheSize = spoff.setFragmentCacheSize(0)
+		try:
+			for work_id in corpus.work_ids:
+				spoff.doc2lilypond(spoff.buildDocument(corpus.plpy, [work_id]), corpus.plpy)
+		finally:
+			spoff.setFragmentCacheSize(cacheSize)
+	return corpus.notes(), 'note', run
+
+WORKLOADS = [
+	('getInterval', getIntervalWorkload),
+	('text2pitch/pitch2text', pitchTextWorkload),
+	('lessThanPitch', lessThanPitchWorkload),
+	('lessThanTime', lessThanTimeWorkload),
+	('timedIntervals', timedIntervalsWorkload),
+	('buildDocument', buildDocumentWorkload),
+	('doc2lilypond', doc2lilypondWorkload),
+]
+
+def timeWorkload(workload, corpus, repeats):
+	"""Best of repeats runs: (items, unit, seconds)"""
+	items, unit, run = workload(corpus)
+	best = None
+	for repeat in range(repeats):
+		start = time.time()
+		run()
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return items, unit, best
+
+def environment():
+	return {'python': platform.python_version(), 'machine': platform.machine(),
+	        'platform': platform.platform()}
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	parser.add_argument('--scales', default='1,10,100',
+	                    help='comma separated numbers of copies of the corpus')
+	parser.add_argument('--workloads', default=None,
+	                    help='comma separated workload names (default all)')
+	parser.add_argument('--baseline', default=BASELINE)
+	parser.add_argument('--save', action='store_true',
+	                    help='store the results as the baseline')
+	parser.add_argument('--tolerance', type=float, default=0.25,
+	                    help='fractional slowdown reported as a regression')
+	options = parser.parse_args(argv)
+
+	scales = [int(scale) for scale in options.scales.split(',')]
+	workloads = WORKLOADS
+	if options.workloads:
+		names = options.workloads.split(',')
+		workloads = [(name, workload) for (name, workload) in WORKLOADS if name in names]
+
+	baseline = {}
+	if not options.save and os.path.exists(options.baseline):
+		with open(options.baseline) as f:
+			baseline = json.load(f)
+		if baseline.get('environment') != environment():
+			print('note: the baseline was recorded on %s' % baseline.get('environment'))
+	baselineResults = baseline.get('results', {})
+
+	data = loadDump(tables=['score_notes', 'note_groups', 'note_groups__score_notes'])
+	results = {}
+	regressions = []
+	print('%-22s %6s %9s %10s %15s %12s %7s' % (
+		'workload', 'scale', 'items', 'seconds', 'us per item', 'baseline', 'ratio'))
+	for scale in scales:
+		corpus = Corpus(data, scale)
+		repeats = 3 if scale < 100 else 1
+		for name, workload in workloads:
+			items, unit, seconds = timeWorkload(workload, corpus, repeats)
+			perItem = seconds / items * 1e6
+			results.setdefault(name, {})[str(scale)] = perItem
+			reference = baselineResults.get(name, {}).get(str(scale))
+			if reference:
+				ratio = perItem / reference
+				flag = ''
+				if ratio > 1 + options.tolerance:
+					flag = ' REGRESSION'
+					regressions.append((name, scale))
+				comparison = '%12.3f %7.2f%s' % (reference, ratio, flag)
+			else:
+				comparison = '%12s %7s' % ('-', '-')
+			print('%-22s %5dx %9d %10.3f %9.3f %-5s %s' % (
+				name, scale, items, seconds, perItem, unit, comparison))
+			sys.stdout.flush()
+
+	if options.save:
+		with open(options.baseline, 'w') as f:
+			json.dump({'environment': environment(), 'results': results}, f,
+			          indent=1, sort_keys=True, separators=(',', ': '))
+			f.write('\n')
+		print('baseline saved to %s' % options.baseline)
+	if regressions:
+		print('%d regression(s): %s' % (len(regressions),
+			', '.join('%s at %dx' % r for r in regressions)))
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,4 +1,4 @@
-select populateDocument('inv', score_notes) from score_notes where work_id = :workID ;
+select build_document('inv', array[:workID]);
 
 begin;
   create temp table bi as (
@@ -6,63 +6,21 @@ begin;
            top.note_id,
            top.voice,
            top.part_id,
-           getinterval(top.pitch, bottom.pitch) as value
-        from score_notes as top
+           row(ti.value, 1, ti.octave)::spoff_interval as value
+        from spoff_timed_interval(:workID, 'XPart 1', 'XPart 0') as ti
+               inner join score_notes as top
+               on (top.work_id = ti.source_work_id and top.note_id = ti.source_note_id)
                inner join score_notes as bottom
-               on (
-                 bottom.work_id = top.work_id
-                   and bottom.part_id = 'XPart 0'
-                   and bottom.type = 'pitch'
-                   and (
-                     bottom.onset = top.onset
-                     or (bottom.onset < top.onset and bottom.onset + bottom.duration > top.onset)
-                   )
-               )
-    where top.part_id = 'XPart 1'
-          and top.type = 'pitch'
-          and top.work_id = :workID
+               on (bottom.work_id = ti.dest_work_id and bottom.note_id = ti.dest_note_id)
+    where bottom.onset <= top.onset
     order by top.onset, bottom.onset
   )
   ;
 
-  select addtextundernotes('inv',
-                           'intervs',
-                           cast (
-                                  ( bi.work_id,
-                                    bi.note_id,
-                                    bi.voice,
-                                    bi.part_id,
-                                    E' \\with-color #red ' || interval2text(bi.value)
-                                  ) as spoff_text_type
-                                )
-                           )
+  select addintervalclassesundernotes('inv', 'intervs', 'consonance',
+                                      bi.work_id, bi.note_id, bi.voice, bi.part_id, bi.value)
       from bi
-  where not (equateIntervalType(bi.value, text2interval('M3'))
-             or equateIntervalType(bi.value, text2interval('m3'))
-             or equateIntervalType(bi.value, text2interval('M6'))
-             or equateIntervalType(bi.value, text2interval('m6'))
-             or equateIntervalType(bi.value, text2interval('P5'))
-             or equateIntervalType(bi.value, text2interval('P1')))
-  ;
-
-  select addtextundernotes('inv',
-                           'intervs',
-                           cast(
-                                 ( bi.work_id,
-                                   bi.note_id,
-                                   bi.voice,
-                                   bi.part_id,
-                                   interval2text(bi.value)
-                                 ) as spoff_text_type
-                               )
-                          )
-      from bi
-  where equateIntervalType(bi.value, text2interval('M3'))
-             or equateIntervalType(bi.value, text2interval('m3'))
-             or equateIntervalType(bi.value, text2interval('M6'))
-             or equateIntervalType(bi.value, text2interval('m6'))
-             or equateIntervalType(bi.value, text2interval('P5'))
-             or equateIntervalType(bi.value, text2interval('P1'))
+    where bi.value is not null
   ;
 
   drop table bi;
@@ -74,62 +32,20 @@ begin;
            bottom.note_id,
            bottom.voice,
            bottom.part_id,
-           getinterval(top.pitch, bottom.pitch) as value
-         from score_notes as top
+           row(ti.value, 1, ti.octave)::spoff_interval as value
+         from spoff_timed_interval(:workID, 'XPart 1', 'XPart 0') as ti
+                inner join score_notes as top
+                on (top.work_id = ti.source_work_id and top.note_id = ti.source_note_id)
                 inner join score_notes as bottom
-                on (
-                  bottom.work_id = top.work_id
-                    and bottom.part_id = 'XPart 0'
-                    and bottom.type = 'pitch'
-                    and (
-                      bottom.onset >= top.onset 
-                        and bottom.onset < top.onset + top.duration
-                    )
-                )
-    where top.part_id = 'XPart 1'
-          and top.type = 'pitch'
-          and top.work_id = :workID
+                on (bottom.work_id = ti.dest_work_id and bottom.note_id = ti.dest_note_id)
+    where bottom.onset >= top.onset
     order by top.onset, bottom.onset
   );
 
-  select addtextundernotes('inv',
-                           'intervs',
-                           cast (
-                                  ( bi.work_id,
-                                    bi.note_id,
-                                    bi.voice,
-                                    bi.part_id,
-                                    E' \\with-color #red ' || interval2text(bi.value)
-                                   ) as spoff_text_type
-                                )
-                           )
-      from bi
-    where not (equateIntervalType(bi.value, text2interval('M3'))
-             or equateIntervalType(bi.value, text2interval('m3'))
-             or equateIntervalType(bi.value, text2interval('M6'))
-             or equateIntervalType(bi.value, text2interval('m6'))
-             or equateIntervalType(bi.value, text2interval('P5'))
-             or equateIntervalType(bi.value, text2interval('P1')))
-  ;
-
-  select addtextundernotes('inv',
-                           'intervs',
-                           cast (
-                                  ( bi.work_id,
-                                    bi.note_id,
-                                    bi.voice,
-                                    bi.part_id,
-                                    interval2text(bi.value)
-                                  ) as spoff_text_type
-                                )
-                          )
+  select addintervalclassesundernotes('inv', 'intervs', 'consonance',
+                                      bi.work_id, bi.note_id, bi.voice, bi.part_id, bi.value)
       from bi
-    where equateIntervalType(bi.value, text2interval('M3'))
-             or equateIntervalType(bi.value, text2interval('m3'))
-             or equateIntervalType(bi.value, text2interval('M6'))
-             or equateIntervalType(bi.value, text2interval('m6'))
-             or equateIntervalType(bi.value, text2interval('P5'))
-             or equateIntervalType(bi.value, text2interval('P1'))
+    where bi.value is not null
   ;
 
   drop table bi;
@@ -4,5 +4,5 @@ setup(	name='spoff',
 	description='A pure-python module providing utility functions for the Spiral of Fifths (spoff) Database',
 	author='Stuart Pullinger',
 	author_email='s.pullinger@elec.gla.ac.uk',
-	py_modules=['spoff'],
+	packages=['spoff'],
 	)
@@ -0,0 +1,2772 @@
+#!/usr/bin/python
+
+"""A Module to Represent Musical Information based on the Spiral of Fifths
+
+http://theses.gla.ac.uk/2133/
+
+This module supplies the primitive functions operating on
+time and pitch in Spoff format. For a full discussion of the
+method chose for the representation of musical time and pitch,
+refer to the doctoral thesis refered to above.
+
+Pitch is represented as a 3-tuple p :: (k, z, o) where
+k is the pitch in spiral-of-fifths representation and o is the
+octave number (4 being the octave beginning on Middle C).
+z is the number of chromatic steps within a minor second,
+which permits representation of scales such as 24-ET which
+is compound of two diatonic scales, being the superposition
+of two 12-ET scales, one offset by one half of a 12-ET semitone.
+For standard 12-ET, z is always 1. For 24-ET it would be 2
+(a consequence arising from there being two 12-ET scales
+overlapped).
+
+The Spoff pitch k of a note is determined by its position around
+the circle of fifths using the basis C=1, and can be read off
+from the following table.
+
+			bb	b	N	#	x
+		+------------------------------------------
+	F	|	-14	-7	0	7	14
+	C	|	-13	-6	1	8	15
+	G	|	-12	-5	2	9	16
+	D	|	-11	-4	3	10	17
+	A	|	-10	-3	4	11	18
+	E	|	-9	-2	5	12	19
+	B	|	-8	-1	6	13	20
+
+The python code represents a pitch as a SpoffPitch, a compact immutable
+tuple which can also be indexed like a dictionary with the following keys:
+
+	pitch:                spoff pitch
+	divisions_per_octave: number of steps in a semitone
+	                      Currently, on 1 is supported; other scales
+	                      such as 24-ET which divide a semitone may require
+	                      other values
+	octave:               octave number (octave 4 contains middle C)
+
+Intervals are also represented as a number of steps around the circle of
+fifths. Spoff intervals are represented as a 3-tuple i :: (i, z, o)
+where z and o have the meanings defined above and i is assigned
+as shown in the table below:
+
+			-14	-7	0	7	14
+		+------------------------------------------
+	0	|	dd1	d1	P1	A1	AA1
+	1	|	dd5	d5	P5	A5	AA5
+	2	|	d2	m2	M2	A2	AA2
+	3	|	d6	m6	M6	A6	AA6
+	4	|	d3	m3	M3	A3	AA3
+	5	|	d7	m7	M7	A7	AA7
+	6	|	d4	P4	a4	AA4	AAA4
+	
+	d = diminished; m = minor; P = perfect; M = major; A = augmented
+	dd = doubly diminished; AAA = tripply augmented etc.
+
+We also maintain the concept of "interval class", so perfect, diminished
+or augmented 4ths all belong to interval class 4 (as does anything with
+a 4 in the name).
+
+This does regrettably give rise to an asymmetry between the conversion
+between textual representation and spoff interval. When comparing interval
+sizes, the interval class as printed can be obtained from the spoff
+interval thus:
+
+	pitchClass = intervalListP4.index(i['interval'] % 7)
+
+The modulo operator effectively removes any specifier such as "minor",
+"augmented" etc from the spoff interval. Since in Python, the result of
+the modulus operator is always positive, the list intervalListP4 is
+supplied with the value of 6 given for a fourth, because the augmented
+fourth appears before any other sort when moving upwards around the
+circle of fifths. The lies intervalList is similar but contains a -1
+at the postion of a 4th (corresponding to a P4). In both cases, 0 is
+prepended in order that the list's index method contains 1 for a
+unison (rather than 0) to preserve the sanity of the developer.
+
+The python code represents an interval as a SpoffInterval, which can also be
+indexed like a dictionary with the following keys:
+
+	interval:             spoff interval
+	divisions_per_octave: number of steps in a semitone
+	                      Currently, on 1 is supported; other scales
+	                      such as 24-ET which divide a semitone may require
+	                      other values
+	octave:               octave number (octave 4 contains middle C)
+
+
+Time is represented in spoff as an improper fraction of a crotchet (quarter-note)
+t :: (n,d) (where n is the numerator and d the denominator). The python
+code represents a time as a SpoffScoreTime, which can also be indexed like
+a dictionary with the following keys:
+
+	crotchet_numerator:   numerator of time measured in crotchets
+	crotchet_denominator: denominator of time measured in crotchets
+
+Duration is represented as a dictionary with the following keys:
+
+	bar:                  number of bars
+	beat:                 number of beats additional to the above
+	division:             number of subdivision of a beat additional to above
+	                      (the default number of beat subdivisions is 8,
+	                      allowing for demisemiquavers)
+
+All of the primitive functions accept either the compact types or the
+dictionaries which plpythonu passes for composite values, so the SQL
+wrappers need not convert their arguments. asPitch(), asInterval() and
+asScoreTime() perform the conversion explicitly. The compact types are
+tuples in the column order of the corresponding Postgresql types, so they
+may be returned directly from plpythonu functions. Arithmetic on them is
+done on plain integers when divisions_per_semitone is 1, which is the
+case for all 12-ET material.
+
+
+Module data:
+
+naturals:		Dictionary to convert from pitch class name to spoff code
+pitch_order:	List convertion from spoff to ordinal pitch (C=0)
+intervalList:	List to convert from spoff interval to interval class
+intervalListP4:	List to convert from spoff interval to interval class mod 7 (see above)
+majorScale:     A list of intervals forming a one-octave major scale
+minorScale:     A list of intervals forming a one-octave harmonic minor scale
+"""
+from fractions import Fraction
+from functools import partial, wraps
+from itertools import count
+from collections import deque
+try:
+	from collections.abc import Mapping, MutableMapping
+except ImportError:
+	from collections import Mapping, MutableMapping
+import re
+import math
+import hashlib
+import marshal
+try:
+	from time import perf_counter as _clock
+except ImportError:
+	from time import time as _clock
+
+##################################
+# Tracing
+##################################
+
+# Trace levels: nothing is recorded by default; TRACE_TIMING accumulates
+# the time spent in each phase of rendering, per work, part and voice;
+# TRACE_VOICES also logs a message per voice and TRACE_NOTES one per note.
+TRACE_OFF = 0
+TRACE_TIMING = 1
+TRACE_VOICES = 2
+TRACE_NOTES = 3
+TRACE_LOG_SIZE = 10000	# the oldest messages are dropped beyond this
+
+traceLevel = TRACE_OFF
+_traceTimings = {}
+_traceLog = deque(maxlen=TRACE_LOG_SIZE)
+
+def setTraceLevel(level):
+	"""Set the trace level and return the previous one"""
+	global traceLevel
+	previous = traceLevel
+	traceLevel = level
+	return previous
+
+def resetTrace():
+	"""Discard the recorded timings and messages"""
+	_traceTimings.clear()
+	_traceLog.clear()
+
+def trace(level, message, *args):
+	"""Log message % args if the trace level is at least level
+
+	The message is only formatted if it is logged. Callers in loops should
+	test traceLevel themselves, so that tracing costs nothing when off.
+
+	>>> previous = setTraceLevel(TRACE_VOICES)
+	>>> trace(TRACE_VOICES, 'voice %d', 1); trace(TRACE_NOTES, 'note %d', 2)
+	>>> traceMessages()
+	['voice 1']
+	>>> resetTrace(); previous = setTraceLevel(previous)
+	"""
+	if traceLevel >= level:
+		_traceLog.append(message % args if args else message)
+
+def _traceTime(phase, work_id, part_id, voice, start):
+	# add the time since start to the phase's total
+	elapsed = _clock() - start
+	entry = _traceTimings.get((phase, work_id, part_id, voice))
+	if entry is None:
+		_traceTimings[(phase, work_id, part_id, voice)] = [1, elapsed]
+	else:
+		entry[0] += 1
+		entry[1] += elapsed
+
+def traceSummary():
+	"""Return the timings recorded since the last resetTrace()
+
+	Returns a list of dictionaries with keys phase, work_id, part_id,
+	voice, calls and seconds, one for each phase of each work, part and
+	voice (None where the phase covers the whole document).
+	"""
+	return [{'phase': phase, 'work_id': work_id, 'part_id': part_id, 'voice': voice,
+		'calls': calls, 'seconds': seconds}
+		for ((phase, work_id, part_id, voice), (calls, seconds))
+		in sorted(_traceTimings.items(), key=_traceOrder)]
+
+def _traceOrder(item):
+	# by work, part and voice (None first), then phase
+	phase, work_id, part_id, voice = item[0]
+	return (work_id is not None, work_id, part_id is not None, part_id,
+		voice is not None, voice, phase)
+
+def traceMessages():
+	"""Return the logged trace messages, oldest first"""
+	return list(_traceLog)
+
+##################################
+# Compact value types
+##################################
+
+class _SpoffValue(tuple):
+	"""Base class for the compact spoff value types.
+
+	Values are tuples laid out in the column order of the Postgresql
+	composite type, so plpythonu can return them directly. Indexing with
+	a field name behaves like the dictionaries plpythonu passes in.
+	"""
+	__slots__ = ()
+	_fields = ()
+
+	def __getitem__(self, key):
+		if isinstance(key, str):
+			try:
+				key = self._fields.index(key)
+			except ValueError:
+				raise KeyError(key)
+		return tuple.__getitem__(self, key)
+
+	def __getnewargs__(self):
+		return tuple(self)
+
+	def __repr__(self):
+		return '%s(%s)' % (self.__class__.__name__,
+			', '.join(['%s=%r' % item for item in zip(self._fields, self)]))
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def keys(self):
+		return list(self._fields)
+
+	def asdict(self):
+		return dict(zip(self._fields, self))
+
+	copy = asdict
+
+class SpoffPitch(_SpoffValue):
+	"""A spoff pitch (pitch, divisions_per_semitone, octave)
+
+	>>> p = SpoffPitch(8, 1, 4)
+	>>> p['pitch'], p.octave, p == (8, 1, 4)
+	(8, 4, True)
+	"""
+	__slots__ = ()
+	_fields = ('pitch', 'divisions_per_semitone', 'octave')
+
+	def __new__(cls, pitch, divisions_per_semitone, octave):
+		return tuple.__new__(cls, (pitch, divisions_per_semitone, octave))
+
+	pitch = property(lambda self: tuple.__getitem__(self, 0))
+	divisions_per_semitone = property(lambda self: tuple.__getitem__(self, 1))
+	octave = property(lambda self: tuple.__getitem__(self, 2))
+
+class SpoffInterval(_SpoffValue):
+	"""A spoff interval (interval, divisions_per_semitone, octave)"""
+	__slots__ = ()
+	_fields = ('interval', 'divisions_per_semitone', 'octave')
+
+	def __new__(cls, interval, divisions_per_semitone, octave):
+		return tuple.__new__(cls, (interval, divisions_per_semitone, octave))
+
+	interval = property(lambda self: tuple.__getitem__(self, 0))
+	divisions_per_semitone = property(lambda self: tuple.__getitem__(self, 1))
+	octave = property(lambda self: tuple.__getitem__(self, 2))
+
+class SpoffScoreTime(_SpoffValue):
+	"""A spoff score time (crotchet_numerator, crotchet_denominator)"""
+	__slots__ = ()
+	_fields = ('crotchet_numerator', 'crotchet_denominator')
+
+	def __new__(cls, crotchet_numerator, crotchet_denominator):
+		return tuple.__new__(cls, (crotchet_numerator, crotchet_denominator))
+
+	crotchet_numerator = property(lambda self: tuple.__getitem__(self, 0))
+	crotchet_denominator = property(lambda self: tuple.__getitem__(self, 1))
+
+##################################
+# Adapters from plpythonu values
+##################################
+
+def lruCache(maxsize=1024):
+	"""Decorator memoizing a function, keeping the most recently used results
+
+	For Python 2, which has no functools.lru_cache. Each result is stamped
+	when it is used; when maxsize results are held, the least recently
+	used quarter are dropped together, which keeps a cache hit down to a
+	dictionary lookup and a list assignment. Calls with unhashable
+	arguments (e.g. plpythonu dictionaries) are passed straight through.
+
+	>>> @lruCache(4)
+	... def square(x):
+	...   return x * x
+	>>> [square(x) for x in (1, 2, 3, 4, 1, 5)], sorted(square.cache)
+	([1, 4, 9, 16, 1, 25], [(1,), (3,), (4,), (5,)])
+	"""
+	def decorate(function):
+		cache = {}
+		clock = count()
+		@wraps(function)
+		def cached(*args):
+			try:
+				entry = cache[args]
+			except KeyError:
+				if len(cache) >= maxsize:
+					stale = sorted(cache.items(), key=lambda item: item[1][1])
+					for key, value in stale[:max(1, maxsize // 4)]:
+						del cache[key]
+				entry = cache[args] = [function(*args), 0]
+			except TypeError:
+				return function(*args)
+			entry[1] = next(clock)
+			return entry[0]
+		cached.cache = cache
+		return cached
+	return decorate
+
+@lruCache(4096)
+def _parseComposite(text):
+	# '(13,4)' -> (13, 4); NULL fields, as in a rest's '(,1,)', are None
+	return tuple([int(field) if field != '' else None for field in text[1:-1].split(',')])
+
+@lruCache(4096)
+def _parseIntArray(text):
+	# '{22,85,1}' -> [22, 85, 1]; NULL elements are None
+	text = text[1:-1]
+	if not text:
+		return ()
+	return tuple([int(element) if element != 'NULL' else None for element in text.split(',')])
+
+# Older versions of plpythonu pass composite values nested in rows and
+# query results, and arrays, as their text representation; newer ones
+# pass dictionaries and lists. The adapters below accept any of these,
+# and the compact types themselves, so that values can be converted
+# once when they enter Python (see documentFromRows()).
+
+def asPitch(value):
+	"""Return value (a SpoffPitch, dictionary, sequence or text) as a SpoffPitch
+
+	The pitch of a rest (e.g. '(,1,)') is None.
+
+	>>> asPitch({'pitch': 3, 'divisions_per_semitone': 1, 'octave': 5})
+	SpoffPitch(pitch=3, divisions_per_semitone=1, octave=5)
+	>>> asPitch('(1,1,3)'), asPitch('(,1,)')
+	(SpoffPitch(pitch=1, divisions_per_semitone=1, octave=3), None)
+	"""
+	if value.__class__ is SpoffPitch or value is None:
+		return value
+	if value.__class__ is str:
+		value = _parseComposite(value)
+		if None in value:
+			return None
+		return _newPitch(value)
+	if isinstance(value, dict):
+		if value['pitch'] is None or value['octave'] is None:
+			return None
+		return SpoffPitch(value['pitch'], value['divisions_per_semitone'], value['octave'])
+	return SpoffPitch(*value)
+
+def asInterval(value):
+	"""Return value (a SpoffInterval, dictionary, sequence or text) as a SpoffInterval"""
+	if value.__class__ is SpoffInterval or value is None:
+		return value
+	if value.__class__ is str:
+		return _newInterval(_parseComposite(value))
+	if isinstance(value, dict):
+		return SpoffInterval(value['interval'], value['divisions_per_semitone'], value['octave'])
+	return SpoffInterval(*value)
+
+def asScoreTime(value):
+	"""Return value (a SpoffScoreTime, dictionary, sequence or text) as a SpoffScoreTime
+
+	>>> asScoreTime('(13,4)')
+	SpoffScoreTime(crotchet_numerator=13, crotchet_denominator=4)
+	"""
+	if value.__class__ is SpoffScoreTime or value is None:
+		return value
+	if value.__class__ is str:
+		return _newScoreTime(_parseComposite(value))
+	if isinstance(value, dict):
+		return SpoffScoreTime(value['crotchet_numerator'], value['crotchet_denominator'])
+	return SpoffScoreTime(*value)
+
+def asIntArray(value):
+	"""Return an integer[] value (a list or text) as a new list of integers
+
+	>>> asIntArray('{22,85,1}'), asIntArray('{}'), asIntArray((2, 3))
+	([22, 85, 1], [], [2, 3])
+	"""
+	if value is None:
+		return None
+	if value.__class__ is str:
+		return list(_parseIntArray(value))
+	return list(value)
+
+# Internal shortcuts: build the compact types without going through
+# __new__, and unpack a plpythonu dictionary, compact type or other
+# sequence into its fields without building anything
+_newPitch = partial(tuple.__new__, SpoffPitch)
+_newInterval = partial(tuple.__new__, SpoffInterval)
+_newScoreTime = partial(tuple.__new__, SpoffScoreTime)
+
+def _pitchFields(value):
+	if value.__class__ is dict:
+		return value['pitch'], value['divisions_per_semitone'], value['octave']
+	return value
+
+def _intervalFields(value):
+	if value.__class__ is dict:
+		return value['interval'], value['divisions_per_semitone'], value['octave']
+	return value
+
+def _scoreTimeFields(value):
+	if value.__class__ is dict:
+		return value['crotchet_numerator'], value['crotchet_denominator']
+	return value
+
+def _addSteps(n1, d1, n2, d2):
+	# (n1/d1) + (n2/d2) as a (numerator, denominator) pair in lowest terms.
+	# Only falls back on Fraction when a semitone is subdivided.
+	if d1 == 1 and d2 == 1:
+		return n1 + n2, 1
+	total = Fraction(n1, d1) + Fraction(n2, d2)
+	return total.numerator, total.denominator
+
+##################################
+# Spiral of fifths (spoff) pitch representation functions
+##################################
+
+###################################
+#
+#	bb	b	N	#	x
+#F	-14	-7	0	7	14
+#C	-13	-6	1	8	15
+#G	-12	-5	2	9	16
+#D	-11	-4	3	10	17
+#A	-10	-3	4	11	18
+#E	-9	-2	5	12	19
+#B	-8	-1	6	13	20
+#
+#####################################
+
+
+naturals = {'F':0, 'C':1, 'G':2, 'D':3, 'A':4, 'E':5, 'B':6}
+pitch_order = [3, 0, 4, 1, 5, 2, 6]
+
+#####################################
+# 
+#	-14	-7	0	7	14
+#0		d1	1st	a1	
+#1		d5	P5	a5	
+#2	d2	m2	M2	a2	
+#3	d6	m6	M6	a6	
+#4	d3	m3	M3	a3	
+#5	d7	m7	M7	a7	
+#6	d4	P4	a4		
+#
+#####################################
+
+intervalList = [None, 0, 2, 4, -1, 1, 3, 5]
+intervalListP4 = [None, 0, 2, 4, 6, 1, 3, 5]
+# intervalListP4.index() for each spoff interval % 7
+_intervalClassP4 = tuple([intervalListP4.index(i) for i in range(7)])
+
+majorScale = [	SpoffInterval(2, 1, 0),
+		SpoffInterval(2, 1, 0),
+		SpoffInterval(-5, 1, 0),
+		SpoffInterval(2, 1, 0),
+		SpoffInterval(2, 1, 0),
+		SpoffInterval(2, 1, 0),
+		SpoffInterval(-5, 1, 0) ]
+
+minorScale = majorScale[5:] + majorScale[0:5]		#harmonic minor
+#minorScale = harmonicMinorScale[0:6] + [{'interval': 7, 'divisions_per_octave': 1, 'octave': 0}], [{'interval': -5, 'divisions_per_octave': 1, 'octave': 0}],
+
+# The pitch classes of each mode as offsets from the keynote along the
+# spiral of fifths: each diatonic mode is seven successive fifths, and
+# the harmonic and melodic minors raise the seventh (-2) to +5. 'M' and
+# 'm' are the scales of scale(), major and (its minorScale) aeolian.
+keyModes = {
+	'ionian': (-1, 0, 1, 2, 3, 4, 5),
+	'dorian': (-3, -2, -1, 0, 1, 2, 3),
+	'phrygian': (-5, -4, -3, -2, -1, 0, 1),
+	'lydian': (0, 1, 2, 3, 4, 5, 6),
+	'mixolydian': (-2, -1, 0, 1, 2, 3, 4),
+	'aeolian': (-4, -3, -2, -1, 0, 1, 2),
+	'locrian': (-6, -5, -4, -3, -2, -1, 0),
+	'harmonic minor': (-4, -3, -1, 0, 1, 2, 5),
+	'melodic minor': (-3, -1, 0, 1, 2, 3, 5),
+}
+keyModes['M'] = keyModes['ionian']
+keyModes['m'] = keyModes['aeolian']
+
+##
+# TODO Create functions to correctly map PG types onto python types eg. spoff_pitch
+# 	see psycopg2.extensions.cursor new_type(val, cur) function
+##
+
+def musicxml2spoff(step, alter):
+	if step == None:
+		return None
+	elif step == 'NULL':
+		return 'NULL'
+	else:
+		return naturals[step] + (7*alter)
+
+def python2sqlstring(py_var):
+	if isinstance(py_var, types.StringTypes):
+		return '\''+py_var+'\''
+	elif py_var==None:
+		return 'NULL'
+	elif isinstance(py_var, list):
+		return ' \'{ ' + ', '.join([python2sqlstring(item) for item in py_var]) + ' }\' '
+	else:
+		return str(py_var)
+	#TODO more types here; recurse for list etc types
+
+def clefSign2Number(clefSign):
+	return ['F', 'C', 'G', 'percussion', 'TAB', 'none'].index(clefSign)
+
+#def spoff2freq(spoff_pitch, divisions_per_octave = 12, temperament = 'equal', a_below_middle_c = 440):
+	#what octave is A440?
+	#calc low c for spoff_pitch['octave']
+	#calc size of semitone: oct/dpo
+	#calc pitch class ie from pitch chapter ( % 7z)
+	#We assume a diatonic scale MMmMMMm and equal temperament
+	#therefore M2 = 2 x m2
+	#therefore we can work out how many semitones from the low-c to the pitch class
+	#add or subtract number of semitones ( / 7z) - see pitch chapter
+	#return freq
+
+def addInterval(note, interval):
+	"""Return the spoff pitch obtained by raising note by interval.
+
+	>>> [ pitch2text(addInterval(text2pitch(n), text2interval(i))) 
+	...   for (n,i) in
+	...     [('G4','M3'), ('F#3','m3'), ('Bb4','dd6'), ('B4','A1'), ('B4','AA1'), ('B4','d2')]
+	... ]
+	['B4', 'A3', 'Gbbb5', 'B#4', 'B##4', 'Cb5']
+	"""
+	pitch, dps, octave = note = _pitchFields(note)
+	step, stepDps, stepOctave = _intervalFields(interval)
+	newPitch, newDps = _addSteps(pitch, dps, step, stepDps)
+	newOctave = octave + stepOctave
+	# The lines above don't account for when the interval takes us
+	# over the octave boundary. Need to add an extra octave if the
+	# interval between the note and the C above is less than or equal
+	# to the supplied argument
+	nextC = (1, dps, octave + 1)	# a C in the octave above
+	if _intervalClassP4[getInterval(note, nextC)[0] % 7] <= _intervalClassP4[step % 7]:
+		#we have wrapped around
+		newOctave += 1
+	return _newPitch((newPitch, newDps, newOctave))
+	
+
+def getInterval(source_pitch, dest_pitch):
+	"""Calculate the interval between two notes
+	
+	The source and destination pitches are in spoff format.
+	Intervals are always calculated upwards from the lowest note.
+	
+	>>> # Source pitch a little below dest_pitch
+	>>> interval2text(getInterval(text2pitch('Eb4'), text2pitch('F#4')))
+	'0+A2'
+	>>> # Source a long way below destination
+	>>> interval2text(getInterval(text2pitch('G2'), text2pitch('D6')))
+	'3+P5'
+	>>> # Source a little above destination
+	>>> interval2text(getInterval(text2pitch('D5'), text2pitch('B4')))
+	'0+m3'
+	>>> # Source a long way above destination
+	>>> interval2text(getInterval(text2pitch('F#4'), text2pitch('C1')))
+	'3+A4'
+	>>> # Exotic (silly questions should produce silly, but correct answers)
+	>>> interval2text(getInterval(text2pitch('B##4'), text2pitch('Cbbb5')))
+	'0+dddddd2'
+	"""
+	if (source_pitch==None) or (dest_pitch==None):
+		return None
+	sourcePitch, sourceDps, sourceOctave = _pitchFields(source_pitch)
+	destPitch, destDps, destOctave = _pitchFields(dest_pitch)
+	#take account of octaves: compare the notes as if in the same octave
+	sourceKey = _pitchClassKey(sourcePitch)
+	destKey = _pitchClassKey(destPitch)
+	if sourceKey == destKey and sourcePitch != destPitch:
+		return None
+	order = (sourceKey > destKey) - (sourceKey < destKey)
+	if sourceOctave < destOctave:
+		interval, dps = _addSteps(destPitch, destDps, -sourcePitch, sourceDps)
+		octave = destOctave - sourceOctave
+		if order > 0:
+			octave -= 1
+		return _newInterval((interval, dps, octave))
+	elif sourceOctave > destOctave:
+		#dest is lower
+		interval, dps = _addSteps(sourcePitch, sourceDps, -destPitch, destDps)
+		octave = sourceOctave - destOctave
+		if order < 0:
+			octave -= 1
+		return _newInterval((interval, dps, octave))
+	elif order < 0:
+		#in same octave, source_pitch is lower
+		interval, dps = _addSteps(destPitch, destDps, -sourcePitch, sourceDps)
+		return _newInterval((interval, dps, 0))
+	elif order > 0:
+		#in same octave, dest is lower
+		interval, dps = _addSteps(sourcePitch, sourceDps, -destPitch, destDps)
+		return _newInterval((interval, dps, 0))
+	else:
+		#unison
+		return _newInterval((0, 1, 0))
+
+def _pitchClassKey(pitch):
+	# Orders spoff pitches (notationally) within an octave: pitch classes
+	# by pitch_order and, within a pitch class, flatter pitches first
+	return 8 * pitch_order[pitch % 7] - pitch_order[pitch // 7]
+
+def _comparePitch(source_pitch, dest_pitch):
+	# -1, 0 or 1 as source_pitch is flatter than, level with or sharper
+	# than dest_pitch
+	sourcePitch, sourceDps, sourceOctave = _pitchFields(source_pitch)
+	destPitch, destDps, destOctave = _pitchFields(dest_pitch)
+	if sourceOctave != destOctave:
+		return -1 if sourceOctave < destOctave else 1
+	sourceKey = _pitchClassKey(sourcePitch)
+	destKey = _pitchClassKey(destPitch)
+	return (sourceKey > destKey) - (sourceKey < destKey)
+
+# pitchKey() of a rest, which sorts below every pitch
+REST_PITCH_KEY = -2**31
+
+def pitchKey(pitch):
+	"""Return an integer which sorts and compares like the spoff pitch
+
+	Matches spoff_pitch_key() in sql/sort_keys.sql. Keys compare as
+	lessThanPitch(), greaterThanPitch() and equatePitch() do, so notes
+	can be sorted by pitch without calling them. Rests (a pitch of None)
+	get REST_PITCH_KEY.
+
+	>>> sorted(['C5', 'Cb5', 'B4', 'C4', 'Bb3'], key=lambda n: pitchKey(text2pitch(n)))
+	['Bb3', 'C4', 'B4', 'Cb5', 'C5']
+	"""
+	pitch, dps, octave = _pitchFields(pitch)
+	if pitch is None or octave is None:
+		return REST_PITCH_KEY
+	return 64 * octave + _pitchClassKey(pitch)
+
+
+def getIntervals(source_pitch, source_dps, source_octave, dest_pitch, dest_dps, dest_octave):
+	"""Calculate the intervals between two aligned sequences of notes
+
+	The same as calling getInterval() on each pair of notes in turn, but
+	on NumPy arrays of the pitch, divisions_per_semitone and octave
+	fields. Returns masked arrays of interval, divisions_per_semitone and
+	octave; elements for which getInterval() would return None (including
+	rests, which should be masked in the arguments) are masked.
+
+	>>> notes = [text2pitch(n) for n in ('Eb4', 'G2', 'D5', 'F#4')]
+	>>> above = [text2pitch(n) for n in ('F#4', 'D6', 'B4', 'C1')]
+	>>> intervals = getIntervals(*(pitches2arrays(notes) + pitches2arrays(above)))
+	>>> [interval2text(i) for i in arrays2intervals(*intervals)]
+	['0+A2', '3+P5', '0+m3', '3+A4']
+	"""
+	import numpy
+	arrays = [numpy.ma.asarray(a) for a in (source_pitch, source_dps, source_octave,
+	                                        dest_pitch, dest_dps, dest_octave)]
+	if len(set([a.shape for a in arrays])) != 1:
+		raise ValueError('getIntervals: note sequences are not aligned')
+	masked = numpy.zeros(arrays[0].shape, dtype=bool)
+	for a in arrays:
+		masked |= numpy.ma.getmaskarray(a)
+	sp, sd, so, dp, dd, do = [numpy.ma.filled(a, 1).astype(numpy.int64) for a in arrays]
+
+	order = numpy.array(pitch_order)
+	sourceKey = 8 * order[sp % 7] - order[sp // 7]
+	destKey = 8 * order[dp % 7] - order[dp // 7]
+	comparison = numpy.sign(sourceKey - destKey)
+	masked |= (comparison == 0) & (sp != dp)
+
+	# Intervals are always measured upwards from the lower note
+	sourceLower = (so < do) | ((so == do) & (comparison < 0))
+	upper = numpy.where(sourceLower, dp, sp)
+	upperDps = numpy.where(sourceLower, dd, sd)
+	lower = numpy.where(sourceLower, sp, dp)
+	lowerDps = numpy.where(sourceLower, sd, dd)
+	interval = upper * lowerDps - lower * upperDps
+	dps = upperDps * lowerDps
+	divisor = numpy.gcd(interval, dps)
+	interval //= divisor
+	dps //= divisor
+
+	octave = numpy.where(so < do, do - so - (comparison > 0),
+	                     numpy.where(so > do, so - do - (comparison < 0), 0))
+	unison = (so == do) & (comparison == 0)
+	interval[unison] = 0
+	dps[unison] = 1
+	return (numpy.ma.masked_array(interval, mask=masked),
+	        numpy.ma.masked_array(dps, mask=masked),
+	        numpy.ma.masked_array(octave, mask=masked.copy()))
+
+def pitches2arrays(pitches):
+	"""Return a sequence of pitches as masked arrays for getIntervals()
+
+	Rests (and None) are masked.
+	"""
+	import numpy
+	from itertools import chain
+	fields = [_pitchFields(p) if p is not None else (None, None, None) for p in pitches]
+	try:
+		data = numpy.fromiter(chain.from_iterable(fields), dtype=numpy.int64, count=3 * len(fields))
+		data = data.reshape(-1, 3)
+		rest = numpy.zeros(len(fields), dtype=bool)
+	except TypeError:
+		# there are rests among the notes
+		data = numpy.array([tuple(f) for f in fields], dtype=object).reshape(-1, 3)
+		rest = numpy.equal(data[:, 0], None) | numpy.equal(data[:, 2], None)
+		data[rest] = 0
+		data = data.astype(numpy.int64)
+	return tuple([numpy.ma.masked_array(data[:, column], mask=rest.copy()) for column in range(3)])
+
+def arrays2intervals(interval, dps, octave):
+	"""Return a list of SpoffIntervals (or None where masked) from arrays"""
+	import numpy
+	mask = numpy.ma.getmaskarray(interval)
+	return [None if m else _newInterval((int(i), int(d), int(o)))
+	        for (i, d, o, m) in zip(numpy.ma.getdata(interval), numpy.ma.getdata(dps),
+	                                numpy.ma.getdata(octave), mask)]
+
+
+#TODO fix this for higher dps
+def lessThanPitch(source_pitch, dest_pitch):
+	"""Return true if source_pitch is (notationally) flatter than dest_pitch
+	
+	Note that this might not correspond with the fundamental frequency of the
+	source being less than the fundamental frequency of the destination. That
+	depends on the temperament. Frequency and pitch are not the same!
+	
+	>>> # Test gross and same-octave differences
+	>>> [lessThanPitch(text2pitch(s),text2pitch(d)) for (s,d) in
+	...   [('A4','G2'), ('G1','A3'), ('D3','G3'), ('G3','D3')]
+	... ]
+	[False, True, True, False]
+	>>> # Enharmonic equivalences (not considered equal!)/crossing the octave
+	>>> [lessThanPitch(text2pitch(s),text2pitch(d)) for (s,d) in 
+	...   [('Ab4','G#4'), ('G#4','Ab4'), ('C4','B4'), ('B4','C4')]
+	... ]
+	[False, True, True, False]
+	>>> # Accidentals differing or not on the same note
+	>>> [lessThanPitch(text2pitch(s),text2pitch(d)) for (s,d) in 
+	...   [('Bb6','B6'), ('B6', 'Bb6'), ('G4','G4')]
+	... ]
+	[True, False, False]
+	"""
+	if (source_pitch==None) or (dest_pitch==None):
+		return None
+	return _comparePitch(source_pitch, dest_pitch) < 0
+
+
+#TODO fix this for higher dps
+def greaterThanPitch(source_pitch, dest_pitch):
+	"""Return true if source_pitch is (notationally) sharper than dest_pitch
+	
+	Note that this might not correspond with the fundamental frequency of the
+	source being less than the fundamental frequency of the destination. That
+	depends on the temperament. Frequency and pitch are not the same!
+	
+	>>> # Use same test cases as lessThanPitch().
+	>>> [greaterThanPitch(text2pitch(s),text2pitch(d)) for (s,d) in
+	...   [('A4','G2'), ('G1','A3'), ('D3','G3'), ('G3','D3')]
+	... ]
+	[True, False, False, True]
+	>>> [greaterThanPitch(text2pitch(s),text2pitch(d)) for (s,d) in 
+	...   [('Ab4','G#4'), ('G#4','Ab4'), ('C4','B4'), ('B4','C4')]
+	... ]
+	[True, False, False, True]
+	>>> [greaterThanPitch(text2pitch(s),text2pitch(d)) for (s,d) in 
+	...   [('Bb6','B6'), ('B6', 'Bb6'), ('G4','G4')]
+	... ]
+	[False, True, False]
+	"""
+#sp = 4,1,5	dp = 2,1,5
+	if (source_pitch==None) or (dest_pitch==None):
+		return None
+	return _comparePitch(source_pitch, dest_pitch) > 0
+
+
+#TODO change this to take account of divs per semitone
+def equatePitch(source_pitch, dest_pitch):
+	"""Return true if both arguments are the same pitch (including accidental)
+	
+	>>> [ equatePitch(text2pitch(s), text2pitch(d)) for (s,d) in
+	...      [('C4','E4'), ('C#5','Db5'), ('G3','g3'), ('F2','F4')]
+	... ]
+	[False, False, True, False]
+	"""
+	if (source_pitch==None) or (dest_pitch==None):
+		return None
+	sourcePitch, sourceDps, sourceOctave = _pitchFields(source_pitch)
+	destPitch, destDps, destOctave = _pitchFields(dest_pitch)
+	return (destOctave == sourceOctave) and (destPitch == sourcePitch)
+
+#TODO change this to take account of divs per semitone
+def approxEquatePitch(source_pitch, dest_pitch):
+	"""Return true if both arguments have the same pitch, ignoring their octaves
+	
+	>>> [ approxEquatePitch(text2pitch(s), text2pitch(d)) for (s,d) in
+	...      [('C4','E4'), ('C#5','Db5'), ('G3','g3'), ('F2','F4')]
+	... ]
+	[False, False, True, True]
+	"""
+	if (source_pitch==None) or (dest_pitch==None):
+		return None
+	return _pitchFields(dest_pitch)[0] == _pitchFields(source_pitch)[0]
+
+
+################################
+## Time functions
+##
+################################
+
+def _compareTime(t1, t2):
+	numerator1, denominator1 = _scoreTimeFields(t1)
+	numerator2, denominator2 = _scoreTimeFields(t2)
+	if denominator1 > 0 and denominator2 > 0:
+		#compare by cross-multiplication; no need for Fractions
+		a = numerator1 * denominator2
+		b = numerator2 * denominator1
+	else:
+		a = Fraction(numerator1, denominator1)
+		b = Fraction(numerator2, denominator2)
+	return (a > b) - (a < b)
+
+def scoreTimeKey(t):
+	"""Return a float which sorts and compares like the spoff score time
+
+	Matches spoff_time_key() in sql/sort_keys.sql. Division is correctly
+	rounded, so equal times always give equal keys; different times give
+	different keys while the product of their denominators and their
+	value stays below 2**52.
+
+	>>> scoreTimeKey(SpoffScoreTime(13, 4)), scoreTimeKey(SpoffScoreTime(2, 6)) == scoreTimeKey(SpoffScoreTime(1, 3))
+	(3.25, True)
+	"""
+	numerator, denominator = _scoreTimeFields(t)
+	return float(numerator) / denominator
+
+def greaterThanTime(t1, t2):
+	return _compareTime(t1, t2) > 0
+
+def greaterThanOrEqualToTime(t1, t2):
+	return _compareTime(t1, t2) >= 0
+
+def lessThanTime(t1, t2):
+	"""Return true if score time t1 is before t2
+
+	>>> [lessThanTime(SpoffScoreTime(*s), SpoffScoreTime(*d)) for (s,d) in
+	...   [((7,2), (15,4)), ((15,4), (7,2)), ((2,4), (1,2))]
+	... ]
+	[True, False, False]
+	"""
+	return _compareTime(t1, t2) < 0
+
+def lessThanOrEqualToTime(t1, t2):
+	return _compareTime(t1, t2) <= 0
+
+def equateTime(t1, t2):
+	return _compareTime(t1, t2) == 0
+
+# Score times as integer ticks: the times of a work are converted once to
+# multiples of 1/denominator crotchet, denominator being the least common
+# multiple of their denominators, so that comparing, adding and testing
+# them for overlap is integer arithmetic, on ints or int64 arrays.
+
+def commonDenominator(times):
+	"""The least common multiple of the denominators of score times
+
+	>>> commonDenominator([SpoffScoreTime(1, 4), '(2,3)', (5, 6), None])
+	12
+	"""
+	denominator = 1
+	for t in times:
+		if t is not None:
+			d = asScoreTime(t)[1]
+			if denominator % d:
+				denominator = denominator * d // _gcd(denominator, d)
+	return denominator
+
+def time2ticks(t, denominator):
+	"""A score time as a whole number of 1/denominator crotchet ticks
+
+	>>> time2ticks(SpoffScoreTime(5, 6), 12), ticks2time(10, 12)
+	(10, SpoffScoreTime(crotchet_numerator=5, crotchet_denominator=6))
+	"""
+	numerator, timeDenominator = _scoreTimeFields(t)
+	ticks, remainder = divmod(numerator * denominator, timeDenominator)
+	if remainder:
+		raise ValueError('%d/%d is not a whole number of 1/%d ticks' % (numerator, timeDenominator, denominator))
+	return ticks
+
+def ticks2time(ticks, denominator):
+	"""ticks of 1/denominator crotchet as a SpoffScoreTime, in lowest terms"""
+	divisor = _gcd(ticks, denominator) or 1
+	return _newScoreTime((ticks // divisor, denominator // divisor))
+
+class ScoreTicks(object):
+	"""The onsets and durations of a work's notes as integer ticks
+
+	onset, duration and end are int64 arrays of the times of each note in
+	ticks of 1/denominator crotchet. Notes overlap as in
+	simultaneousNotes(): if they start together or either starts before
+	the other ends.
+
+	>>> ticks = ScoreTicks(['(0,1)', '(1,3)', '(1,2)'], ['(1,3)', '(1,6)', '(1,4)'])
+	>>> ticks.denominator, ticks.onset.tolist(), ticks.end.tolist()
+	(12, [0, 4, 6], [4, 6, 9])
+	>>> ticks.overlaps(0, 1), ticks.overlaps(1, 2), ticks.sounding(5, 7).tolist()
+	(False, False, [1, 2])
+	>>> ticks.time(ticks.end[2])
+	SpoffScoreTime(crotchet_numerator=3, crotchet_denominator=4)
+	"""
+
+	def __init__(self, onsets, durations):
+		import numpy
+		onsets = [asScoreTime(t) for t in onsets]
+		durations = [asScoreTime(t) for t in durations]
+		if None in onsets or None in durations:
+			raise ValueError('a note without an onset or duration')
+		self.denominator = denominator = commonDenominator(onsets + durations)
+		self.onset = numpy.array([time2ticks(t, denominator) for t in onsets], dtype=numpy.int64)
+		self.duration = numpy.array([time2ticks(t, denominator) for t in durations], dtype=numpy.int64)
+		self.end = self.onset + self.duration
+
+	def __len__(self):
+		return len(self.onset)
+
+	def ticks(self, t):
+		"""A score time in the ticks of these notes"""
+		return time2ticks(t, self.denominator)
+
+	def time(self, ticks):
+		return ticks2time(int(ticks), self.denominator)
+
+	def overlaps(self, i, j):
+		"""Whether notes i and j (indices into the arrays) sound together"""
+		onset1, onset2 = int(self.onset[i]), int(self.onset[j])
+		return onset1 == onset2 or onset1 < int(self.end[j]) and onset2 < int(self.end[i])
+
+	def sounding(self, start, end):
+		"""The indices of the notes which sound during the ticks [start, end),
+		or start with it"""
+		import numpy
+		return numpy.flatnonzero(((self.onset < end) & (self.end > start)) | (self.onset == start))
+
+	def order(self):
+		"""The indices of the notes in onset order (stable)"""
+		import numpy
+		return numpy.argsort(self.onset, kind='mergesort')
+
+
+
+def addDuration(location, duration, beats=4, divisionsPerBeat=8):
+	"""Return the sum of two durations. Typically, the first might be
+	the score time and the second an offset
+	
+	>>> # Add 2 beats in 3/4 time from the second beat of bar 6
+	>>> st = addDuration({'bar':6, 'beat':2, 'division':0}, 
+	...                  {'bar':0, 'beat':2, 'division':0}, 3)
+	>>> st == {'bar':7, 'beat':1, 'division':0}
+	True
+	
+	>>> # Start at bar 100 in 4/4 time, beat 1; go back 7 bars, 2.5 beats
+	>>> st = addDuration({'bar':100, 'beat':1, 'division':0}, 
+	...                  {'bar':-7, 'beat':-2, 'division':-4})
+	>>> st == {'bar':92, 'beat':2, 'division':4}
+	True
+	"""
+	sourceBar = location['bar']
+	sourceBeat = location['beat']
+	sourceDiv = location['division']
+	durBars = duration['bar']
+	durBeats = duration['beat']
+	durDivs = duration['division']
+	
+	overflowBeats = (sourceDiv + durDivs) / divisionsPerBeat
+	newDivisions = (sourceDiv + durDivs) % divisionsPerBeat
+	overflowBars = (sourceBeat + durBeats + overflowBeats) / beats
+	newBeats = (sourceBeat + durBeats + overflowBeats) % beats
+	newBars = sourceBar + durBars + overflowBars
+
+	return {'bar': newBars, 'beat': newBeats, 'division': newDivisions}
+
+def addDurations(locations, duration, beats=4, divisionsPerBeat=8):
+	"""addDuration() over arrays: locations and duration are dictionaries of
+	'bar', 'beat' and 'division', each an array or a number, and the
+	result is a dictionary of int64 arrays
+
+	>>> st = addDurations({'bar':[6, 100], 'beat':[2, 1], 'division':[0, 0]},
+	...                   {'bar':[0, -7], 'beat':[2, -2], 'division':[0, -4]}, 3)
+	>>> dict((k, v.tolist()) for (k, v) in st.items()) == {'bar':[7, 92], 'beat':[1, 1], 'division':[0, 4]}
+	True
+	"""
+	import numpy
+	fields = [numpy.asarray(values, dtype=numpy.int64) for values in (
+		locations['bar'], locations['beat'], locations['division'],
+		duration['bar'], duration['beat'], duration['division'])]
+	sourceBar, sourceBeat, sourceDiv, durBars, durBeats, durDivs = fields
+	overflowBeats, newDivisions = numpy.divmod(sourceDiv + durDivs, divisionsPerBeat)
+	overflowBars, newBeats = numpy.divmod(sourceBeat + durBeats + overflowBeats, beats)
+	return {'bar': sourceBar + durBars + overflowBars, 'beat': newBeats, 'division': newDivisions}
+
+def _gcd(a, b):
+	while b:
+		a, b = b, a % b
+	return abs(a)
+
+def _noteSpans(source_notes, dest_notes):
+	# Each note stream as an onset-sorted list of (onset, end, note) with
+	# the times in integer ticks of a common denominator, so that the
+	# sweep compares plain integers.
+	times = []
+	denominator = 1
+	for notes in (source_notes, dest_notes):
+		noteTimes = []
+		for note in notes:
+			onsetNum, onsetDen = asScoreTime(note['onset'])
+			durNum, durDen = asScoreTime(note['duration'])
+			for d in (onsetDen, durDen):
+				if denominator % d:
+					denominator = denominator * d // _gcd(denominator, d)
+			noteTimes.append((onsetNum, onsetDen, durNum, durDen, note))
+		times.append(noteTimes)
+	spans = []
+	for noteTimes in times:
+		noteSpans = []
+		for onsetNum, onsetDen, durNum, durDen, note in noteTimes:
+			onset = onsetNum * (denominator // onsetDen)
+			noteSpans.append((onset, onset + durNum * (denominator // durDen), note))
+		noteSpans.sort(key=lambda span: span[0])
+		spans.append(noteSpans)
+	return spans[0], spans[1], denominator
+
+def simultaneousNotes(source_notes, dest_notes):
+	"""Generate every pair of overlapping notes from two note streams
+
+	The streams are sequences of score_notes rows (dictionaries with at
+	least 'onset' and 'duration'), typically two parts of a work. Yields
+	(source_note, dest_note, location, duration) ordered by the onset of
+	the source note, then of the dest note, where location and duration
+	are the SpoffScoreTimes of the span over which the two sound together.
+
+	Two notes overlap if they start together or if either starts before
+	the other ends. The notes are swept in onset order, so this takes
+	O(n log n + k) time for n notes and k pairs (O(n + k) if the
+	streams are already sorted by onset).
+
+	>>> def note(note_id, onset, duration):
+	...   return {'note_id':note_id, 'onset':onset, 'duration':duration}
+	>>> top = [note(1, (0,1), (1,2)), note(2, (1,2), (1,2)), note(3, (1,1), (1,1))]
+	>>> bottom = [note(4, '(0,1)', '(1,1)'), note(5, '(1,1)', '(1,4)')]
+	>>> [(s['note_id'], d['note_id'], tuple(l), tuple(t))
+	...   for (s, d, l, t) in simultaneousNotes(top, bottom)]
+	[(1, 4, (0, 1), (1, 2)), (2, 4, (1, 2), (1, 2)), (3, 5, (1, 1), (1, 4))]
+	"""
+	sources, dests, denominator = _noteSpans(source_notes, dest_notes)
+	destCount = len(dests)
+	sounding = []	# dest notes which started at or before the source note
+	nextDest = 0
+	for onset, end, source in sources:
+		while nextDest < destCount and dests[nextDest][0] <= onset:
+			sounding.append(dests[nextDest])
+			nextDest += 1
+		# Forget dest notes which have finished. Sources come in onset
+		# order, so they can't overlap anything later either.
+		sounding = [d for d in sounding if d[1] > onset or d[0] == onset]
+		for destOnset, destEnd, dest in sounding:
+			yield (source, dest, ticks2time(onset, denominator),
+				ticks2time(max(min(end, destEnd) - onset, 0), denominator))
+		# then the dest notes which start while the source note sounds
+		i = nextDest
+		while i < destCount and dests[i][0] < end:
+			destOnset, destEnd, dest = dests[i]
+			yield (source, dest, ticks2time(destOnset, denominator),
+				ticks2time(min(end, destEnd) - destOnset, denominator))
+			i += 1
+
+def timedIntervals(source_notes, dest_notes):
+	"""Generate the vertical intervals between two note streams
+
+	Yields a spoff_timed_interval_type dictionary for every pair of
+	overlapping notes found by simultaneousNotes(), skipping rests.
+	value and octave are those of getInterval(source pitch, dest pitch);
+	direction is +1 if the dest note is higher, -1 if it is lower and 0
+	for a unison. location and duration are [numerator, denominator]
+	lists giving the span over which the notes sound together.
+
+	>>> def note(note_id, pitch, onset, duration):
+	...   return {'work_id':0, 'note_id':note_id, 'pitch':pitch,
+	...           'onset':onset, 'duration':duration}
+	>>> top = [note(1, text2pitch('E5'), (0,1), (1,1))]
+	>>> bottom = [note(2, text2pitch('C4'), (0,1), (1,2)),
+	...           note(3, '(,1,)', (1,2), (1,4)), note(4, '(2,1,4)', (3,4), (1,1))]
+	>>> [(row['dest_note_id'], row['value'], row['direction'], row['octave'],
+	...   row['location'], row['duration']) for row in timedIntervals(top, bottom)]
+	[(2, 4, -1, 1, [0, 1], [1, 2]), (4, 3, -1, 0, [3, 4], [1, 4])]
+	"""
+	for source, dest, location, duration in simultaneousNotes(source_notes, dest_notes):
+		sourcePitch = asPitch(source['pitch'])
+		destPitch = asPitch(dest['pitch'])
+		if sourcePitch is None or destPitch is None:
+			continue
+		interval = getInterval(sourcePitch, destPitch)
+		yield {
+			'source_work_id': source['work_id'],
+			'source_note_id': source['note_id'],
+			'dest_work_id': dest['work_id'],
+			'dest_note_id': dest['note_id'],
+			'value': None if interval is None else interval[0],
+			'direction': _comparePitch(destPitch, sourcePitch),
+			'octave': None if interval is None else interval[2],
+			'duration': list(duration),
+			'location': list(location),
+		}
+
+# Rows fetched from a cursor at a time by fetchRows()
+CURSOR_BATCH = 1000
+
+def fetchRows(plpy, plan, args=(), batch=CURSOR_BATCH):
+	"""Generate the rows of a prepared query batch rows at a time
+
+	Uses an SPI cursor (plpy.cursor(), PostgreSQL 9.2 and later) so that
+	only one batch is held in memory; where plpy has no cursor() (older
+	servers, spoff.store) the whole result is fetched with execute().
+	"""
+	if not hasattr(plpy, 'cursor'):
+		for row in plpy.execute(plan, list(args)):
+			yield row
+		return
+	cursor = plpy.cursor(plan, list(args))
+	while True:
+		rows = cursor.fetch(batch)
+		if not rows:
+			break
+		for row in rows:
+			yield row
+
+# The notes of a work, in the order melodicIntervals() reads them
+voiceNoteQuery = """select * from score_notes
+	where work_id = $1
+	order by part_id, voice, spoff_time_key(onset), note_id;"""
+
+def melodicIntervals(notes, bridgeRests=False):
+	"""Generate the melodic intervals between successive notes of each voice
+
+	notes are score_notes rows ordered by onset within each (work_id,
+	part_id, voice), with the rows of each voice together, as
+	voiceNoteQuery returns them. Yields a spoff_interval_type dictionary
+	for each pair of successive notes of a voice: value and octave are
+	those of getInterval(), direction is +1 if the second note is higher,
+	-1 if it is lower and 0 for a unison. No interval spans two voices.
+
+	A rest ends the melodic line, so no interval spans it, unless
+	bridgeRests is true, when the notes either side of it are paired.
+	The rows are only read as far as needed, so a cursor can be passed.
+
+	>>> def note(note_id, pitch, voice=1):
+	...   return {'work_id':0, 'note_id':note_id, 'part_id':'P1', 'voice':voice,
+	...           'pitch':text2pitch(pitch) if pitch else '(,1,)'}
+	>>> notes = [note(0, 'C4'), note(1, 'E4'), note(2, None), note(3, 'D4'),
+	...          note(4, 'G3', 2), note(5, 'G3', 2)]
+	>>> [(row['source_note_id'], row['dest_note_id'], row['value'], row['direction'])
+	...   for row in melodicIntervals(notes)]
+	[(0, 1, 4, 1), (4, 5, 0, 0)]
+	>>> [(row['source_note_id'], row['dest_note_id'], row['value'], row['direction'])
+	...   for row in melodicIntervals(notes, bridgeRests=True)]
+	[(0, 1, 4, 1), (1, 3, 2, -1), (4, 5, 0, 0)]
+	"""
+	voice = None
+	previous = previousPitch = None
+	for note in notes:
+		key = (note['work_id'], note['part_id'], note['voice'])
+		if key != voice:
+			voice = key
+			previous = previousPitch = None
+		pitch = asPitch(note['pitch'])
+		if pitch is None:
+			if not bridgeRests:
+				previous = previousPitch = None
+			continue
+		if previous is not None:
+			interval = getInterval(previousPitch, pitch)
+			yield {
+				'source_work_id': previous['work_id'],
+				'source_note_id': previous['note_id'],
+				'dest_work_id': note['work_id'],
+				'dest_note_id': note['note_id'],
+				'value': None if interval is None else interval[0],
+				'direction': _comparePitch(pitch, previousPitch),
+				'octave': None if interval is None else interval[2],
+			}
+		previous, previousPitch = note, pitch
+
+def getSimultaneous(source_note, dest_table):
+	"""Find notes which are simultaneous with the given note
+
+	returns a list of score_notes which overlap in time with the source_note"""
+	return [dest for (source, dest, location, duration)
+		in simultaneousNotes([source_note], dest_table)]
+
+#def text2interval(text):
+	#text in the form:
+	# '1+m3rd' - an octave and a minor 3rd
+	# or 'm10th' - as above
+	#regex = re.compile('([0-9]+\+)?([MmPp]?|[AaDd]*)([0-9]+)(st|nd|rd|th)')
+	#result = regex.search(text)
+	#if result:
+		#interval_type = result.group(2)
+		#interval_number = result.group(3)
+		#octave = result.group(1) if result.group(1) else 0
+		#octave = octave + (interval_number / 7)
+		#should m/M/P etc be optional as per wikipedia page?
+		#interval = interval_order[int(interval_number)%7]
+		#if interval_type
+	#else:
+#1	raise ValueError
+
+#need 2 more interval operators:
+#	interval ~= interval -> True|False :: whether interval is in the same class ie. m3, m10, m17
+#	interval #= interval -> True|False :: whether intervals are in the same interval class ie. M3, m3, M10, m10 are all scalar 3rds
+#also need a few utility functions:
+#	text2interval("string") -> interval :: converts string to a interval eg. "1+M3rd" -> (4,1,1)
+#	interval2text(interval) -> "string" :: converts interval to a string eg. 
+#	scale("string") -> pitch[] :: returns an array of pitches making a single octave of the desired scale
+#	pitch <- pitch[] -> True|False :: whether pitch is an element of the array of pitches
+#	pitch <~ pitch[] -> True|False :: whether pitch is element of the array of pitches ignoring octaves
+#	spoff_time <- spoff_time[] -> True|False :: 
+
+_intervalPattern = re.compile('([0-9]*)\+?([MmPp]?|[Aa]*|[Dd]*)([0-9]+)(st|nd|rd|th)?')
+
+@lruCache()
+def text2interval(text):
+	matches = _intervalPattern.match(text)
+	
+	octave = int(matches.group(1)) if matches.group(1) else 0
+	alter = matches.group(2) if matches.group(2) else ''
+	type = int(matches.group(3))
+	
+	octave = octave + (type / 8)		#8 notes in a diatonic octave
+	interval_class = type % 8
+	modifier = 0
+	
+	if (interval_class in [2, 3, 6, 7]):
+		if ('M' in alter):
+		#Major
+			modifier = 0
+		elif ('m' in alter):
+		#minor
+			modifier = -7
+		elif ('a' in alter) or ('A' in alter):
+		#augmented 
+			modifier = 7 * len(alter)
+		elif ('d' in alter) or ('D' in alter):
+		#diminished
+			modifier = -7 * len(alter) -7
+	elif (interval_class in [0, 1, 4, 5]):
+		if ('P' in alter) or ('p' in alter):
+		#perfect
+			modifier = 0
+		if ('a' in alter) or ('A' in alter):
+		#augmented 
+			modifier = 7 * len(alter)
+		elif ('d' in alter) or ('D' in alter):
+		#diminished
+			modifier = -7 * len(alter)
+	else:
+		raise ValueError
+
+	return SpoffInterval(intervalList[interval_class] + modifier, 1, octave)
+
+def interval2text(interval):
+# Whoa! should it really be called divisions per semitone when we are talking about intervals?
+	#will this work? can/how does the modulo operator work on Fractions?
+	#what about div_per_s > 1 ??
+	#continuing assuming that dps = 1 
+	interval_string = str(interval['octave']) + '+'
+	spoff_interval_class = interval['interval'] % 7
+	spoff_modifier = interval['interval'] / 7
+	interval_class = intervalListP4.index(spoff_interval_class)	#+1 ???
+	if (interval_class in [2, 3, 6, 7]):
+		if (-2 <= spoff_modifier <= 1):
+			interval_string = interval_string + ['d', 'm', 'M', 'A'][spoff_modifier+2] + str(interval_class)
+		elif (spoff_modifier < -2):
+			interval_string = interval_string + ('d' * -spoff_modifier) + str(interval_class)
+		elif (spoff_modifier > 1):
+			interval_string = interval_string + ('A' * spoff_modifier) + str(interval_class)
+	elif (interval_class == 4):
+		if (spoff_modifier == -1):
+			interval_string = interval_string + 'P' + str(interval_class)
+		elif (spoff_modifier < -1):
+			interval_string = interval_string + ('d' * -(spoff_modifier+1)) + str(interval_class)
+		elif (spoff_modifier > -1):
+			interval_string = interval_string + ('A' * (spoff_modifier+1)) + str(interval_class)
+	elif (interval_class in [0,1,5]):
+		if (spoff_modifier == 0):
+			interval_string = interval_string + 'P' + str(interval_class)
+		elif (spoff_modifier < 0):
+			interval_string = interval_string + ('d' * -spoff_modifier) + str(interval_class)
+		elif (spoff_modifier > 0):
+			interval_string = interval_string + ('A' * spoff_modifier) + str(interval_class)
+	else:
+		#failure
+		raise ValueError
+	
+	return interval_string
+
+_scalePattern = re.compile('([AaBbCcDdEeFfGg][b#]?)([Mm])')
+
+def scale(text):
+	"""Return a list of the pitches of a one-octave scale, e.g. 'Ebm', from
+	the keynote up
+
+	The scales are cached, so each call returns a new copy of the list.
+
+	>>> s = scale('Ebm')
+	>>> len(s), s == scale('Ebm'), s is scale('Ebm')
+	(8, True, False)
+	"""
+	return list(_scale(text))
+
+@lruCache()
+def _scale(text):
+	matches = _scalePattern.match(text)
+	keynote = text2pitch(matches.group(1))
+	type = matches.group(2)
+	if (type == 'M'):
+		scale = majorScale
+	elif (type == 'm'):
+		scale = minorScale		#assumes harmonic minor
+	else:
+		raise ValueError
+	pitchArray = [keynote]
+	for interval in scale:
+		pitchArray.append(addInterval(pitchArray[-1], interval))
+
+	return tuple(pitchArray)
+		
+def elementOfPitchArray(testPitch, pitchArray):
+	for pitch in pitchArray:
+		if equatePitch(testPitch, pitch):
+			return True
+	return False
+
+def approxElementOfPitchArray(testPitch, pitchArray):
+	for pitch in pitchArray:
+		if approxEquatePitch(testPitch, pitch):
+			return True
+	return False
+
+##################################
+# Keys
+##################################
+
+# A set of pitches, ignoring octaves, is an integer with a bit for each
+# spoff pitch value (0, -1, 1, -2, 2, ... are bits 0, 1, 2, 3, 4, ...),
+# so membership is a shift and a mask. keyBits holds the set of every
+# mode of keyModes on the keynotes Cb to C#, by name: 'CM', 'Am' (the
+# scales of scale()) and e.g. 'D dorian', 'A harmonic minor'.
+
+def _pitchBitIndex(pitch):
+	return 2 * pitch if pitch >= 0 else -2 * pitch - 1
+
+def pitchBits(pitches):
+	"""The set of the pitch values of pitches, ignoring octaves and rests"""
+	bits = 0
+	for pitch in pitches:
+		if pitch is not None:
+			value = _pitchFields(pitch)[0]
+			if value is not None:
+				bits |= 1 << _pitchBitIndex(value)
+	return bits
+
+def keyName(keynote, mode):
+	return keynote + mode if mode in ('M', 'm') else keynote + ' ' + mode
+
+_keynotes = [natural + accidental for accidental in ('b', '', '#')
+	for natural in ('F', 'C', 'G', 'D', 'A', 'E', 'B')][1:16]
+_keyPattern = re.compile('([AaBbCcDdEeFfGg][b#]*) ?(.+)$')
+
+keyPitches = {}	# name -> the pitch values of the key
+keyBits = {}	# name -> their pitchBits()
+for _keynote in _keynotes:
+	_pitch = naturals[_keynote[0]] + 7 * (_keynote.count('#') - _keynote.count('b'))
+	for _mode, _offsets in keyModes.items():
+		_name = keyName(_keynote, _mode)
+		keyPitches[_name] = tuple([_pitch + offset for offset in _offsets])
+		keyBits[_name] = pitchBits([(pitch, 1, 0) for pitch in keyPitches[_name]])
+del _keynote, _pitch, _mode, _offsets, _name
+
+# The keys keyFractions() compares by default: major and harmonic minor
+KEYS = [keyName(keynote, mode) for mode in ('M', 'harmonic minor') for keynote in _keynotes]
+
+def _keyPitches(key):
+	if key in keyPitches:
+		return keyPitches[key]
+	matches = _keyPattern.match(key)
+	if matches is None or matches.group(2) not in keyModes:
+		raise ValueError('unknown key: %s' % key)
+	keynote = text2pitch(matches.group(1))[0]
+	return tuple([keynote + offset for offset in keyModes[matches.group(2)]])
+
+def inKey(pitch, key):
+	"""Return true if the pitch (in any octave) is in the key, e.g. 'Ebm'
+
+	>>> [inKey(text2pitch(p), 'A harmonic minor') for p in ('G#3', 'G5', 'C4')]
+	[True, False, True]
+	>>> inKey(text2pitch('Fb4'), 'Fb lydian'), inKey(None, 'CM')
+	(True, False)
+	"""
+	if pitch is None:
+		return False
+	value = _pitchFields(pitch)[0]
+	if value is None:
+		return False
+	bits = keyBits.get(key)
+	if bits is None:
+		bits = pitchBits([(p, 1, 0) for p in _keyPitches(key)])
+	return (bits >> _pitchBitIndex(value)) & 1 == 1
+
+def keyFractions(pitch, keys=None, weights=None):
+	"""The fraction of the notes of a work in each of keys (default KEYS)
+
+	pitch is an array of the spoff pitch values of the notes, with rests
+	masked, such as the first of the arrays of pitches2arrays() or
+	NoteCache.pitchArrays(); weights, e.g. the durations of the notes,
+	weigh each note. Returns (key, fraction) by decreasing fraction.
+
+	>>> pitches = [text2pitch(p) for p in ('C4', 'E4', 'G4', 'F#4', 'B4')]
+	>>> keyFractions(pitches2arrays(pitches)[0])[:3]
+	[('GM', 1.0), ('E harmonic minor', 1.0), ('CM', 0.8)]
+	>>> keyFractions(pitches2arrays(pitches)[0], ['CM', 'GM'], weights=[1, 1, 1, 2, 1])
+	[('GM', 1.0), ('CM', 0.6666666666666666)]
+	"""
+	import numpy
+	keys = KEYS if keys is None else list(keys)
+	pitch = numpy.ma.asarray(pitch)
+	valid = ~numpy.ma.getmaskarray(pitch)
+	values = numpy.ma.getdata(pitch)[valid].astype(numpy.int64)
+	if weights is None:
+		weights = numpy.ones(len(values))
+	else:
+		weights = numpy.asarray(weights, dtype=float)[valid]
+	total = weights.sum()
+	if len(values) == 0 or total == 0:
+		return [(key, 0.0) for key in keys]
+	low = values.min()
+	counts = numpy.bincount(values - low, weights=weights)
+	index = numpy.array([_keyPitches(key) for key in keys], dtype=numpy.int64) - low
+	inRange = (index >= 0) & (index < len(counts))
+	fractions = numpy.where(inRange, counts[numpy.clip(index, 0, len(counts) - 1)], 0).sum(axis=1) / total
+	order = numpy.argsort(-fractions, kind='mergesort')
+	return [(keys[i], float(fractions[i])) for i in order]
+
+def pitch2text(pitch):
+	#TODO extend to pitches where dps>1
+	spoffPitch = pitch['pitch']
+	dps = pitch['divisions_per_semitone']
+	spoffPitchClass = ((spoffPitch + ((spoffPitch % dps) *7)) / dps) %7
+	#accidental = spoffPitch / (7*dps) + (spoffPitch % dps)
+	accidental = (spoffPitch - (spoffPitchClass * dps) ) / 7
+	pitchString = naturals.keys()[naturals.values().index(spoffPitchClass)]
+	pitchFraction = Fraction(spoffPitch, dps)
+	octave = str(pitch['octave'])
+	if dps > 2:
+		pitchString = ''.join([pitchString, str(abs(accidental)), '/', str(dps), '#' if pitchFraction.numerator > 0 else 'b', octave])
+	elif dps == 2:
+		if spoffPitch > (spoffPitchClass * dps):
+			accidentalSemitone = '#'
+			accidentalQuartertone = '+'
+		else:
+			accidentalSemitone = 'b'
+			accidentalQuartertone = 'd'
+		pitchString = ''.join([pitchString, (abs(accidental) %2)*accidentalQuartertone, (abs(accidental) /2)*accidentalSemitone, octave])
+	elif dps == 1:
+		if accidental >0:
+			accidentalSign = '#'
+		elif accidental <0:
+			accidentalSign = 'b'
+		else:
+			accidentalSign = ''
+		pitchString = ''.join([pitchString, abs(accidental) / dps * accidentalSign, octave])
+	else:
+		raise ValueError
+
+	return pitchString
+
+
+_pitchPattern = re.compile('([a-gA-G])([#b]*)(-?[0-9]*)')
+
+@lruCache()
+def text2pitch(text):
+	#TODO extend to pitches with sesqui- and semi- intervals ie. dps>1
+	matches = _pitchPattern.match(text)
+	pitchClass = naturals[matches.group(1).upper()]
+	accidental = matches.group(2) if matches.group(2) else ''
+	octave = int(matches.group(3)) if matches.group(3) else 0
+	if ('#' in accidental):
+		#sharp
+		alter = 7 * len(accidental)
+	elif ('b' in accidental):
+		#flat
+		alter = -7 * len(accidental)
+	else:
+		alter = 0
+
+	return SpoffPitch(pitchClass + alter, 1, octave)
+
+#####################################
+# 
+#	-14	-7	0	7	14
+#0		d1	1st	a1	
+#1		d5	P5	a5	
+#2	d2	m2	M2	a2	
+#3	d6	m6	M6	a6	
+#4	d3	m3	M3	a3	
+#5	d7	m7	M7	a7	
+#6	d4	P4	a4		
+#
+#####################################
+
+def equateIntervalType(interval1, interval2):
+	#  ~= ignoring octaves eg. M3 ~= M10 -> True
+	if (interval1==None) or (interval2==None):
+		return False
+	#TODO check this for more exotic intervals and dps
+	step1, dps1, octave1 = _intervalFields(interval1)
+	step2, dps2, octave2 = _intervalFields(interval2)
+	# equal fractions, compared by cross-multiplication
+	return step1 * dps2 == step2 * dps1
+
+def equateIntervalClass(interval1, interval2):
+	#  #= eg. all thirds are in the same class m3 #= M17 -> True
+	if (interval1==None) or (interval2==None):
+		return False
+	#TODO check this for more exotic intervals and dps
+	step1, dps1, octave1 = _intervalFields(interval1)
+	step2, dps2, octave2 = _intervalFields(interval2)
+	if dps1 == 1 and dps2 == 1:
+		return step1 % 7 == step2 % 7
+	return Fraction(step1, dps1) %7 == Fraction(step2, dps2) %7
+
+def equateInterval(interval1, interval2):
+	if (interval1==None) or (interval2==None):
+		return False
+	#TODO check this for more exotic intervals and dps
+	step1, dps1, octave1 = _intervalFields(interval1)
+	step2, dps2, octave2 = _intervalFields(interval2)
+	return (step1 * dps2 == step2 * dps1) and (octave1 == octave2)
+
+##################################
+# Interval classes
+##################################
+
+# Named classifications of intervals, ignoring octaves as
+# equateIntervalType() does. Each is a list of (class, intervals, colour)
+# and the (class, colour) of any other interval; the colour is the one
+# intervalClassText() marks the class in, None for none.
+intervalClassifications = {}
+_intervalClasses = {}
+
+def defineIntervalClassification(name, classes, default):
+	"""Add (or replace) the classification name, compiling its intervals
+	into a dictionary for intervalClassOf()
+
+	>>> defineIntervalClassification('thirds', [('third', ('m3', 'M3'), 'blue')], ('other', None))
+	>>> intervalClassOf(text2interval('m3'), 'thirds'), intervalClassOf(text2interval('P5'), 'thirds')
+	('third', 'other')
+	"""
+	lookup = {}
+	for className, intervals, colour in classes:
+		for text in intervals:
+			lookup[_intervalTypeKey(text2interval(text))] = (className, colour)
+	intervalClassifications[name] = (classes, default)
+	_intervalClasses[name] = (lookup, tuple(default))
+
+def _intervalTypeKey(interval):
+	# interval / divisions_per_semitone in lowest terms: equal for
+	# intervals which equateIntervalType() equates
+	step, dps = _intervalFields(interval)[:2]
+	if dps == 1:
+		return (step, 1)
+	divisor = _gcd(step, dps) or 1
+	if dps < 0:
+		divisor = -divisor
+	return (step // divisor, dps // divisor)
+
+def _intervalClass(interval, classification):
+	# (class, colour) of interval
+	lookup, default = _intervalClasses[classification]
+	return lookup.get(_intervalTypeKey(interval), default)
+
+def intervalClassOf(interval, classification):
+	"""The class of interval (a SpoffInterval, dictionary or text) in the
+	named classification, None for no interval
+
+	>>> [intervalClassOf(text2interval(text), 'consonance') for text in ('P1', 'M6', 'P4', 'A4')]
+	['consonant', 'consonant', 'dissonant', 'dissonant']
+	>>> intervalClassOf('(3,1,1)', 'perfection'), intervalClassOf(None, 'perfection')
+	('imperfect', None)
+	"""
+	if interval is None:
+		return None
+	return _intervalClass(asInterval(interval), classification)[0]
+
+def intervalClassText(interval, classification):
+	"""interval2text(interval), marked in the colour of its class
+
+	>>> intervalClassText(text2interval('M3'), 'consonance'), intervalClassText(text2interval('m2'), 'consonance')
+	('0+M3', ' \\\\with-color #red 0+m2')
+	"""
+	if interval is None:
+		return None
+	interval = asInterval(interval)
+	colour = _intervalClass(interval, classification)[1]
+	if colour is None:
+		return interval2text(interval)
+	return ' \\with-color #%s %s' % (colour, interval2text(interval))
+
+defineIntervalClassification('consonance',
+	[('consonant', ('P1', 'm3', 'M3', 'P5', 'm6', 'M6'), None)], ('dissonant', 'red'))
+defineIntervalClassification('perfection',
+	[('perfect', ('P1', 'P5'), None), ('imperfect', ('m3', 'M3', 'm6', 'M6'), None)],
+	('dissonant', 'red'))
+
+def addTextToNote(doc, valname, work_id, note_id, voice, part_id, text):
+	"""Add text to the valname text under a note of doc, as the
+	addtextundernotes() aggregate does
+
+	>>> doc = documentFromRows([{'work_id':0, 'note_id':3, 'voice':1, 'part_id':'XPart 0',
+	...   'type':'pitch', 'onset':'(0,1)', 'duration':'(1,1)', 'pitch':'(1,1,4)'}])
+	>>> addTextToNote(doc, 'intervs', 0, 3, 1, 'XPart 0', '0+M3')
+	>>> addTextToNote(doc, 'intervs', 0, 3, 1, 'XPart 0', '0+P5')
+	>>> doc['textUnderList'], doc['noteData'][0][3]['intervs']
+	({'XPart 0': {1: ['intervs']}}, ['0+M3', '0+P5'])
+	"""
+	_registerLayer(doc, 'textUnderList', part_id, voice, valname)
+	_appendToNote(doc['noteData'][work_id][note_id], valname, text)
+
+def addBarGraphToNote(doc, valname, work_id, note_id, voice, part_id, value):
+	"""Set the valname bar graph value of a note of doc, as the
+	addbargraphundernotes() aggregate does"""
+	_registerLayer(doc, 'barGraphList', part_id, voice, valname)
+	doc['noteData'][work_id][note_id][valname] = value
+
+def addLineGraphToNote(doc, valname, work_id, note_id, voice, part_id, value):
+	"""Add a point to the valname line graph of a note of doc, as the
+	addlinegraphundernotes() aggregate does"""
+	_registerLayer(doc, 'lineGraphList', part_id, voice, valname)
+	_appendToNote(doc['noteData'][work_id][note_id], valname, value)
+
+def _registerLayer(doc, listName, part_id, voice, valname):
+	# show valname under the voice of the part, once
+	names = doc.setdefault(listName, {}).setdefault(part_id, {}).setdefault(voice, [])
+	if valname not in names:
+		names.append(valname)
+
+def _appendToNote(note, valname, value):
+	values = note.get(valname)
+	if values is None:
+		note[valname] = [value]
+	else:
+		values.append(value)
+
+def addIntervalClassToNote(doc, valname, classification, work_id, note_id, voice, part_id, interval):
+	"""Add interval under a note of doc, coloured by its class: the
+	addintervalclassesundernotes() aggregate, which marks every row in
+	one pass. part_id is as in score_notes, padded to ten characters, so
+	the layer is shown under the part of the note; a None interval adds
+	nothing.
+
+	>>> doc = documentFromRows([{'work_id':0, 'note_id':3, 'voice':1, 'part_id':'XPart 0   ',
+	...   'type':'pitch', 'onset':'(0,1)', 'duration':'(1,1)', 'pitch':'(1,1,4)'}])
+	>>> addIntervalClassToNote(doc, 'intervs', 'consonance', 0, 3, 1, 'XPart 0   ', text2interval('m2'))
+	>>> addIntervalClassToNote(doc, 'intervs', 'consonance', 0, 3, 1, 'XPart 0   ', None)
+	>>> list(doc['textUnderList']) == [doc['noteData'][0][3]['part_id']], doc['noteData'][0][3]['intervs']
+	(True, [' \\\\with-color #red 0+m2'])
+	"""
+	if interval is None:
+		return
+	addTextToNote(doc, valname, work_id, note_id, voice, part_id,
+		intervalClassText(interval, classification))
+
+# The document list of the layers of each kind of annotation
+annotationLists = {'text': 'textUnderList', 'bar': 'barGraphList', 'line': 'lineGraphList'}
+
+def annotate(doc, layer, kind, work_ids, note_ids, values):
+	"""Attach a layer of annotations to the notes of doc in one pass: the
+	annotate() SQL function
+
+	kind is 'text', 'bar' or 'line', and each of values annotates the note
+	(work_ids[i], note_ids[i]); None, or a note which is not in doc,
+	annotates nothing. A bar graph has a
+	value per note. The texts and line graph points of a note are its
+	values in order (a value which is itself a list adding all of its
+	elements), replacing any the layer had. The layer is shown under the
+	part and voice of each note annotated. Returns the number of notes
+	annotated.
+
+	>>> doc = documentFromRows([{'work_id':0, 'note_id':n, 'voice':1 + n % 2, 'part_id':'XPart %d' % (n // 2),
+	...   'type':'pitch', 'onset':(n,1), 'duration':'(1,1)', 'pitch':'(1,1,4)'} for n in range(4)])
+	>>> annotate(doc, 'ioi', 'bar', [0, 0, 0, 7], [0, 1, 3, 0], [32, 16, None, 8])
+	2
+	>>> sorted(doc['barGraphList'].items()), doc['noteData'][0][1]['ioi']
+	([('XPart 0', {1: ['ioi'], 2: ['ioi']})], 16)
+	>>> annotate(doc, 'pitch_curve', 'line', [0, 0, 0, 0], [2, 3, 2, 3], [1.0, [2.0, 2.5], 1.5, 3.0])
+	2
+	>>> doc['noteData'][0][2]['pitch_curve'], doc['noteData'][0][3]['pitch_curve']
+	([1.0, 1.5], [2.0, 2.5, 3.0])
+	>>> sorted(doc['lineGraphList']['XPart 1'].items())
+	[(1, ['pitch_curve']), (2, ['pitch_curve'])]
+	"""
+	if kind not in annotationLists:
+		raise ValueError('unknown kind of annotation: %s' % kind)
+	if not len(work_ids) == len(note_ids) == len(values):
+		raise ValueError('work_id, note_id and value arrays of different lengths')
+	listName = annotationLists[kind]
+	noteData = doc['noteData']
+	annotated = set()
+	registered = set()
+	for work_id, note_id, value in zip(work_ids, note_ids, values):
+		if value is None:
+			continue
+		workNotes = noteData.get(work_id)
+		if workNotes is None or note_id not in workNotes:
+			continue
+		note = workNotes[note_id]
+		if (work_id, note_id) not in annotated:
+			annotated.add((work_id, note_id))
+			place = (note['part_id'], note['voice'])
+			if place not in registered:
+				registered.add(place)
+				_registerLayer(doc, listName, place[0], place[1], layer)
+			if kind != 'bar':
+				note[layer] = []
+		if kind == 'bar':
+			note[layer] = value
+		elif isinstance(value, (list, tuple)):
+			note[layer].extend(value)
+		else:
+			note[layer].append(value)
+	return len(annotated)
+
+############ 
+# output lilypond
+###########
+def spoff_pitch2lily(pitch):
+	return _pitch2lily(asPitch(pitch))
+
+@lruCache()
+def _pitch2lily(pitch):
+	if pitch==None:
+		return ''
+	spoffPitch, dps, octave = pitch
+	spoffPitchClass = ((spoffPitch + ((spoffPitch % dps) *7)) / dps) %7
+	#accidental = spoffPitch / (7*dps) + (spoffPitch % dps)
+	accidental = (spoffPitch - (spoffPitchClass * dps) ) / 7
+	pitchString = naturals.keys()[naturals.values().index(spoffPitchClass)].lower()
+	pitchFraction = Fraction(spoffPitch, dps)
+	# Middle C: C4 in spoff/musicxml, c' in lilypond
+	lilyOctave = (octave -3)
+	octave = lilyOctave * '\'' if lilyOctave >=0 else abs(lilyOctave)*','
+	if dps > 2:
+		raise ValueError #TODO implement something here!
+		# see second bullet at http://lilypond.org/doc/v2.12/Documentation/topdocs/NEWS
+	elif dps == 2:
+		if spoffPitch > (spoffPitchClass * dps):
+			accidentalSemitone = 'is'
+			accidentalQuartertone = 'ih'
+		else:
+			accidentalSemitone = 'es'
+			accidentalQuartertone = 'eh'
+		pitchString = ''.join([pitchString, (abs(accidental) %2)*accidentalQuartertone, (abs(accidental) /2)*accidentalSemitone, octave])
+	elif dps == 1:
+		if accidental >0:
+			accidentalSign = 'is'
+		elif accidental <0:
+			accidentalSign = 'es'
+		else:
+			accidentalSign = ''
+		pitchString = ''.join([pitchString, abs(accidental) / dps * accidentalSign, octave])
+	else:
+		raise ValueError
+
+	return pitchString
+
+def reducePow2(number):
+	#reduces number to a list of powers of 2. The first in the list can be used as the note duration class with the length of the remaining list determining the number of dots. sort of but no quite...
+	residual = number
+	integralList = []
+	while residual != 0:
+		#modf returns a tuple of (fractional_part, integral_part)
+		pow2_fractional, pow2_integral = math.modf(math.log(residual, 2))
+		integralList.append(pow2_integral)
+		residual = residual - 2**pow2_integral
+	return integralList
+	
+
+def spoff_time2lily(time):
+	return _time2lily(asScoreTime(time))
+
+@lruCache()
+def _time2lily(time):
+	#spoff_score_time (along with musicxml) represents time in divisions of a crotchet. Lilypond represents time as divisions of a whole note denominator
+	if time==None:
+		return ''
+	timeFraction = Fraction(time[0], time[1])
+	#check if fraction denominator is a power of 2. If not, duration is dotted
+	#TODO check this for musical tuples. Maybe deal with musical tuples in the note_group section
+	pow2ListNumerator = reducePow2(timeFraction.numerator)
+	pow2ListDenominator = reducePow2(timeFraction.denominator)
+	if (pow2ListNumerator == []) or (pow2ListDenominator == []):
+		return ''
+	else:
+		durationClass = 4*Fraction(int(2**pow2ListNumerator.pop(0)), int(2**pow2ListDenominator.pop(0)))**-1
+		dotcount = len(pow2ListNumerator) + len(pow2ListDenominator)
+		return str(durationClass) + ('.' * dotcount)
+	
+def mxmlKeySig2lily(mxml_key):
+	spoff_key = mxml_key + 1
+	pitch_class = naturals.keys()[naturals.values().index(spoff_key%7)].lower()
+	accidentalCount = spoff_key / 7
+	# flats and sharps
+	accidental = (-accidentalCount)*'es' if accidentalCount < 0 else accidentalCount*'is'
+	return pitch_class + accidental 
+
+def plpy2list(valuestring):
+	# '{2,3,5,676}'
+	# No longer used by spoff or its SQL functions: values entering spoff
+	# are converted by asIntArray(), asScoreTime() and asPitch() instead.
+	# Kept only for code outside the package which imports it.
+	# Make sure we actually got a string!
+	if not isinstance(valuestring, str):
+		return valuestring
+	
+	#Eurggh too clever
+	return [int(val) if val != '' else 0 for val in valuestring.strip('{}()').split(',')]
+	#return [int('0'+val) for val in valuestring.strip('{}()').split(',')]
+
+##################################
+# Documents
+##################################
+
+# The score_notes columns held for each note, besides work_id and note_id
+scoreNoteColumns = ('voice', 'part_id', 'type', 'onset', 'duration', 'pitch')
+
+# and the adapters converting those which have compact types
+_scoreNoteAdapters = {'onset': asScoreTime, 'duration': asScoreTime, 'pitch': asPitch}
+
+# A new stamp is taken for each change to the notes of a NoteColumns,
+# and for each fetch of a document's note groups, so that equal stamps
+# mean equal contents (see _voiceKey())
+_stamps = count()
+
+scoreNoteQuery = """select * from score_notes
+	where work_id = any($1)
+	order by work_id, note_id;"""
+
+class NoteColumns(Mapping):
+	"""The notes of one work in a document, stored column by column
+
+	Each score_notes column is a list with an entry per note, and
+	note_index maps note_id to the position in the lists. Onsets and
+	durations are held as SpoffScoreTimes and pitches as SpoffPitches
+	(None for a rest). Annotations added to notes are kept in a
+	dictionary per annotation name. stamp changes whenever the notes do
+	(not the annotations). Values, and their conversions from
+	text, are shared with the NoteColumns shared if given, e.g. the
+	first work of the same document.
+
+	It presents itself as the dictionary of note_id to note dictionaries
+	which populatedocument() builds, so doc2lilypond() and the annotation
+	functions can use either. The notes are NoteViews onto the columns.
+
+	>>> notes = NoteColumns()
+	>>> notes.append({'note_id':3, 'voice':1, 'part_id':'XPart 0', 'type':'pitch',
+	...               'onset':'(1,1)', 'duration':'(1,4)', 'pitch':'(1,1,4)'})
+	>>> notes[3]['onset'], 3 in notes, len(notes)
+	(SpoffScoreTime(crotchet_numerator=1, crotchet_denominator=1), True, 1)
+	>>> notes[3]['intervs'] = ['P5']
+	>>> notes[3].get('intervs'), 'intervs' in notes[3], notes[3].get('ioi')
+	(['P5'], True, None)
+	"""
+
+	def __init__(self, shared=None):
+		self.note_id = []
+		self.columns = dict((name, []) for name in scoreNoteColumns)
+		self.note_index = {}
+		self.annotations = {}
+		self.stamp = next(_stamps)
+		if shared is None:
+			self._values = {}
+			self._converted = {}
+		else:
+			self._values = shared._values
+			self._converted = shared._converted
+		self._ticks = None
+
+	def append(self, row):
+		"""Add a score_notes row (a dictionary)"""
+		self.extend([row])
+
+	def extend(self, rows):
+		"""Add score_notes rows (dictionaries); repeated values are shared"""
+		self._ticks = None
+		self.stamp = next(_stamps)
+		first = len(self.note_id)
+		self.note_id.extend([row['note_id'] for row in rows])
+		for row, note_id in enumerate(self.note_id[first:], first):
+			self.note_index[note_id] = row
+		share = self._values.setdefault
+		for name in scoreNoteColumns:
+			column = [row[name] for row in rows]
+			adapter = _scoreNoteAdapters.get(name)
+			try:
+				if adapter is None:
+					column = [share(value, value) for value in column]
+				else:
+					# each distinct value is converted, and shared, once
+					converted = self._converted.setdefault(name, {})
+					for value in set(column).difference(converted):
+						compact = adapter(value)
+						converted[value] = share(compact, compact)
+					column = [converted[value] for value in column]
+			except TypeError:
+				# unhashable, e.g. dictionaries from plpy
+				if adapter is not None:
+					column = [adapter(value) for value in column]
+			self.columns[name].extend(column)
+
+	def __getitem__(self, note_id):
+		return NoteView(self, self.note_index[note_id])
+
+	def scoreTicks(self):
+		"""The onsets and durations of the notes as a ScoreTicks, indexed
+		like the columns; made once and kept until they change"""
+		if self._ticks is None:
+			self._ticks = ScoreTicks(self.columns['onset'], self.columns['duration'])
+		return self._ticks
+
+	def __iter__(self):
+		return iter(self.note_id)
+
+	def __len__(self):
+		return len(self.note_id)
+
+	def __contains__(self, note_id):
+		return note_id in self.note_index
+
+class NoteView(MutableMapping):
+	"""One note of a NoteColumns, used like a populatedocument() note dictionary
+
+	Setting a key which is not a score_notes column adds an annotation.
+	"""
+	__slots__ = ('notes', 'row')
+
+	def __init__(self, notes, row):
+		self.notes = notes
+		self.row = row
+
+	def __getitem__(self, key):
+		column = self.notes.columns.get(key)
+		if column is not None:
+			return column[self.row]
+		return self.notes.annotations[key][self.row]
+
+	def get(self, key, default=None):
+		column = self.notes.columns.get(key)
+		if column is not None:
+			return column[self.row]
+		return self.notes.annotations.get(key, {}).get(self.row, default)
+
+	def __setitem__(self, key, value):
+		column = self.notes.columns.get(key)
+		if column is not None:
+			column[self.row] = value
+			self.notes.stamp = next(_stamps)
+			if key == 'onset' or key == 'duration':
+				self.notes._ticks = None
+		else:
+			self.notes.annotations.setdefault(key, {})[self.row] = value
+
+	def __delitem__(self, key):
+		if key in self.notes.columns:
+			raise KeyError('score_notes column %s cannot be removed' % key)
+		del self.notes.annotations[key][self.row]
+
+	def __contains__(self, key):
+		return key in self.notes.columns or self.row in self.notes.annotations.get(key, ())
+
+	def __iter__(self):
+		for key in scoreNoteColumns:
+			yield key
+		for key, values in self.notes.annotations.items():
+			if self.row in values:
+				yield key
+
+	def __len__(self):
+		return len(list(iter(self)))
+
+def documentFromRows(rows):
+	"""Build a document (as used by doc2lilypond) from score_notes rows
+
+	The notes of each work are stored in a NoteColumns, in the order of
+	the rows.
+
+	>>> doc = documentFromRows([
+	...   {'work_id':0, 'note_id':0, 'voice':1, 'part_id':'XPart 0', 'type':'rest',
+	...    'onset':'(0,1)', 'duration':'(1,1)', 'pitch':'(,1,)'}])
+	>>> sorted(doc['noteData'][0][0].items())[2:]
+	[('part_id', 'XPart 0'), ('pitch', None), ('type', 'rest'), ('voice', 1)]
+	"""
+	workRows = {}
+	for row in rows:
+		workRows.setdefault(row['work_id'], []).append(row)
+	noteData = {}
+	shared = None
+	for work_id, rows in workRows.items():
+		noteData[work_id] = NoteColumns(shared)
+		noteData[work_id].extend(rows)
+		if shared is None:
+			shared = noteData[work_id]
+	return {'noteData': noteData}
+
+def buildDocument(plpy, work_ids):
+	"""Build a document of all the notes in work_ids with one query"""
+	plan = plpy.prepare(scoreNoteQuery, ["int[]"])
+	return documentFromRows(plpy.execute(plan, [asIntArray(work_ids)]))
+
+# Every note group of every note in the given works, for noteGroupIndex()
+noteGroupQuery = """select ngsn.score_note_work_id as work_id, ngsn.score_note_note_id as note_id,
+		ng.id, ng.type, ng.comment, ng.value
+	from note_groups as ng
+		inner join note_groups__score_notes as ngsn on (ng.id = ngsn.note_group_id)
+	where ngsn.score_note_work_id = any($1)
+	order by ngsn.score_note_work_id, ngsn.score_note_note_id, ng.id;"""
+
+def noteGroupIndex(rows):
+	"""Index note group rows by (work_id, note_id)
+
+	rows are those returned by noteGroupQuery. Returns a dictionary
+	mapping (work_id, note_id) to the list of that note's groups, each a
+	dictionary of 'id', 'type', 'comment' and 'value', with value parsed
+	by asIntArray().
+
+	>>> index = noteGroupIndex([
+	...   {'work_id':0, 'note_id':3, 'id':7, 'type':'key', 'comment':None, 'value':'{-1}'},
+	...   {'work_id':0, 'note_id':3, 'id':9, 'type':'tie', 'comment':None, 'value':'{3,4}'}])
+	>>> [(g['type'], g['value']) for g in index[(0, 3)]]
+	[('key', [-1]), ('tie', [3, 4])]
+	"""
+	index = {}
+	for row in rows:
+		group = {'id': row['id'], 'type': row['type'], 'comment': row['comment'],
+			'value': asIntArray(row['value'])}
+		index.setdefault((row['work_id'], row['note_id']), []).append(group)
+	return index
+
+def fetchNoteGroups(plpy, work_ids):
+	"""Fetch the note groups of all the notes in work_ids with one query
+	and return them indexed by noteGroupIndex()"""
+	plan = plpy.prepare(noteGroupQuery, ["int[]"])
+	return noteGroupIndex(plpy.execute(plan, [list(work_ids)]))
+
+##################################
+# Rendered fragment cache
+##################################
+
+class FragmentCache(object):
+	"""A bounded cache of rendered voices, keyed by a hash of their inputs
+
+	Each fragment is stamped when it is used; when maxsize fragments are
+	held, the least recently used quarter are dropped together, as in
+	lruCache(). A maxsize of 0 turns the cache off.
+
+	>>> cache = FragmentCache(4)
+	>>> for key in 'abcd': cache.put(key, key.upper())
+	>>> cache.get('a'), cache.get('x')
+	('A', None)
+	>>> cache.put('e', 'E')
+	>>> sorted(cache.fragments), sorted(cache.stats().items())
+	(['a', 'c', 'd', 'e'], [('evictions', 1), ('fragments', 4), ('hits', 1), ('maxsize', 4), ('misses', 1)])
+	"""
+
+	def __init__(self, maxsize=4096):
+		self.maxsize = maxsize
+		self.fragments = {}
+		self._clock = count()
+		self.hits = self.misses = self.evictions = 0
+
+	def get(self, key):
+		"""The fragment stored under key, or None"""
+		entry = self.fragments.get(key)
+		if entry is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		entry[1] = next(self._clock)
+		return entry[0]
+
+	def put(self, key, fragment):
+		if len(self.fragments) >= self.maxsize:
+			stale = sorted(self.fragments.items(), key=lambda item: item[1][1])
+			for staleKey, entry in stale[:max(1, self.maxsize // 4)]:
+				del self.fragments[staleKey]
+				self.evictions += 1
+		self.fragments[key] = [fragment, next(self._clock)]
+
+	def clear(self):
+		"""Drop the fragments and zero the counters"""
+		self.fragments.clear()
+		self.hits = self.misses = self.evictions = 0
+
+	def stats(self):
+		return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+			'fragments': len(self.fragments), 'maxsize': self.maxsize}
+
+# doc2lilypond() keeps each voice it renders here, so that when a document
+# is rendered again, e.g. after adding a layer of annotations, only the
+# voices whose notes, note groups or shown annotations changed are
+# rendered again. The cache lasts as long as the backend.
+FRAGMENT_CACHE_SIZE = 4096
+fragmentCache = FragmentCache(FRAGMENT_CACHE_SIZE)
+
+def setFragmentCacheSize(maxsize):
+	"""Set the number of rendered voices kept (0 for none) and return the
+	previous number; the cache is emptied"""
+	previous = fragmentCache.maxsize
+	fragmentCache.clear()
+	fragmentCache.maxsize = maxsize
+	return previous
+
+def _voiceKey(work, part_id, voice, workNotes, noteList, noteGroups, groupStamp, lineNames, staff):
+	# A hash of everything the rendering of a voice depends on: its notes,
+	# the type, value and id of their note groups, the annotations shown
+	# under it and the key, clef and time in force at its start. The notes
+	# of a NoteColumns and the note groups kept in a document stand for
+	# themselves by their stamps, so only the annotations shown are read;
+	# other notes are read whole. marshal format 0 gives the same bytes for
+	# equal values, dictionaries being taken as their sorted items.
+	annotationNames = [name for names in lineNames if names != None for name in names]
+	inputs = [work, part_id, voice, staff, lineNames]
+	if workNotes.__class__ is NoteColumns:
+		inputs.append(workNotes.stamp)
+		rows = [note.row for (note_id, note) in noteList]
+		for name in annotationNames:
+			values = workNotes.annotations.get(name, {})
+			inputs.append([(row in values, _plainValue(values.get(row))) for row in rows])
+	else:
+		inputs.append([note_id for (note_id, note) in noteList])
+		for note_id, note in noteList:
+			inputs.append((note['type'], _plainValue(note['pitch']),
+				_plainValue(note['onset']), _plainValue(note['duration']),
+				[(name in note, _plainValue(note.get(name))) for name in annotationNames]))
+	if groupStamp is not None:
+		inputs.append(groupStamp)
+	else:
+		groupsOf = noteGroups.get
+		for note_id, note in noteList:
+			inputs.append([(group['id'], group['type'], group['value'])
+				for group in groupsOf((work, note_id), ()) if group != None])
+	try:
+		data = marshal.dumps(inputs, 0)
+	except ValueError:
+		data = repr(inputs).encode('utf-8')	# e.g. Decimal annotations
+	return hashlib.sha1(data).digest()
+
+def _plainValue(value):
+	# the compact types as plain tuples, which marshal takes, and
+	# dictionaries as their sorted items
+	if value.__class__ is SpoffPitch or value.__class__ is SpoffScoreTime:
+		return value[:]
+	if isinstance(value, dict):
+		return [(key, _plainValue(item)) for (key, item) in sorted(value.items())]
+	return value
+
+##################################
+# Lilypond
+##################################
+
+# The start of the lilypond file, up to the \book
+_lilypondHeader = """\\version "2.12.1"
+
+	\pointAndClickOff
+	valueboxheight = 10
+	valueboxwidth = 1
+	% #(define-markup-command (valuebox layout props value) (number?)
+	%	(interpret-markup layout props (markup ( #:rounded-box ( #:with-color 'white #:filled-box #'(0 . 5) #'(0 . \\valueboxheight) #0 )))))
+	#(define-markup-command (valuebox layout props val) (number?)
+              "Draws 2 boxes - one containing val as text, one containing val as a line graph - in a column"
+                 (interpret-markup layout props
+                  (markup  
+                   #:center-column 
+                    (#:override '(box-padding . 0.1)
+                    #:rounded-box 
+                     (markup #:override '(font-size . -5) 
+                      (format #f "~$" val))
+                       #:override '(box-padding . 0.1)
+                        #:rounded-box 
+                         (#:combine
+                          (#:combine
+                           #:with-color (x11-color 'white)  #:filled-box `(0 . ,valueboxwidth) `(0 . ,valueboxheight) 0 
+                            ;; #:with-color (x11-color 'pink)  #:filled-box `(0 . ,valueboxwidth) `(,(/ valueboxheight 2) . ,(+ 5 val)) 0 )
+                            #:with-color (x11-color 'blue)  #:filled-box `(0 . ,valueboxwidth) `(0 . ,(* 8 val)) 0 )
+                             ;; #:translate `(-0.1 . ,(/ valueboxheight 2)) #:draw-line `(,(+ 0.2 valueboxwidth) . 0)) 
+                             #:translate `(-0.5 . 0) #:draw-line `(,(+ 1 valueboxwidth) . 0)) 
+                    ))))
+ 
+linegraphboxheight = 10
+linegraphboxwidth = 5
+linegraphscalefactor = 1
+linegraphbias = 0
+
+#(define (pslines prev_x x_inc y_list)
+  (if (> (length y_list) 0)
+   (format #f "~$ ~$ ~a~a" (exact->inexact (+ prev_x x_inc)) (* linegraphscalefactor (+ (car y_list) linegraphbias)) "lineto\n" (pslines (+ prev_x x_inc) x_inc (cdr y_list)))
+   ""
+   ))
+
+#(define (generate-ps y_list)
+  (format #f "~$ ~$ ~a~a~a" '0 (* linegraphscalefactor (+ (car y_list) linegraphbias)) "moveto\n" (pslines '0 (/ linegraphboxwidth (- (length y_list) 1)) (cdr y_list)) "stroke"))
+
+#(define-markup-command (linegraphbox layout props y_list) (list?)
+              "draws a line graph from  a list of values in fixed size box"
+                 (interpret-markup layout props
+                  (markup
+		   (#:rounded-box
+		     (#:combine
+		     #:with-color (x11-color 'white) #:filled-box `(0 . ,linegraphboxwidth) `(0 . ,linegraphboxheight) 0
+		     #:with-color (x11-color 'red) #:postscript (generate-ps y_list )
+		     )))))
+	
+		#(define (startbracket x) (
+	 (ly:context-set-property 'Voice textval $x)))
+
+	%%#(define-markup-command (stopbracket layout props val)(number?)
+	%%   (interpret-markup layout props (markup textval)))
+	#(define-markup-command (stopbracket layout props val) (string?)
+	  (interpret-markup layout props (markup #:ly:context-property 'textval 'Voice)))
+	   \\layout {
+	    \\context {
+	     \\Voice
+	      \\consists "Horizontal_bracket_engraver"
+	    }
+	   }
+	  \\paper { ragged-right = ##f } \n\n
+"""
+
+def doc2lilypondChunks(doc, plpy, processes=None):
+	""" Takes a data structure (defined below) and generates lilypond markup
+
+	The markup comes in chunks: the header, then each voice followed by
+	its \\addlyrics lines, then the end of each score, so no more than
+	one voice's worth of output is held at a time. doc2lilypond() joins
+	the chunks and writeLilypond() copies them to a file.
+
+	Each work is rendered on its own (see _workChunks()). With processes
+	greater than 1, the works are rendered concurrently by a pool of that
+	many processes and their chunks generated in document order, a work
+	at a time; the output is the same. This is for large documents
+	outside the database: not inside a plpythonu function, where the
+	backend should not be forked. Only the note group fetch is traced.
+
+	Rendered voices are kept in fragmentCache and reused while their
+	inputs are unchanged. In the pool, each worker starts with a copy of
+	the cache and what it adds is lost. The note groups are fetched when
+	a document is first rendered, and kept in it as "noteGroups" like its
+	notes, until works are added: build the document again to see note
+	groups changed since.
+	
+	Data Structure:
+	
+	GD {
+		doc {
+			"textUnderList" {
+				part_id {
+					voice [
+						"melodic_intervals",
+						"chord_names", ...]
+			"barGraphList" [
+				"MIDI_velocity",
+				"ioi", ... ]
+			... #other display methods
+			"noteData" {
+				work_id {
+					note_id {
+						"pitch": (0,1,0), "onset": (0,1,2), ... #rest of score_note type
+						"melodic_intervals": 5, "MIDI_velocity": 99, "ioi": 32 ... }
+					...}
+				...}
+		...}
+	}"""
+
+	#get group data
+	
+	
+						#> if unsuccessful output a skip to the lyric
+					# as above for each bargraph entry, etc
+	
+	# collect all the lists into one big string including headers
+	
+	# Lilypond file structure - don't forget to escape the \'s: \ -> \\
+	# \book {							;;one per document
+	# 	\score {						;;one per work
+	#		\new Staff = "part_id" << 			;;one per part
+	#			\new Voice {				;;one per voice
+	#			}
+	#			\addLyrics {				;;one per data list
+	#			}
+	#		>>
+	#	}
+	# }
+
+	groupStamp, noteGroups = _documentNoteGroups(doc, plpy)
+	yield _lilypondHeader + '\\book {\n'
+	lineLists = dict((name, doc[name]) for name in _lineListNames if name in doc)
+	noteData = doc['noteData']
+	if processes is not None and processes > 1:
+		works = _renderWorksInPool(noteData, noteGroups, groupStamp, lineLists, processes)
+	else:
+		works = (_workChunks(work, noteData[work], noteGroups, lineLists, groupStamp)
+			for work in noteData.iterkeys())
+	for chunks in works:
+		for chunk in chunks:
+			yield chunk
+	yield '}\n'
+
+# The document's lists of annotations to display under each part and voice
+_lineListNames = ('textUnderList', 'barGraphList', 'lineGraphList')
+
+def _documentNoteGroups(doc, plpy):
+	# (stamp, note groups) of the works of doc: fetched when it is first
+	# rendered and kept in doc, as its notes are, until its works change
+	work_ids = frozenset(doc['noteData'])
+	kept = doc.get('noteGroups')
+	if kept is None or kept[0] != work_ids:
+		tracing = traceLevel >= TRACE_TIMING
+		if tracing:
+			start = _clock()
+		kept = doc['noteGroups'] = (work_ids, next(_stamps), fetchNoteGroups(plpy, work_ids))
+		if tracing:
+			_traceTime('group fetch', None, None, None, start)
+	return kept[1], kept[2]
+
+def _renderWorksInPool(noteData, noteGroups, groupStamp, lineLists, processes):
+	# Render the works in a pool of processes, generating the chunks of
+	# each in document order. Each worker is sent one work's notes and
+	# note groups.
+	import multiprocessing
+	workGroups = {}
+	for key, groups in noteGroups.iteritems():
+		workGroups.setdefault(key[0], {})[key] = groups
+	tasks = ((work, noteData[work], workGroups.get(work, {}), lineLists, groupStamp)
+		for work in noteData.iterkeys())
+	pool = multiprocessing.Pool(processes)
+	try:
+		for chunks in pool.imap(_renderWork, tasks):
+			yield chunks
+	finally:
+		pool.terminate()
+		pool.join()
+
+def _renderWork(task):
+	# a process pool worker: the chunks of one work
+	return list(_workChunks(*task))
+
+def _workChunks(work, workNotes, noteGroups, lineLists, groupStamp=None):
+	"""Generate the \\score of one work in chunks, as doc2lilypondChunks()
+
+	The output depends only on the work's notes (a note_id to note
+	mapping), noteGroups (as from fetchNoteGroups(), for at least this
+	work) and lineLists (the document's textUnderList, barGraphList and
+	lineGraphList), so works can be rendered independently. groupStamp,
+	if given, stands for noteGroups in the keys of fragmentCache (see
+	_documentNoteGroups()).
+	"""
+	traceVoices = traceLevel >= TRACE_VOICES
+	notes = list(workNotes.iteritems())
+	lilyList = ['\t\\score { <<\n']
+	partSet = set( [note['part_id'] for (note_id, note) in notes] )
+	if traceVoices:
+		trace(TRACE_VOICES, 'doc2lilypond: work %s: partSet: %s', work, partSet)
+	for part_id in partSet:
+		lilyList.append('\t\t \\new Staff = \"%s\" \n <<' % (part_id))
+		voiceSet = set( [note['voice'] for (note_id, note) in notes] )
+		if traceVoices:
+			trace(TRACE_VOICES, 'doc2lilypond: part ID: %s, voiceSet: %s', part_id, voiceSet)
+		# key, clef and time carry on from voice to voice within a part,
+		# and are re-evaluated for each part
+		staff = (None, None, None)
+		for voice in voiceSet:
+			noteList = [noteTuple for noteTuple in notes if noteTuple[1]['part_id']==part_id and noteTuple[1]['voice']==voice]
+			lineNames = _voiceLineNames(lineLists, part_id, voice)
+			if fragmentCache.maxsize:
+				key = _voiceKey(work, part_id, voice, workNotes, noteList, noteGroups, groupStamp,
+					lineNames, staff)
+				fragment = fragmentCache.get(key)
+				if fragment is None:
+					fragment = _renderVoice(work, part_id, voice, noteList, noteGroups, lineNames, staff)
+					fragmentCache.put(key, fragment)
+				elif traceVoices:
+					trace(TRACE_VOICES, 'doc2lilypond: part ID: %s, voice: %d, from the fragment cache',
+						part_id, voice)
+			else:
+				fragment = _renderVoice(work, part_id, voice, noteList, noteGroups, lineNames, staff)
+			voiceList, lyricLines, staff = fragment
+			lilyList.extend(voiceList)
+			yield ''.join(lilyList)
+			lilyList = []
+			for lyricLine in lyricLines:
+				yield lyricLine
+		lilyList.append('>> \n')
+	lilyList.append('\t>> }\n')
+	yield ''.join(lilyList)
+
+def _voiceLineNames(lineLists, part_id, voice):
+	# The names of the text, bar graph and line graph annotations to show
+	# under a voice (None where there are none)
+	names = []
+	for listName in _lineListNames:
+		lines = lineLists.get(listName, {})
+		if part_id in lines and voice in lines[part_id]:
+			names.append(lines[part_id][voice])
+		else:
+			names.append(None)
+	return tuple(names)
+
+def _renderVoice(work, part_id, voice, noteList, noteGroups, lineNames, staff):
+	"""Render one voice of one part of a work
+
+	noteList is the voice's (note_id, note) pairs, which are rendered in
+	onset order, lineNames the annotations to show under it (from
+	_voiceLineNames()) and staff the (key, clef, time) in force. Returns
+	the lilypond markup, the \\addlyrics lines and the (key, clef, time)
+	at the end, as tuples.
+	"""
+	tracing = traceLevel >= TRACE_TIMING
+	traceVoices = traceLevel >= TRACE_VOICES
+	traceNotes = traceLevel >= TRACE_NOTES
+	keysig, clef, time = staff
+	tieString = ''
+	inTie = False
+	startTie = False
+	endTie = False
+	slurString = ''
+	previousChord = False
+	currentChord = False
+	chordEndString  = ''
+	chordStartString = ''
+	textUnderLineDict = {}
+	textUnderLineStrings = {}
+	barGraphLineDict = {}
+	lineGraphLineDict = {}
+
+	# Check if current part/voice combo has any lyric lines to add.
+	# If so, set up necessary variables to store them in.
+	textUnderLineNames, barGraphLineNames, lineGraphLineNames = lineNames
+	if textUnderLineNames != None:
+		for textUnderLine in textUnderLineNames:
+			textUnderLineDict[textUnderLine] = []
+	if barGraphLineNames != None:
+		for barGraphLine in barGraphLineNames:
+			barGraphLineDict[barGraphLine] = []
+	if lineGraphLineNames != None:
+		for lineGraphLine in lineGraphLineNames:
+			lineGraphLineDict[lineGraphLine] = []
+	if tracing:
+		start = _clock()
+	# whoah! Exxxtreeme Python! for each note in current part and voice, sorted by onset time
+	noteList = sorted(noteList, key=lambda note: scoreTimeKey(asScoreTime(note[1]['onset'])))
+	if tracing:
+		_traceTime('sort', work, part_id, voice, start)
+		start = _clock()
+	if traceVoices:
+		trace(TRACE_VOICES, 'doc2lilypond: part ID: %s, voice: %d, noteList length: %d',
+			part_id, voice, len(noteList))
+	lilyList = ['\t\t\t {\n']
+	for note in noteList:
+		if traceNotes:
+			trace(TRACE_NOTES, 'doc2lilypond: noteid: %d, %s', note[0], note[1])
+		currentChord = False
+		noteGroupList = noteGroups.get((work, note[0]), [])
+		#noteGroupList = []
+		for noteGroup in noteGroupList:
+			if noteGroup == None:
+				continue
+			if traceNotes:
+				trace(TRACE_NOTES, 'doc2lilypond: noteid: %d, noteGroup: %s', note[0], noteGroup['type'])
+			valueList = noteGroup['value']
+			if 'key' in noteGroup['type']:
+				if (keysig == None) or (keysig != valueList):
+					keyString = mxmlKeySig2lily(valueList[0])
+					#keyString = naturals.keys()[naturals.values().index(valueList[0])].lower()
+					#TODO: properly deal with modes
+					mode = 'major'
+					lilyList.append(' \\key ' + keyString + ' \\' + mode + ' ')
+					keysig = valueList
+			elif 'clef' in noteGroup['type']:
+				if (clef == None) or (clef != valueList):
+					if valueList == [0,4]:
+						lilyList.append(' \\clef bass ')
+						clef = valueList
+					elif valueList == [2,2]:
+						lilyList.append(' \\clef treble ')
+						clef = valueList
+					else:
+						lilyList.append(' ;unknown clef %s\n' % str(valueList))
+						clef = 'unknown'
+			if 'time' in noteGroup['type']:
+				if (time == None) or (valueList != time):
+					lilyList.append(' \\time %d/%d ' % (valueList[0], valueList[1]))
+					time = valueList
+
+			if 'tie' in noteGroup['type']:
+				#TODO get value as a list
+				if valueList[0] == int(note[0]):
+					tieString = ' ~ '
+					startTie = True
+					endTie = False
+				else:
+					startTie = False
+					endTie = True
+
+			if 'slur' in noteGroup['type']:
+				#TODO get value as list
+				if valueList[0] == note[0]:
+					#we are starting a slur
+					slurString = ' ( ' 	#Spaces or no spaces?
+				if valueList[1] == note[0]:
+					#we are ending a slur
+					slurString = ' ) '	#Spaces or no spaces?
+
+			if 'chord' in noteGroup['type']:
+				currentChord = noteGroup['id']	
+
+			#TODO add code for slurs, ties, tuplets
+					
+		#TODO get the order right! output note before or after '>' or '<'
+
+		#Are we in a tie?
+		inTie = any(['tie' in x['type'] for x in noteGroupList])
+		if currentChord and not previousChord:
+			# start a chord, previous notes not in chord 
+			chordStartString = ' < '
+			durationString = ''
+			chordEndString = ''
+			if textUnderLineNames != None and (startTie or not inTie):
+				for textUnderLine in textUnderLineNames:
+					textUnderLineValue = note[1].get(textUnderLine, '')
+					textUnderLineDict[textUnderLine].append('\\markup {\\column {')
+					# The order of lines has to be reversed for the column
+					# to be the right way up, so we'll just build a list of
+					# stings to use later
+					textUnderLineStrings = \
+					  { textUnderLine: [ ' '.join(('\\tiny %s' % str(x) for x in textUnderLineValue)) ] }
+					if traceNotes:
+						trace(TRACE_NOTES, "Starting chord. textUnderLineStrings=%s", textUnderLineStrings[textUnderLine])
+			#output bargraph here
+			if barGraphLineNames != None:
+				for barGraphLine in barGraphLineNames:
+					barGraphLineValue = note[1].get(barGraphLine, None)
+					valuebox = ' \\valuebox #%s ' % str(barGraphLineValue) if barGraphLineValue != None else '{}'
+					barGraphLineDict[barGraphLine].append(' \\markup %s ' % valuebox)
+			#output linegraph here
+			if lineGraphLineNames != None:
+				for lineGraphLine in lineGraphLineNames:
+					lineGraphLineValue = note[1].get(lineGraphLine, [])
+					lineGraphValueString = [str(x) for x in lineGraphLineValue]
+					linegraphbox = ' \\linegraphbox #\'(%s) ' % ' '.join(lineGraphValueString) if lineGraphLineValue != [] else '{}'
+					lineGraphLineDict[lineGraphLine].append(' \\markup %s ' % linegraphbox)
+
+	
+		elif currentChord and previousChord:
+			if currentChord == previousChord:
+				#continuation of a chord
+				#pass
+				chordStartString = ''
+				durationString = ''
+				chordEndString = ''
+				if textUnderLineNames != None and (startTie or not inTie):
+					for textUnderLine in textUnderLineNames:
+						textUnderLineValue = note[1].get(textUnderLine, '')
+						textUnderLineStrings[textUnderLine].append(' '.join(('\\tiny %s' % str(x) for x in textUnderLineValue)))
+						if traceNotes:
+							trace(TRACE_NOTES, "Chord continues. textUnderLineStrings=%s", textUnderLineStrings[textUnderLine])
+
+			else:
+				# end a chord, start a new chord
+				chordStartString = ' >%s < ' % spoff_time2lily(previousDuration)
+				durationString = ''
+				chordEndString = ''
+				if textUnderLineNames != None and (startTie or not inTie):
+					for textUnderLine in textUnderLineNames:
+						textUnderLineValue = note[1].get(textUnderLine, '')
+						textUnderLineStrings.append(' '.join(('\\tiny %s' % str(x) for x in textUnderLineValue)))
+						if traceNotes:
+							trace(TRACE_NOTES, "End of chord; starting new. textUnderLineStrings=%s", textUnderLineStrings[textUnderLine])
+						textUnderLineDict[textUnderLine].append(
+						  ' '.join( [ '\\line{ %s } ' % str(x) for x in \
+						       reversed(textUnderLineStrings[textUnderLine]) ] ))
+						textUnderLineStrings[textUnderLine]=[]
+						textUnderLineDict[textUnderLine].append('}} \\markup {\\column { ')
+				#output bargraph here
+				if barGraphLineNames != None:
+					for barGraphLine in barGraphLineNames:
+						barGraphLineValue = note[1].get(barGraphLine, None)
+						valuebox = ' \\valuebox #%s ' % str(barGraphLineValue) if barGraphLineValue != None else '{}'
+						barGraphLineDict[barGraphLine].append(' \\markup %s ' % valuebox)
+				#output linegraph here
+				if lineGraphLineNames != None:
+					for lineGraphLine in lineGraphLineNames:
+						lineGraphLineValue = note[1].get(lineGraphLine, [])
+						lineGraphValueString = [str(x) for x in lineGraphLineValue]
+						linegraphbox = ' \\linegraphbox #\'(%s) ' % ' '.join(lineGraphValueString) if lineGraphLineValue != [] else '{}'
+						lineGraphLineDict[lineGraphLine].append(' \\markup %s ' % linegraphbox)
+
+
+		elif previousChord and not currentChord:
+			#end a chord
+			chordStartString = ' >%s ' % spoff_time2lily(previousDuration)
+			durationString = spoff_time2lily(note[1]['duration'])
+			chordEndString = ''
+			if textUnderLineNames != None and (startTie or not inTie):
+				for textUnderLine in textUnderLineNames:
+					textUnderLineValue = note[1].get(textUnderLine, '')
+					textUnderLineStrings[textUnderLine].append(' '.join(('\\tiny %s' % str(x) for x in textUnderLineValue)))
+					if traceNotes:
+						trace(TRACE_NOTES, "End of chord. textUnderLineStrings=%s", textUnderLineStrings[textUnderLine])
+					textUnderLineDict[textUnderLine].append(
+						  ' '.join( [ '\\line{ %s } ' % str(x) for x in \
+						       reversed(textUnderLineStrings[textUnderLine]) ] ))
+					textUnderLineStrings[textUnderLine]=[]
+					textUnderLineDict[textUnderLine].append(' }} ')
+
+		else:
+			#previousChord and currentChord are false
+			#we are not in a chord
+			chordStartString = ''
+			durationString = spoff_time2lily(note[1]['duration'])
+			chordEndString = ''
+			#add lyric lines for text under 
+			if 'rest' in note[1]['type']:
+				pass
+			else:
+				if textUnderLineNames != None and (startTie or not inTie):
+					for textUnderLine in textUnderLineNames:
+						textUnderLineValue = note[1].get(textUnderLine, '')
+						textUnderLineDict[textUnderLine].append('\\markup {%s}' % ' '.join(('\\tiny %s' % str(x) for x in textUnderLineValue)))
+				#output bargraph here
+				if barGraphLineNames != None and (startTie or not inTie):
+					for barGraphLine in barGraphLineNames:
+						barGraphLineValue = note[1].get(barGraphLine, None)
+						valuebox = ' \\valuebox #%s ' % str(barGraphLineValue) if barGraphLineValue != None else '{}'
+						barGraphLineDict[barGraphLine].append(' \\markup %s ' % valuebox)
+				#output linegraph here
+				if lineGraphLineNames != None and (startTie or not inTie):
+					for lineGraphLine in lineGraphLineNames:
+						lineGraphLineValue = note[1].get(lineGraphLine, [])
+						lineGraphValueString = [str(x) for x in lineGraphLineValue]
+						linegraphbox = ' \\linegraphbox #\'(%s) ' % ' '.join(lineGraphValueString) if lineGraphLineValue != [] else '{}'
+						lineGraphLineDict[lineGraphLine].append(' \\markup %s ' % linegraphbox)
+
+
+			
+		#NB: we only output a barGraph or a lineGraph on the first note of a chord which shows up. It will not necessarily be the highest or lowest. It will be the first note which is returned by the query. It might be useful to consider using an 'order by pitch' clause in queries to ensure consistancy.
+		# output note here!!
+		if 'pitch' in note[1]['type']:
+			noteString = spoff_pitch2lily(note[1]['pitch'])
+		elif 'rest' in note[1]['type']:
+			noteString = 'r'
+
+		else:
+			noteString = 'unknown type at %s' % note[0]
+		lilyList.extend([' ', chordStartString, noteString, durationString, slurString, tieString, chordEndString ])
+		#previousNote = note
+		previousChord = currentChord
+		previousDuration = note[1]['duration']
+		tieString = ''
+		slurString = ''
+		#experimental bit follows!!
+		chordStartString = ''
+		chordEndString = ''
+		endTie = False
+	#check for an unfinished chord
+	if currentChord:
+		lilyList.append(' >%s ' % spoff_time2lily(previousDuration))
+		if textUnderLineNames != None:
+			for textUnderLine in textUnderLineNames:
+				if traceNotes:
+					trace(TRACE_NOTES, "Unfinished chord: textUnderLineStrings=%s", textUnderLineStrings[textUnderLine])
+				textUnderLineDict[textUnderLine].append(
+						  ' '.join( [ '\\line{ %s } ' % str(x) for x in \
+						       reversed(textUnderLineStrings[textUnderLine]) ] ))
+				textUnderLineDict[textUnderLine].append('}} %% %s\n\t\t' % textUnderLine)
+	lilyList.append('\t\t\t}\n')
+	if tracing:
+		_traceTime('note emission', work, part_id, voice, start)
+		start = _clock()
+	lyricLines = []
+	if textUnderLineNames != None:
+		for textUnderLine in textUnderLineNames:
+			lyricLines.append('\t\t\t\\addlyrics { ' + ' '.join(textUnderLineDict.get(textUnderLine, '')) + ' }\n')
+	if barGraphLineNames != None:
+		for barGraphLine in barGraphLineNames:
+			lyricLines.append('\t\t\t\\addlyrics { ' + ' '.join(barGraphLineDict[barGraphLine]) + ' }\n')
+	if lineGraphLineNames != None:
+		for lineGraphLine in lineGraphLineNames:
+			lyricLines.append('\t\t\t\\addlyrics { ' + ' '.join(lineGraphLineDict[lineGraphLine]) + ' }\n')
+	if tracing:
+		_traceTime('lyric assembly', work, part_id, voice, start)
+	return tuple(lilyList), tuple(lyricLines), (keysig, clef, time)
+
+def doc2lilypond(doc, plpy, processes=None):
+	"""Return the lilypond markup for doc (see doc2lilypondChunks) as one string
+
+	>>> class NoGroups(object):
+	...   def prepare(self, query, types): return query
+	...   def execute(self, plan, args): return []
+	>>> doc = documentFromRows([{'work_id':w, 'note_id':n, 'voice':1, 'part_id':'XPart 0',
+	...   'type':'pitch', 'onset':(n,1), 'duration':(1,1), 'pitch':(n,1,4)}
+	...   for w in range(3) for n in range(4)])
+	>>> doc2lilypond(doc, NoGroups()) == doc2lilypond(doc, NoGroups(), processes=2)
+	True
+	"""
+	return ''.join(doc2lilypondChunks(doc, plpy, processes))
+
+def writeLilypond(doc, plpy, sink, processes=None):
+	"""Write the lilypond markup for doc to the file-like object sink as it
+	is generated, one chunk at a time (see doc2lilypondChunks)"""
+	for chunk in doc2lilypondChunks(doc, plpy, processes):
+		sink.write(chunk)
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
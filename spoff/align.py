@@ -0,0 +1,372 @@
+"""Align performances with their scores, filling segments.matched_note_id
+
+The segments of a performance (perf_id, perfpart) are the notes played,
+in start_time order. alignNotes() matches them with the notes of a work,
+in onset order, by a banded dynamic programming alignment: the score and
+the performance are walked together, and each step either matches a
+note with a segment of the same pitch, skips a score note (not played)
+or skips a segment (an extra or wrong note). Among alignments with the
+fewest skips, matches whose relative positions in the score and the
+performance are closest are preferred. Pitches are compared as spoff
+pitches, or by MIDI note number where a segment has no spelled pitch.
+
+Only the cells within band of the diagonal are considered, and only
+their back pointers (a byte each) are kept, so memory grows with the
+length of the score times the band, not with the product of the two
+lengths.
+
+In the database, align_performances() (sql/align.sql) aligns each of
+a list of performances with a work and writes all the matches back
+with one update. Outside it, alignPerformances() does the same with a
+pool of processes, against a connection's plpy or a store's (see
+spoff.store):
+
+	from spoff import align, store
+	plpy = store.load('musicdb_dump.txt').plpy
+	jobs = [(perf_id, perfpart, work_id, 'XPart 0') for (perf_id, perfpart) in performances]
+	align.alignPerformances(plpy, jobs, processes=4)
+
+The queries are answered by a store (spoff.store) through the handlers
+registered at the end of this module, which compute in Python what the
+SQL computes: the examples run against a store, so they do not exercise
+the SQL text.
+"""
+import numpy
+
+from spoff import asPitch, asScoreTime, scoreTimeKey, pitchKey
+from spoff import store
+
+# Half the number of cells considered in each row of the alignment
+BAND = 64
+# The costs of skipping a score note and a segment, and the weight of
+# the difference in relative position of a match (at most 1)
+DELETION = 1.0
+INSERTION = 1.0
+TIMING = 1.0
+# Segments starting within this of the one before (in start_time units)
+# are taken as played together, and ordered by pitch as chords are in
+# the score
+CHORD_SPREAD = 0.05
+
+_naturalSemitones = (5, 0, 7, 2, 9, 4, 11)	# F C G D A E B
+
+def pitchNumber(pitch):
+	"""The MIDI note number of a spoff pitch (C4 is 60), None for a rest
+
+	>>> from spoff import text2pitch
+	>>> [pitchNumber(text2pitch(p)) for p in ('C4', 'Cb4', 'B#3', 'A4')]
+	[60, 59, 60, 69]
+	"""
+	pitch = asPitch(pitch)
+	if pitch is None:
+		return None
+	value, dps, octave = pitch
+	natural = value % 7
+	return 12 * (octave + 1) + _naturalSemitones[natural] + (value - natural) // 7
+
+# The spelling of each semitone of an octave from C, as a spoff pitch
+# value, for a segment with only a MIDI note number: C C# D D# E F F# G
+# G# A A# B
+_semitoneSpellings = (1, 8, 3, 10, 5, 0, 7, 2, 9, 4, 11, 6)
+
+def midiPitch(number):
+	"""A spoff pitch of a MIDI note number, spelled with sharps
+
+	>>> midiPitch(60), midiPitch(61), all([pitchNumber(midiPitch(n)) == n for n in range(128)])
+	((1, 1, 4), (8, 1, 4), True)
+	"""
+	if number is None:
+		return None
+	return (_semitoneSpellings[number % 12], 1, number // 12 - 1)
+
+def _spelling(pitch):
+	# a spoff pitch as one integer, -1 for none
+	pitch = asPitch(pitch)
+	if pitch is None:
+		return -1
+	return (pitch[2] + 64) * 1024 + pitch[0] + 512
+
+def _relative(times):
+	# times as fractions of the span from the first to the last
+	times = numpy.asarray(times, dtype=float)
+	if len(times) == 0:
+		return times
+	span = times.max() - times.min()
+	return (times - times.min()) / span if span > 0 else numpy.zeros(len(times))
+
+class AlignmentError(Exception):
+	pass
+
+def alignNotes(score, performance, band=BAND):
+	"""Match the notes of a score with the segments of a performance
+
+	score is a sequence of (note_id, pitch, onset) in onset order and
+	performance of (segment id, pitch, midi_note, start_time) in
+	start_time order, where pitch may be None. Segments played together
+	(see CHORD_SPREAD) are matched in pitch order. Returns a list of
+	(segment id, note_id) for every segment, in the order given,
+	note_id being None for a segment matched with no note.
+
+	>>> from spoff import text2pitch
+	>>> score = [(i, text2pitch(p), (i, 1)) for i, p in enumerate(['C4', 'D4', 'E4', 'F4', 'G4'])]
+	>>> played = [(10, 'C4', None), (11, None, 62), (12, 'F#4', None), (13, 'E4', None),
+	...           (14, 'G4', None), (15, 'G4', None)]
+	>>> performance = [(s, p and text2pitch(p), m, 0.5 * k) for k, (s, p, m) in enumerate(played)]
+	>>> alignNotes(score, performance, band=2)
+	[(10, 0), (11, 1), (12, None), (13, 2), (14, None), (15, 4)]
+
+	Chords are ordered as spoff_pitch_key() orders them, so enharmonic
+	notes are matched in the same order on both sides:
+
+	>>> chord = [(0, text2pitch('B#3'), (0, 1)), (1, text2pitch('C4'), (0, 1))]
+	>>> alignNotes(chord, [(10, text2pitch('C4'), None, 0.0), (11, text2pitch('B#3'), None, 0.01)])
+	[(10, 1), (11, 0)]
+	"""
+	given = performance
+	performance = _chordOrder(performance)
+	m = len(score)
+	n = len(performance)
+	scoreSpelling = numpy.array([_spelling(pitch) for (note_id, pitch, onset) in score], dtype=numpy.int64)
+	scoreNumber = numpy.array([pitchNumber(pitch) for (note_id, pitch, onset) in score], dtype=numpy.int64)
+	scoreTime = _relative([scoreTimeKey(asScoreTime(onset)) for (note_id, pitch, onset) in score])
+	perfSpelling = numpy.array([_spelling(pitch) for (segment, pitch, midi, start) in performance],
+		dtype=numpy.int64)
+	perfNumber = numpy.array([-1 if midi is None else midi for (segment, pitch, midi, start) in performance],
+		dtype=numpy.int64)
+	perfTime = _relative([float(start) for (segment, pitch, midi, start) in performance])
+	spelled = perfSpelling >= 0
+
+	# the band must be wide enough for successive rows to overlap
+	width = max(band, -(-n // max(m, 1)) + 1)
+	los = []
+	pointers = []	# per row: 0 diagonal (match), 1 up (skip note), 2 left (skip segment)
+	previous = previousLo = None
+	for i in range(m + 1):
+		centre = (i * n) // m if m else n
+		lo = max(0, centre - width)
+		hi = min(n, centre + width)
+		columns = numpy.arange(lo, hi + 1)
+		if i == 0:
+			best = INSERTION * columns
+			pointer = numpy.full(len(columns), 2, dtype=numpy.int8)
+		else:
+			def fromPrevious(cols):
+				values = numpy.full(len(cols), numpy.inf)
+				index = cols - previousLo
+				valid = (index >= 0) & (index < len(previous))
+				values[valid] = previous[index[valid]]
+				return values
+			up = fromPrevious(columns) + DELETION
+			segments = columns - 1
+			valid = segments >= 0
+			equal = numpy.zeros(len(columns), dtype=bool)
+			s = segments[valid]
+			equal[valid] = numpy.where(spelled[s], perfSpelling[s] == scoreSpelling[i - 1],
+				perfNumber[s] == scoreNumber[i - 1])
+			diagonal = numpy.full(len(columns), numpy.inf)
+			diagonal[equal] = (fromPrevious(columns - 1)[equal]
+				+ TIMING * numpy.abs(perfTime[segments[equal]] - scoreTime[i - 1]))
+			arrive = numpy.minimum(diagonal, up)
+			pointer = numpy.where(diagonal <= up, 0, 1).astype(numpy.int8)
+			best = INSERTION * columns + numpy.minimum.accumulate(arrive - INSERTION * columns)
+			pointer[best < arrive - 1e-9] = 2
+		los.append(lo)
+		pointers.append(pointer)
+		previous, previousLo = best, lo
+	if not numpy.isfinite(previous[n - previousLo]):
+		raise AlignmentError('no alignment within the band')
+
+	matches = {}
+	i, j = m, n
+	while i > 0 or j > 0:
+		step = pointers[i][j - los[i]] if i > 0 else 2
+		if step == 0:
+			matches[j - 1] = score[i - 1][0]
+			i -= 1
+			j -= 1
+		elif step == 1:
+			i -= 1
+		else:
+			j -= 1
+	matched = dict((performance[j][0], note_id) for (j, note_id) in matches.items())
+	return [(segment[0], matched.get(segment[0])) for segment in given]
+
+def _chordOrder(performance):
+	# the segments with each group played together sorted by pitch
+	ordered = []
+	group = []
+	last = None
+	for segment in performance:
+		start = float(segment[3])
+		if group and start - last > CHORD_SPREAD:
+			ordered.extend(sorted(group, key=_segmentPitch))
+			group = []
+		group.append(segment)
+		last = start
+	ordered.extend(sorted(group, key=_segmentPitch))
+	return ordered
+
+def _segmentPitch(segment):
+	# the order of a segment in its chord: as spoff_pitch_key() orders the
+	# chords of the score (B#3 below C4), spelling a segment with only a
+	# MIDI note number with sharps
+	segment_id, pitch, midi, start = segment
+	if pitch is None:
+		pitch = midiPitch(midi)
+	return (pitchKey(pitch), segment_id)
+
+##################################
+# In the database
+##################################
+
+# The notes to align with: pitched, in onset order (chords by pitch),
+# without the later notes of ties, which are not played again
+alignScoreQuery = """select sn.note_id, sn.pitch, sn.onset from score_notes as sn
+	where sn.work_id = $1 and ($2::text is null or sn.part_id = $2) and sn.type = 'pitch'
+		and not exists (select 1 from note_groups__score_notes as ngsn
+				inner join note_groups as ng on (ng.id = ngsn.note_group_id)
+			where ngsn.score_note_work_id = sn.work_id and ngsn.score_note_note_id = sn.note_id
+				and ng.type = 'tie' and ng.value[1] <> sn.note_id)
+	order by spoff_time_key(sn.onset), spoff_pitch_key(sn.pitch), sn.note_id;"""
+
+alignSegmentQuery = """select id, pitch, midi_note, start_time from segments
+	where perf_id = $1 and ($2::integer is null or perfpart = $2)
+	order by start_time, id;"""
+
+updateQuery = """update segments set matched_note_id = m.note_id, matched_work_id = m.work_id
+	from (select $1[i] as id, $2[i] as note_id, $3[i] as work_id
+		from generate_subscripts($1, 1) as i) as m
+	where segments.id = m.id;"""
+
+def fetchAlignmentInputs(plpy, perf_id, perfpart, work_id, part_id=None):
+	"""The score notes and performance segments for alignNotes()"""
+	notes = plpy.execute(plpy.prepare(alignScoreQuery, ["integer", "text"]), [work_id, part_id])
+	segments = plpy.execute(plpy.prepare(alignSegmentQuery, ["integer", "integer"]), [perf_id, perfpart])
+	score = [(row['note_id'], asPitch(row['pitch']), asScoreTime(row['onset'])) for row in notes]
+	performance = [(row['id'], asPitch(row['pitch']), row['midi_note'], row['start_time'])
+		for row in segments]
+	return score, performance
+
+def writeMatches(plpy, matches):
+	"""Set matched_note_id and matched_work_id of segments with one update
+
+	matches are (segment id, note_id, work_id); a note_id of None clears
+	the match.
+	"""
+	if not matches:
+		return 0
+	ids, note_ids, work_ids = zip(*matches)
+	plan = plpy.prepare(updateQuery, ["integer[]", "integer[]", "integer[]"])
+	plpy.execute(plan, [list(ids), list(note_ids), list(work_ids)])
+	return len(matches)
+
+def _alignJob(job):
+	# a process pool worker: the matches of one performance, or the error
+	# which stopped its alignment
+	work_id, score, performance, band = job
+	try:
+		return [(segment, note_id, None if note_id is None else work_id)
+			for (segment, note_id) in alignNotes(score, performance, band)], None
+	except AlignmentError as e:
+		return None, str(e)
+
+def alignPerformances(plpy, jobs, processes=None, band=BAND):
+	"""Align each (perf_id, perfpart, work_id, part_id) of jobs and write
+	the matches back with one update; returns the number of segments
+	matched with a note
+
+	The inputs are all fetched first. With processes greater than 1 the
+	alignments are computed by a pool of that many processes; as with
+	doc2lilypondChunks(), not inside a plpythonu function. A job which
+	cannot be aligned leaves its segments as they were, and is reported
+	with plpy.warning() where plpy has it.
+
+	>>> from spoff import store
+	>>> dump = ['CREATE TABLE score_notes (', '    work_id integer,', '    note_id integer,',
+	...	'    part_id character(10),', '    type character(10),', '    onset spoff_score_time,',
+	...	'    pitch spoff_pitch', ');',
+	...	'COPY score_notes (work_id, note_id, part_id, type, onset, pitch) FROM stdin;']
+	>>> dump += ['0\\t%d\\tXPart 0   \\tpitch     \\t(%d,1)\\t(%d,1,4)' % (n, n, p)
+	...	for n, p in enumerate([1, 3, 5, 0, 1])] + ['\\\\.']
+	>>> dump += ['CREATE TABLE segments (', '    id integer,', '    start_time numeric,',
+	...	'    pitch spoff_pitch,', '    midi_note smallint,', '    matched_note_id integer,',
+	...	'    matched_work_id integer,', '    perf_id integer,', '    perfpart integer', ');',
+	...	'COPY segments (id, start_time, pitch, midi_note, matched_note_id, matched_work_id,'
+	...	' perf_id, perfpart) FROM stdin;']
+	>>> dump += ['%d\\t%s\\t\\\\N\\t%d\\t\\\\N\\t\\\\N\\t%d\\t1' % (10 * perf + k, 0.5 * k, midi, perf)
+	...	for perf in (1, 2) for k, midi in enumerate([60, 62, 64, 65, 60])] + ['\\\\.']
+	>>> corpus = store.load(dump)
+	>>> alignPerformances(corpus.plpy, [(1, 1, 0, 'XPart 0'), (2, 1, 0, 'XPart 0')], processes=2)
+	10
+	>>> list(corpus.tables['segments'].column('matched_note_id'))
+	[0, 1, 2, 3, 4, 0, 1, 2, 3, 4]
+	"""
+	tasks = []
+	for perf_id, perfpart, work_id, part_id in jobs:
+		score, performance = fetchAlignmentInputs(plpy, perf_id, perfpart, work_id, part_id)
+		tasks.append((work_id, score, performance, band))
+	if processes is not None and processes > 1:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes)
+		try:
+			results = pool.map(_alignJob, tasks)
+		finally:
+			pool.terminate()
+			pool.join()
+	else:
+		results = [_alignJob(task) for task in tasks]
+	matches = []
+	for (perf_id, perfpart, work_id, part_id), (result, error) in zip(jobs, results):
+		if error is None:
+			matches.extend(result)
+		elif hasattr(plpy, 'warning'):
+			plpy.warning('performance %s part %s not aligned with work %s: %s'
+				% (perf_id, perfpart, work_id, error))
+	writeMatches(plpy, matches)
+	return len([match for match in matches if match[1] is not None])
+
+##################################
+# In a store
+##################################
+
+# What the queries above compute, for spoff.store; the SQL is not run.
+
+def _storeTieContinuation(plpy, work_id, note_id):
+	corpus = plpy.store
+	indices = corpus.groups_by_note.get((work_id, note_id))
+	if not indices:
+		return False
+	return any(group['type'].rstrip() == 'tie' and group['value'][0] != note_id
+		for group in corpus.tables['note_groups'].rows(indices))
+
+def _storeScore(plpy, work_id, part_id):
+	rows = [row for row in plpy.scoreNotes([work_id])
+		if (part_id is None or (row['part_id'] or '').rstrip() == part_id.rstrip())
+			and (row['type'] or '').rstrip() == 'pitch'
+			and not _storeTieContinuation(plpy, work_id, row['note_id'])]
+	rows.sort(key=lambda row: (store.timeKey(row['onset']), pitchKey(row['pitch']), row['note_id']))
+	return rows
+
+def _storeSegments(plpy, perf_id, perfpart):
+	rows = [row for row in plpy.rows('segments') if row['perf_id'] == perf_id
+		and (perfpart is None or row['perfpart'] == perfpart)]
+	rows.sort(key=lambda row: (store.nullsLast(row['start_time']), row['id']))
+	return rows
+
+def _storeUpdate(plpy, ids, note_ids, work_ids):
+	segments = plpy.store.tables['segments']
+	index = dict((segment_id, i) for (i, segment_id) in enumerate(segments.column('id')))
+	for column, values in (('matched_note_id', note_ids), ('matched_work_id', work_ids)):
+		data = segments.data[column] = list(segments.data[column])
+		for segment_id, value in zip(ids, values):
+			if segment_id in index:
+				data[index[segment_id]] = value
+	return []
+
+store.registerQuery(alignScoreQuery, _storeScore)
+store.registerQuery(alignSegmentQuery, _storeSegments)
+store.registerQuery(updateQuery, _storeUpdate)
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
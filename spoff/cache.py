@@ -0,0 +1,307 @@
+"""A memory-mapped binary cache of score_notes
+
+Reading a work's notes back from the database, or from a dump, is most
+of the start-up time of an analysis session. writeCache() stores
+score_notes rows in a compact binary file which NoteCache opens with
+mmap, giving numpy views of it without reading or parsing anything:
+
+	from spoff import cache, store
+	corpus = store.load('musicdb_dump.txt')
+	cache.writeCache('notes.cache', cache.fetchScoreNotes(corpus.plpy, range(15)))
+
+	notes = cache.NoteCache('notes.cache', plpy=corpus.plpy)
+	notes.work(0)['onset_numerator']		# an int32 view of the file
+	getIntervals(*notes.pitchArrays(0))		# batch intervals
+	timedIntervals(*notes.parts(0))			# simultaneity
+	doc2lilypond(buildDocument(notes.plpy, [0]), notes.plpy)
+
+The file is a header, a table of the works (work_id, first note, number
+of notes), the notes as fixed-width records sorted by work_id and
+note_id, and the table of the part_id and type strings, each ended by a
+NUL, which the notes refer to by index. Times and pitches are stored as their integer fields,
+with NULL as NULL_FIELD. The header holds a version number and a CRC-32
+of the rest of the file; a file of another version, or which fails the
+check, raises CacheError, and openCache() rebuilds it.
+"""
+import mmap
+import os
+import struct
+import warnings
+import zlib
+
+import numpy
+
+from spoff import asPitch, asScoreTime, scoreNoteQuery, _newPitch, _newScoreTime
+
+MAGIC = b'SPOFFNC\0'
+VERSION = 2
+NULL_FIELD = -32768
+# Bytes checksummed at a time, so that the whole file is never copied
+CHUNK = 1 << 20
+
+# magic, version, CRC-32 of the rest of the file, number of works, notes
+# and bytes of strings
+_header = struct.Struct('<8sIIIII4x')
+
+workDtype = numpy.dtype([('work_id', '<i4'), ('start', '<i4'), ('count', '<i4'), ('pad', '<i4')])
+
+noteDtype = numpy.dtype([
+	('work_id', '<i4'), ('note_id', '<i4'),
+	('onset_numerator', '<i4'), ('onset_denominator', '<i4'),
+	('duration_numerator', '<i4'), ('duration_denominator', '<i4'),
+	('voice', '<i2'), ('part_id', '<i2'), ('type', '<i2'),
+	('pitch', '<i2'), ('divisions_per_semitone', '<i2'), ('octave', '<i2'),
+])
+
+class CacheError(Exception):
+	pass
+
+if bytes is str:
+	def _decode(text):
+		return text
+	def _encode(text):
+		return text.encode('utf-8') if isinstance(text, unicode) else text
+else:
+	def _decode(text):
+		return text.decode('utf-8')
+	def _encode(text):
+		return text.encode('utf-8')
+
+def _field(value):
+	return NULL_FIELD if value is None else value
+
+def _crc32(data, offset):
+	# the CRC-32 of data (a map) from offset, a chunk at a time
+	checksum = 0
+	for start in range(offset, len(data), CHUNK):
+		checksum = zlib.crc32(data[start:start + CHUNK], checksum)
+	return checksum & 0xffffffff
+
+def fetchScoreNotes(plpy, work_ids):
+	"""The score_notes rows of work_ids, from the database or a store"""
+	return plpy.execute(plpy.prepare(scoreNoteQuery, ["int[]"]), [list(work_ids)])
+
+##################################
+# Writing
+##################################
+
+def writeCache(path, rows):
+	"""Write score_notes rows (in any of the forms plpy gives) to a cache file
+
+	The file is written alongside path and renamed into place, so a
+	reader never sees a partly written cache.
+	"""
+	strings = []
+	stringIndex = {}
+	def intern(text):
+		if text is None:
+			return NULL_FIELD
+		if text not in stringIndex:
+			stringIndex[text] = len(strings)
+			strings.append(text)
+		return stringIndex[text]
+
+	records = []
+	for row in rows:
+		onset = asScoreTime(row['onset']) or (None, None)
+		duration = asScoreTime(row['duration']) or (None, None)
+		pitch = asPitch(row['pitch']) or (None, None, None)
+		records.append((row['work_id'], row['note_id'],
+			_field(onset[0]), _field(onset[1]), _field(duration[0]), _field(duration[1]),
+			_field(row['voice']), intern(row['part_id']), intern(row['type']),
+			_field(pitch[0]), _field(pitch[1]), _field(pitch[2])))
+	notes = numpy.array(records, dtype=noteDtype)
+	notes = notes[numpy.lexsort((notes['note_id'], notes['work_id']))]
+
+	work_ids, starts, counts = numpy.unique(notes['work_id'], return_index=True, return_counts=True)
+	works = numpy.zeros(len(work_ids), dtype=workDtype)
+	works['work_id'] = work_ids
+	works['start'] = starts
+	works['count'] = counts
+
+	stringBytes = b''.join([_encode(text) + b'\0' for text in strings])
+	body = works.tobytes() + notes.tobytes() + stringBytes
+	header = _header.pack(MAGIC, VERSION, zlib.crc32(body) & 0xffffffff,
+		len(works), len(notes), len(stringBytes))
+	temporary = '%s.%d.tmp' % (path, os.getpid())
+	with open(temporary, 'wb') as f:
+		f.write(header)
+		f.write(body)
+	os.rename(temporary, path)
+
+##################################
+# Reading
+##################################
+
+class NoteCache(object):
+	"""A cache file written by writeCache(), mapped into memory
+
+	notes and works are read-only numpy record arrays over the file;
+	strings is the table of part_id and type strings. The plpy attribute
+	answers buildDocument()'s query from the cache and passes others,
+	such as the note groups doc2lilypond() fetches, on to plpy.
+
+	>>> import tempfile, shutil
+	>>> directory = tempfile.mkdtemp()
+	>>> path = os.path.join(directory, 'notes.cache')
+	>>> writeCache(path, [
+	...   {'work_id': 0, 'note_id': 1, 'voice': 1, 'part_id': 'P1', 'type': 'note',
+	...    'onset': '(1,4)', 'duration': '(1,4)', 'pitch': '(2,1,4)'},
+	...   {'work_id': 0, 'note_id': 0, 'voice': 1, 'part_id': 'P1', 'type': 'rest',
+	...    'onset': '(0,1)', 'duration': '(1,4)', 'pitch': '(,1,)'}])
+	>>> cache = NoteCache(path)
+	>>> cache.work(0)['note_id'].tolist(), cache.strings
+	([0, 1], ['P1', 'note', 'rest'])
+	>>> [(row['note_id'], row['type'], row['pitch']) for row in cache.rows(0)]
+	[(0, 'rest', None), (1, 'note', SpoffPitch(pitch=2, divisions_per_semitone=1, octave=4))]
+	>>> [values.tolist() for values in cache.pitchArrays(0)]
+	[[None, 2], [None, 1], [None, 4]]
+	>>> cache.close()
+	>>> writeCache(path, [{'work_id': 0, 'note_id': 0, 'voice': 1, 'part_id': '', 'type': None,
+	...    'onset': '(0,1)', 'duration': '(1,4)', 'pitch': '(,1,)'}])
+	>>> cache = NoteCache(path)
+	>>> cache.strings, cache.rows(0)[0]['part_id']
+	([''], '')
+	>>> cache.close()
+	>>> shutil.rmtree(directory)
+	"""
+
+	def __init__(self, path, verify=True, plpy=None):
+		self.path = path
+		with open(path, 'rb') as f:
+			self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			self._open(verify)
+		except Exception:
+			self._map.close()
+			raise
+		self.plpy = CachePlpy(self, plpy)
+
+	def _open(self, verify):
+		if len(self._map) < _header.size:
+			raise CacheError('%s: not a note cache' % self.path)
+		magic, version, checksum, workCount, noteCount, stringSize = \
+			_header.unpack_from(self._map, 0)
+		if magic != MAGIC:
+			raise CacheError('%s: not a note cache' % self.path)
+		if version != VERSION:
+			raise CacheError('%s: cache version %d, expected %d' % (self.path, version, VERSION))
+		offset = _header.size
+		notesOffset = offset + workCount * workDtype.itemsize
+		stringsOffset = notesOffset + noteCount * noteDtype.itemsize
+		if len(self._map) != stringsOffset + stringSize:
+			raise CacheError('%s: truncated' % self.path)
+		if verify and _crc32(self._map, offset) != checksum:
+			raise CacheError('%s: checksum mismatch' % self.path)
+		self.works = numpy.frombuffer(self._map, workDtype, workCount, offset)
+		self.notes = numpy.frombuffer(self._map, noteDtype, noteCount, notesOffset)
+		# every string ends with a NUL, so an empty one is still counted
+		self.strings = [_decode(text) for text in self._map[stringsOffset:].split(b'\0')[:-1]]
+		self._workIndex = dict((work_id, (start, start + count)) for (work_id, start, count)
+			in zip(self.works['work_id'].tolist(), self.works['start'].tolist(),
+			       self.works['count'].tolist()))
+
+	def close(self):
+		# the views must go before the map can be closed
+		self.works = self.notes = None
+		self._map.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def workIds(self):
+		return sorted(self._workIndex)
+
+	def work(self, work_id):
+		"""The notes of a work, by note_id: a view of the file"""
+		start, end = self._workIndex.get(work_id, (0, 0))
+		return self.notes[start:end]
+
+	def pitchArrays(self, work_id=None):
+		"""(pitch, divisions_per_semitone, octave) of the notes of a work (or
+		of every work) as masked arrays for getIntervals(), rests masked"""
+		notes = self.notes if work_id is None else self.work(work_id)
+		rest = (notes['pitch'] == NULL_FIELD) | (notes['octave'] == NULL_FIELD)
+		return tuple([numpy.ma.masked_array(notes[field], mask=rest.copy())
+			for field in ('pitch', 'divisions_per_semitone', 'octave')])
+
+	def rows(self, work_id):
+		"""The score_notes rows of a work, by note_id, with the compact types"""
+		strings = self.strings
+		rows = []
+		for (work_id, note_id, onsetNum, onsetDen, durNum, durDen, voice, part_id, noteType,
+				pitch, dps, octave) in self.work(work_id).tolist():
+			rows.append({
+				'work_id': work_id, 'note_id': note_id,
+				'voice': None if voice == NULL_FIELD else voice,
+				'part_id': None if part_id == NULL_FIELD else strings[part_id],
+				'type': None if noteType == NULL_FIELD else strings[noteType],
+				'onset': None if onsetDen == NULL_FIELD else _newScoreTime((onsetNum, onsetDen)),
+				'duration': None if durDen == NULL_FIELD else _newScoreTime((durNum, durDen)),
+				'pitch': None if pitch == NULL_FIELD or octave == NULL_FIELD
+					else _newPitch((pitch, dps, octave)),
+			})
+		return rows
+
+	def parts(self, work_id):
+		"""The rows of each part of a work, by part_id, as for timedIntervals()"""
+		parts = {}
+		for row in self.rows(work_id):
+			parts.setdefault(row['part_id'], []).append(row)
+		return [parts[part_id] for part_id in sorted(parts)]
+
+def openCache(path, build, verify=True, plpy=None):
+	"""Open the cache at path, first writing it with the rows that build()
+	returns if it is missing, out of date or damaged"""
+	if os.path.exists(path):
+		try:
+			return NoteCache(path, verify, plpy)
+		except CacheError:
+			pass
+	writeCache(path, build())
+	return NoteCache(path, verify, plpy)
+
+##################################
+# plpy
+##################################
+
+class CachePlpy(object):
+	"""Stands in for plpy, answering the score_notes query of buildDocument()
+	from a NoteCache, and passing any other query on to plpy if given"""
+
+	def __init__(self, cache, plpy=None):
+		self.cache = cache
+		self.fallback = plpy
+
+	def prepare(self, query, types=None):
+		if query == scoreNoteQuery:
+			return query
+		if self.fallback is None:
+			raise CacheError('query not answered by the note cache: %s' % query)
+		return self.fallback.prepare(query, types)
+
+	def execute(self, plan, args=()):
+		if plan == scoreNoteQuery:
+			rows = []
+			for work_id in sorted(set(args[0])):
+				rows.extend(self.cache.rows(work_id))
+			return rows
+		if self.fallback is None:
+			raise CacheError('query not answered by the note cache: %s' % plan)
+		return self.fallback.execute(plan, args)
+
+	def error(self, message):
+		raise CacheError(message)
+
+	def warning(self, message):
+		if self.fallback is not None and hasattr(self.fallback, 'warning'):
+			self.fallback.warning(message)
+		else:
+			warnings.warn(message)
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
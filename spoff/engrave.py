@@ -0,0 +1,204 @@
+"""Engrave lilypond output in batches, caching the results
+
+Compiling a document's lilypond markup takes far longer than generating
+it. engraveDocuments() writes the markup of many documents (with
+writeLilypond()) and engraveFiles() runs the engraver on .ly files, such
+as those saved from getlilypond(), as subprocesses, workers at a time:
+
+	from spoff import engrave, store, buildDocument
+	corpus = store.load('musicdb_dump.txt')
+	documents = [('invention%d' % w, buildDocument(corpus.plpy, [w])) for w in range(15)]
+	for job in engrave.engraveDocuments(documents, corpus.plpy, 'out', workers=4):
+		print(job['name'], job['status'], job['seconds'])
+
+The outputs are cached under a SHA-1 of the .ly file, the engraver
+command and the formats, in cache (by default the .engraved directory
+of the output directory), and a job whose outputs are cached is not run
+again. Of several jobs with the same digest in one batch only the first
+is run; the others copy its outputs. The engraver is run as
+
+	command + ['--formats=' + ','.join(formats), '-o', <output directory>/<name>, <name>.ly]
+
+and is expected to write <name>.<format> (or <name>-<page>.<format>);
+command can be any program which behaves like lilypond, such as a stub
+for testing.
+"""
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from spoff import writeLilypond, _clock
+
+LILYPOND_COMMAND = ['lilypond']
+FORMATS = ('pdf',)
+CACHE_DIRECTORY = '.engraved'
+
+class _HashingFile(object):
+	# a file which hashes what is written to it
+	def __init__(self, sink):
+		self.sink = sink
+		self.hash = hashlib.sha1()
+
+	def write(self, text):
+		self.sink.write(text)
+		self.hash.update(text.encode('utf-8') if not isinstance(text, bytes) else text)
+
+def engraveDocuments(documents, plpy, directory, command=LILYPOND_COMMAND, formats=FORMATS,
+		workers=2, cache=None):
+	"""Write each (name, document) of documents to directory/name.ly and
+	engrave them (see engraveFiles())"""
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	paths = []
+	digests = {}
+	for name, doc in documents:
+		path = os.path.join(directory, name + '.ly')
+		with open(path, 'w') as f:
+			sink = _HashingFile(f)
+			writeLilypond(doc, plpy, sink)
+		digests[path] = sink.hash
+		paths.append(path)
+	return _engrave(paths, digests, directory, command, formats, workers, cache)
+
+def engraveFiles(paths, directory, command=LILYPOND_COMMAND, formats=FORMATS,
+		workers=2, cache=None):
+	"""Engrave the .ly files at paths into directory, workers at a time
+
+	Returns a dictionary per job, in the order of paths, with keys name,
+	ly, digest, status ('engraved', 'cached' or 'failed'), seconds,
+	outputs (the paths of the files written), returncode and log (the
+	engraver's output; None if cached).
+
+	>>> import sys, tempfile
+	>>> directory = tempfile.mkdtemp()
+	>>> path = os.path.join(directory, 'a.ly')
+	>>> with open(path, 'w') as f:
+	...   f.write('{ c4 }')
+	>>> stub = [sys.executable, '-c',
+	...   "import sys; open(sys.argv[sys.argv.index('-o') + 1] + '.pdf', 'w').write('%PDF')"]
+	>>> jobs = engraveFiles([path], directory, command=stub)
+	>>> [(job['name'], job['status'], job['returncode']) for job in jobs]
+	[('a', 'engraved', 0)]
+	>>> [(job['status'], [os.path.basename(output) for output in job['outputs']])
+	...   for job in engraveFiles([path], directory, command=stub)]
+	[('cached', ['a.pdf'])]
+	>>> [job['status'] for job in engraveFiles([path], directory, command=stub + ['-x'])]
+	['engraved']
+	>>> [job['status'] for job in engraveFiles([path], directory, command=[sys.executable, '-c', 'pass'])]
+	['failed']
+	>>> copy = os.path.join(directory, 'b.ly')
+	>>> _ = shutil.copyfile(path, copy)
+	>>> [(job['name'], job['status'], [os.path.basename(output) for output in job['outputs']])
+	...   for job in engraveFiles([path, copy], directory, command=stub + ['-y'], workers=2)]
+	[('a', 'engraved', ['a.pdf']), ('b', 'cached', ['b.pdf'])]
+	>>> shutil.rmtree(directory)
+	"""
+	return _engrave(paths, {}, directory, command, formats, workers, cache)
+
+def _engrave(paths, digests, directory, command, formats, workers, cache):
+	if cache is None:
+		cache = os.path.join(directory, CACHE_DIRECTORY)
+	for path in (directory, cache):
+		if not os.path.isdir(path):
+			os.makedirs(path)
+	jobs = []
+	first = {}	# digest -> the index of its first job
+	for path in paths:
+		digest = digests.get(path)
+		if digest is None:
+			digest = hashlib.sha1()
+			with open(path, 'rb') as f:
+				for block in iter(lambda: f.read(65536), b''):
+					digest.update(block)
+		digest = digest.copy()
+		digest.update(repr((list(command), list(formats))).encode('utf-8'))
+		name = os.path.splitext(os.path.basename(path))[0]
+		first.setdefault(digest.hexdigest(), len(jobs))
+		jobs.append((name, path, digest.hexdigest(), directory, command, formats, cache))
+	# each digest is engraved once, so that no two jobs write the same
+	# cached files; the other jobs with it copy the outputs
+	leaders = sorted(first.values())
+	pool = ThreadPool(max(1, workers))
+	try:
+		results = dict(zip(leaders, pool.map(_engraveJob, [jobs[i] for i in leaders])))
+	finally:
+		pool.close()
+		pool.join()
+	engraved = []
+	for i, job in enumerate(jobs):
+		leader = first[job[2]]
+		engraved.append(results[i] if i == leader else _copyJob(job, jobs[leader], results[leader]))
+	return engraved
+
+def _outputs(base, formats):
+	# the files the engraver wrote for base: base.pdf, base-page1.png, ...
+	directory, prefix = os.path.split(base)
+	names = os.listdir(directory)
+	found = []
+	for format in formats:
+		output = re.compile(r'%s(-(page)?[0-9]+)?\.%s$' % (re.escape(prefix), re.escape(format)))
+		found.extend(sorted([name for name in names if output.match(name)]))
+	return [os.path.join(directory, name) for name in found]
+
+def _copyJob(job, leaderJob, leader):
+	# the result of a job with the same digest as leaderJob, from its result
+	name, path, digest, directory, command, formats, cache = job
+	start = _clock()
+	result = {'name': name, 'ly': path, 'digest': digest, 'returncode': leader['returncode'],
+		'log': leader['log']}
+	if leader['status'] == 'failed':
+		result.update(status='failed', outputs=[], seconds=0.0)
+		return result
+	base = os.path.join(directory, name)
+	outputs = []
+	for leaderOutput in leader['outputs']:
+		output = base + os.path.basename(leaderOutput)[len(leaderJob[0]):]
+		if output != leaderOutput:
+			shutil.copyfile(leaderOutput, output)
+		outputs.append(output)
+	result.update(status='cached', returncode=None, log=None, outputs=outputs,
+		seconds=_clock() - start)
+	return result
+
+def _engraveJob(job):
+	name, path, digest, directory, command, formats, cache = job
+	start = _clock()
+	base = os.path.join(directory, name)
+	result = {'name': name, 'ly': path, 'digest': digest, 'returncode': None, 'log': None}
+	cached = _outputs(os.path.join(cache, digest), formats)
+	if cached:
+		outputs = []
+		for cachedPath in cached:
+			output = base + os.path.basename(cachedPath)[len(digest):]
+			shutil.copyfile(cachedPath, output)
+			outputs.append(output)
+		result.update(status='cached', outputs=outputs, seconds=_clock() - start)
+		return result
+
+	for stale in _outputs(base, formats):
+		os.remove(stale)
+	process = subprocess.Popen(list(command) + ['--formats=' + ','.join(formats), '-o', base, path],
+		stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	log = process.communicate()[0]
+	outputs = _outputs(base, formats)
+	result.update(returncode=process.returncode, log=log.decode('utf-8', 'replace'),
+		outputs=outputs, seconds=_clock() - start)
+	if process.returncode != 0 or not outputs:
+		result['status'] = 'failed'
+		return result
+	for output in outputs:
+		# copied under a temporary name, then renamed, so that a job never
+		# finds part of a cached output
+		cachedPath = os.path.join(cache, digest + os.path.basename(output)[len(name):])
+		temporary = '%s.%d.tmp' % (cachedPath, os.getpid())
+		shutil.copyfile(output, temporary)
+		os.rename(temporary, cachedPath)
+	result['status'] = 'engraved'
+	return result
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
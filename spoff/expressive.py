@@ -0,0 +1,197 @@
+"""Expressive timing features of performances, per note
+
+Once the segments of a performance are matched with the notes of a work
+(see spoff.align), timingFeatures() computes, for every matched note at
+once, from arrays of its score onset and its segment's start_time,
+midi_velocity and centsdiff:
+
+	ioi           the performed inter-onset interval from the note's onset
+	              (the earliest segment of the notes with its score onset)
+	              to the next
+	tempo         the local tempo, in crotchets a minute, from the note's
+	              onset to the onset window onsets later
+	MIDI_velocity the segment's midi_velocity
+	centsdiff     the segment's centsdiff
+	asynchrony    how long after the earliest note of its chord the note
+	              was played
+
+Times are in the units of start_time. Notes without a value get NaN.
+addFeatures() attaches them to a document as bar graphs, or as line
+graphs of the values of each note and the notes played after it, and
+statistics() summarises them. workFeatures() reads the matched segments
+of all the performances of a work with one query, in the database
+through addexpressivetiming() (sql/expressive_timing.sql):
+
+	from spoff import expressive
+	features = expressive.workFeatures(plpy, work_id)
+	for perf_id, (notes, values) in features.items():
+		expressive.addFeatures(doc, notes, values, suffix='_%d' % perf_id)
+
+The queries are answered by a store (spoff.store) through the handlers
+registered at the end of this module, which compute in Python what the
+SQL computes: the examples run against a store, so they do not exercise
+the SQL text.
+"""
+from itertools import groupby
+
+import numpy
+
+from spoff import asScoreTime, scoreTimeKey, fetchRows
+from spoff.timed import addBarGraphs, addLineGraphs
+from spoff import store
+
+FEATURES = ('ioi', 'tempo', 'MIDI_velocity', 'centsdiff', 'asynchrony')
+
+# Onsets over which the local tempo is measured
+TEMPO_WINDOW = 1
+# Notes in each line graph
+POINTS = 4
+
+def _floats(values):
+	return numpy.array([numpy.nan if value is None else float(value) for value in values], dtype=float)
+
+def timingFeatures(onsets, starts, velocities=None, cents=None, window=TEMPO_WINDOW):
+	"""The features of each of a performance's matched notes, as a
+	dictionary of arrays of FEATURES
+
+	onsets are the score onsets of the notes in crotchets and starts the
+	start_time of their segments, both in any order; velocities and cents
+	may contain None.
+
+	>>> features = timingFeatures([0, 0, 1, 2, 4], [0.0, 0.02, 0.5, 1.0, 1.5], [60, 70, None, 80, 90])
+	>>> features['ioi'].tolist(), features['tempo'].tolist()
+	([0.5, 0.5, 0.5, 0.5, nan], [120.0, 120.0, 120.0, 240.0, nan])
+	>>> numpy.round(features['asynchrony'], 3).tolist(), features['MIDI_velocity'].tolist()
+	([0.0, 0.02, 0.0, 0.0, 0.0], [60.0, 70.0, nan, 80.0, 90.0])
+	"""
+	onsets = numpy.asarray(onsets, dtype=float)
+	starts = numpy.asarray(starts, dtype=float)
+	n = len(onsets)
+	# the onsets, in score order, and the earliest start of each
+	events, event = numpy.unique(onsets, return_inverse=True)
+	first = numpy.full(len(events), numpy.inf)
+	numpy.minimum.at(first, event, starts)
+	eventIOI = numpy.full(len(events), numpy.nan)
+	eventIOI[:-1] = numpy.diff(first)
+	eventTempo = numpy.full(len(events), numpy.nan)
+	if len(events) > window:
+		elapsed = first[window:] - first[:-window]
+		with numpy.errstate(invalid='ignore', divide='ignore'):
+			tempo = 60.0 * (events[window:] - events[:-window]) / elapsed
+		eventTempo[:-window] = numpy.where(elapsed > 0, tempo, numpy.nan)
+	return {
+		'ioi': eventIOI[event],
+		'tempo': eventTempo[event],
+		'MIDI_velocity': _floats(velocities) if velocities is not None else numpy.full(n, numpy.nan),
+		'centsdiff': _floats(cents) if cents is not None else numpy.full(n, numpy.nan),
+		'asynchrony': starts - first[event],
+	}
+
+def statistics(features):
+	"""The count (of values which are not NaN), mean, standard deviation,
+	minimum and maximum of each feature, as a dictionary of dictionaries
+
+	>>> sorted(statistics({'ioi': numpy.array([0.5, 1.5, numpy.nan])})['ioi'].items())
+	[('count', 2), ('max', 1.5), ('mean', 1.0), ('min', 0.5), ('std', 0.5)]
+	"""
+	summary = {}
+	for name, values in features.items():
+		values = values[~numpy.isnan(values)]
+		if len(values):
+			summary[name] = {'count': len(values), 'mean': float(values.mean()),
+				'std': float(values.std()), 'min': float(values.min()), 'max': float(values.max())}
+		else:
+			summary[name] = {'count': 0, 'mean': None, 'std': None, 'min': None, 'max': None}
+	return summary
+
+def curves(values, order, points=POINTS):
+	"""For each note, the values of it and the notes played after it, points
+	in all (repeating the last note's at the end), where order is the
+	notes' indexes in the order played
+
+	>>> curves(numpy.array([1.0, 2.0, 3.0]), [0, 2, 1], 2).tolist()
+	[[1.0, 3.0], [2.0, 2.0], [3.0, 2.0]]
+	"""
+	order = numpy.asarray(order, dtype=numpy.int64)
+	rank = numpy.empty(len(order), dtype=numpy.int64)
+	rank[order] = numpy.arange(len(order))
+	following = numpy.minimum(rank[:, None] + numpy.arange(points)[None, :], len(order) - 1)
+	return values[order[following]]
+
+def addFeatures(doc, notes, features, names=FEATURES, graph='bar', suffix='', order=None,
+		points=POINTS, digits=3):
+	"""Attach features of notes, (work_id, note_id), to doc as graphs
+	named each feature with suffix, under the part and voice of each note
+	in doc: bar graphs of the values, or if graph is 'line', line graphs
+	from curves() (order defaulting to the order of notes). Returns the
+	number of values attached."""
+	if graph not in ('bar', 'line'):
+		raise ValueError('unknown graph: %s' % graph)
+	if order is None:
+		order = numpy.arange(len(notes))
+	added = 0
+	for name in names:
+		values = features[name]
+		if graph == 'bar':
+			added += addBarGraphs(doc, name + suffix, notes, numpy.round(values, digits))
+		else:
+			added += addLineGraphs(doc, name + suffix, notes, curves(values, order, points), digits)
+	return added
+
+##################################
+# In the database
+##################################
+
+# The segments of performances matched with the notes of a work
+featureQuery = """select s.perf_id, s.matched_work_id as work_id, s.matched_note_id as note_id,
+		sn.onset, s.start_time, s.midi_velocity, s.centsdiff
+	from segments as s
+		inner join score_notes as sn
+		on (sn.work_id = s.matched_work_id and sn.note_id = s.matched_note_id)
+	where s.matched_work_id = $1 and ($2::integer[] is null or s.perf_id = any($2))
+	order by s.perf_id, s.start_time, s.id;"""
+
+def workFeatures(plpy, work_id, perf_ids=None, window=TEMPO_WINDOW):
+	"""The features of the performances of a work (those of perf_ids, or
+	all), read with one query, as a dictionary of perf_id to (notes,
+	features), notes being (work_id, note_id) in the order played"""
+	plan = plpy.prepare(featureQuery, ["integer", "integer[]"])
+	performances = {}
+	for perf_id, rows in groupby(fetchRows(plpy, plan, [work_id, perf_ids]),
+			lambda row: row['perf_id']):
+		rows = list(rows)
+		notes = [(row['work_id'], row['note_id']) for row in rows]
+		features = timingFeatures([scoreTimeKey(asScoreTime(row['onset'])) for row in rows],
+			[row['start_time'] for row in rows], [row['midi_velocity'] for row in rows],
+			[row['centsdiff'] for row in rows], window)
+		performances[perf_id] = (notes, features)
+	return performances
+
+def addExpressiveTiming(plpy, doc, work_id, perf_ids=None, names=FEATURES, graph='bar',
+		window=TEMPO_WINDOW, points=POINTS):
+	"""Attach the features of the performances of a work to the notes of
+	doc, each performance's named with the suffix _perf_id; notes which
+	are not in doc are left out. Returns the number of values attached."""
+	added = 0
+	for perf_id, (notes, features) in sorted(workFeatures(plpy, work_id, perf_ids, window).items()):
+		added += addFeatures(doc, notes, features, names, graph, '_%d' % perf_id, points=points)
+	return added
+
+##################################
+# In a store
+##################################
+
+# What the queries above compute, for spoff.store; the SQL is not run.
+
+def _storeFeatures(plpy, work_id, perf_ids):
+	rows = plpy.matchedSegments(lambda segment: segment['matched_work_id'] == work_id
+		and (perf_ids is None or segment['perf_id'] in perf_ids))
+	rows.sort(key=lambda row: (store.nullsLast(row['perf_id']), store.nullsLast(row['start_time']),
+		row['id']))
+	return rows
+
+store.registerQuery(featureQuery, _storeFeatures)
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
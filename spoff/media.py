@@ -0,0 +1,330 @@
+"""Chunked access to audio and binary_files payloads, with a PCM cache
+
+audio.file is a bytea and binary_files.file a large object. Reading
+either whole pulls the entire recording through the connection, so
+readRange() reads a byte range of one (substring() of the bytea,
+lo_get() of the large object) and readChunks() reads it in CHUNK sized
+pieces. readAudio() reads a few seconds of a WAV recording by reading
+its header and then only the bytes of those samples.
+
+For repeated analyses of the same performance, PCMCache keeps the
+recordings in a local directory as WAV files named by the MD5 of their
+content, and maps their samples into memory as numpy arrays; the least
+recently used files are removed when the cache grows beyond its size.
+Each recording is transferred, and decoded, once. The MD5 of an audio
+payload is kept in audio.digest by a trigger (sql/media.sql), so a
+cached recording costs one small query; that of a binary_files large
+object, which can be rewritten without its row changing, is computed
+by the server, reading the whole object, every time:
+
+	from spoff import media
+	cache = media.PCMCache('/var/tmp/spoff-pcm')
+	for audio_id, rate, samples in cache.performance(plpy, perf_id):
+		samples[int(rate * 10):int(rate * 12)]	# seconds 10 to 12, (frames, channels)
+
+Only PCM WAV is decoded; other formats raise MediaError.
+"""
+import hashlib
+import os
+import struct
+import wave
+
+import numpy
+
+# Bytes read at a time by readChunks()
+CHUNK = 1 << 20
+# Default size of a PCMCache
+CACHE_BYTES = 2 << 30
+
+class MediaError(Exception):
+	pass
+
+##################################
+# Payloads
+##################################
+
+# For each table: the digest and size of a payload, and a byte range of
+# it from a 0-based offset. audio.digest is NULL only where the trigger
+# of sql/media.sql has not been installed.
+_queries = {
+	'audio': (
+		"select coalesce(digest, md5(file)) as digest, octet_length(file) as size, format"
+			" from audio where id = $1",
+		"select substring(file from $2 + 1 for $3) as chunk from audio where id = $1"),
+	'binary_files': (
+		"select md5(data) as digest, length(data) as size, format"
+			" from (select lo_get(file) as data, mimetype as format from binary_files where id = $1) as b",
+		"select lo_get(file, $2, $3) as chunk from binary_files where id = $1"),
+}
+
+def _query(table, which):
+	if table not in _queries:
+		raise MediaError('no payloads in table %s' % table)
+	return _queries[table][which]
+
+def payloadInfo(plpy, table, id):
+	"""The digest (MD5, computed by the server), size and format of a payload"""
+	rows = plpy.execute(plpy.prepare(_query(table, 0), ["integer"]), [id])
+	if not rows or rows[0]['digest'] is None:
+		raise MediaError('no payload for %s %d' % (table, id))
+	row = rows[0]
+	return row['digest'], row['size'], (row['format'] or '').strip()
+
+def readRange(plpy, table, id, offset, length, plan=None):
+	"""length bytes of a payload from offset (fewer at its end)"""
+	if plan is None:
+		plan = plpy.prepare(_query(table, 1), ["integer", "bigint", "integer"])
+	rows = plpy.execute(plan, [id, offset, length])
+	if not rows or rows[0]['chunk'] is None:
+		raise MediaError('no payload for %s %d' % (table, id))
+	return rows[0]['chunk']
+
+def readChunks(plpy, table, id, size, chunk=CHUNK):
+	"""Generate a payload of size bytes in pieces of chunk bytes"""
+	plan = plpy.prepare(_query(table, 1), ["integer", "bigint", "integer"])
+	for offset in range(0, size, chunk):
+		yield readRange(plpy, table, id, offset, min(chunk, size - offset), plan)
+
+def reader(plpy, table, id):
+	"""A read(offset, length) function over a payload"""
+	plan = plpy.prepare(_query(table, 1), ["integer", "bigint", "integer"])
+	return lambda offset, length: readRange(plpy, table, id, offset, length, plan)
+
+##################################
+# WAV
+##################################
+
+_dtypes = {1: numpy.dtype('u1'), 2: numpy.dtype('<i2'), 4: numpy.dtype('<i4')}
+
+def wavLayout(read):
+	"""The layout of a PCM WAV file given read(offset, length): a dictionary
+	of channels, rate, width (bytes per sample), offset and size (of the
+	sample data, in bytes), reading only the headers
+
+	>>> data = _wavBytes(8000, 1, 2, [0, 1, -1, 2])
+	>>> layout = wavLayout(lambda offset, length: data[offset:offset + length])
+	>>> sorted(layout.items())
+	[('channels', 1), ('offset', 44), ('rate', 8000), ('size', 8), ('width', 2)]
+	"""
+	header = read(0, 12)
+	if len(header) < 12 or header[0:4] != b'RIFF' or header[8:12] != b'WAVE':
+		raise MediaError('not a WAV file')
+	layout = {}
+	offset = 12
+	while True:
+		chunk = read(offset, 8)
+		if len(chunk) < 8:
+			raise MediaError('WAV file without sample data')
+		name, size = chunk[0:4], struct.unpack('<I', chunk[4:8])[0]
+		if name == b'fmt ':
+			fields = struct.unpack('<HHIIHH', read(offset + 8, 16))
+			if fields[0] not in (1, 0xFFFE):
+				raise MediaError('WAV file not PCM (format %d)' % fields[0])
+			layout.update(channels=fields[1], rate=fields[2], width=fields[5] // 8)
+		elif name == b'data':
+			if 'rate' not in layout:
+				raise MediaError('WAV file without a format')
+			layout.update(offset=offset + 8, size=size)
+			return layout
+		offset += 8 + size + (size & 1)
+
+def _fileReader(f):
+	# read(offset, length) over an open file
+	def read(offset, length):
+		f.seek(offset)
+		return f.read(length)
+	return read
+
+def _samples(data, layout):
+	# bytes of sample data as a (frames, channels) array
+	width = layout['width']
+	if width == 3:
+		raw = numpy.frombuffer(data, dtype=numpy.uint8)
+		raw = raw[:len(raw) // 3 * 3].reshape(-1, 3).astype(numpy.int32)
+		# as 32 bit samples, to the same scale
+		samples = (raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)
+	elif width in _dtypes:
+		samples = numpy.frombuffer(data, dtype=_dtypes[width])
+	else:
+		raise MediaError('unsupported sample width %d' % width)
+	channels = layout['channels']
+	return samples[:len(samples) // channels * channels].reshape(-1, channels)
+
+def readAudio(read, start=0.0, seconds=None):
+	"""Samples of a WAV payload, from start for seconds (to the end if
+	None), as (rate, array of (frames, channels)), reading only those
+	bytes; read is as for wavLayout(), e.g. from reader()
+
+	>>> data = _wavBytes(4, 2, 2, range(16))
+	>>> rate, samples = readAudio(lambda offset, length: data[offset:offset + length], 0.5, 1)
+	>>> rate, samples.tolist()
+	(4, [[4, 5], [6, 7], [8, 9], [10, 11]])
+	"""
+	layout = wavLayout(read)
+	frameBytes = layout['width'] * layout['channels']
+	frames = layout['size'] // frameBytes
+	first = min(frames, int(round(start * layout['rate'])))
+	last = frames if seconds is None else min(frames, first + int(round(seconds * layout['rate'])))
+	data = read(layout['offset'] + first * frameBytes, (last - first) * frameBytes)
+	return layout['rate'], _samples(data, layout)
+
+def _wavBytes(rate, channels, width, samples):
+	# a WAV file of samples, for the examples
+	import io
+	buffer = io.BytesIO()
+	f = wave.open(buffer, 'wb')
+	f.setnchannels(channels)
+	f.setsampwidth(width)
+	f.setframerate(rate)
+	f.writeframes(numpy.asarray(list(samples), dtype=_dtypes[width]).tobytes())
+	f.close()
+	return buffer.getvalue()
+
+##################################
+# Cache
+##################################
+
+class PCMCache(object):
+	"""Recordings kept as WAV files in directory, named by the MD5 of their
+	payload, their samples mapped into memory
+
+	A file is written under a temporary name and renamed into place, as
+	spoff.cache does. Each use of a file marks it used (its modification
+	time); when the files take more than maxBytes, the least recently
+	used are removed.
+
+	>>> import tempfile, shutil
+	>>> directory = tempfile.mkdtemp()
+	>>> cache = PCMCache(directory, maxBytes=100)
+	>>> payload = _wavBytes(8000, 1, 2, range(20))
+	>>> def fetch(f):
+	...   f.write(payload)
+	>>> rate, samples = cache.load(hashlib.md5(payload).hexdigest(), fetch)
+	>>> rate, samples.shape, int(samples[19, 0]), cache.stats()['misses']
+	(8000, (20, 1), 19, 1)
+	>>> rate, samples = cache.load(hashlib.md5(payload).hexdigest(), None)
+	>>> cache.stats()['hits'], cache.stats()['files']
+	(1, 1)
+	>>> other = _wavBytes(8000, 1, 2, range(30))
+	>>> rate, samples = cache.load(hashlib.md5(other).hexdigest(), lambda f: f.write(other))
+	>>> cache.stats()['files'], cache.stats()['evictions']
+	(1, 1)
+	>>> shutil.rmtree(directory)
+	"""
+
+	def __init__(self, directory, maxBytes=CACHE_BYTES):
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.hits = self.misses = self.evictions = 0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def path(self, digest):
+		return os.path.join(self.directory, digest + '.wav')
+
+	def load(self, digest, fetch):
+		"""(rate, samples) of the recording with MD5 digest, calling
+		fetch(file) to write its payload to file if it is not cached"""
+		path = self.path(digest)
+		if os.path.exists(path):
+			self.hits += 1
+			os.utime(path, None)
+		else:
+			self.misses += 1
+			self._store(path, digest, fetch)
+			self.evict(keep=path)
+		return self._map(path)
+
+	def _store(self, path, digest, fetch):
+		temporary = '%s.%d.tmp' % (path, os.getpid())
+		try:
+			with open(temporary, 'wb') as f:
+				fetch(f)
+			with open(temporary, 'rb') as f:
+				digester = hashlib.md5()
+				for block in iter(lambda: f.read(CHUNK), b''):
+					digester.update(block)
+			if digester.hexdigest() != digest:
+				raise MediaError('payload does not match its digest %s' % digest)
+			with open(temporary, 'rb') as f:
+				layout = wavLayout(_fileReader(f))
+			if layout['width'] == 3:
+				# 24 bit samples are stored as 32 bit, which can be mapped
+				self._widen(temporary, layout)
+			os.rename(temporary, path)
+		finally:
+			if os.path.exists(temporary):
+				os.remove(temporary)
+
+	def _widen(self, path, layout):
+		with open(path, 'rb') as f:
+			f.seek(layout['offset'])
+			samples = _samples(f.read(layout['size']), layout)
+		f = wave.open(path, 'wb')
+		f.setnchannels(layout['channels'])
+		f.setsampwidth(4)
+		f.setframerate(layout['rate'])
+		f.writeframes(samples.astype('<i4').tobytes())
+		f.close()
+
+	def _map(self, path):
+		with open(path, 'rb') as f:
+			layout = wavLayout(_fileReader(f))
+		frames = layout['size'] // (layout['width'] * layout['channels'])
+		if frames == 0:
+			return layout['rate'], numpy.zeros((0, layout['channels']), dtype=_dtypes[layout['width']])
+		return layout['rate'], numpy.memmap(path, dtype=_dtypes[layout['width']], mode='r',
+			offset=layout['offset'], shape=(frames, layout['channels']))
+
+	def files(self):
+		"""(path, size, last used) of the cached files, least recently used first"""
+		files = []
+		for name in os.listdir(self.directory):
+			if name.endswith('.wav'):
+				path = os.path.join(self.directory, name)
+				status = os.stat(path)
+				files.append((path, status.st_size, status.st_mtime))
+		files.sort(key=lambda f: f[2])
+		return files
+
+	def evict(self, keep=None):
+		"""Remove the least recently used files until the rest fit in
+		maxBytes, except keep"""
+		files = self.files()
+		total = sum([size for (path, size, used) in files])
+		for path, size, used in files:
+			if total <= self.maxBytes:
+				break
+			if path == keep:
+				continue
+			os.remove(path)
+			total -= size
+			self.evictions += 1
+
+	def clear(self):
+		for path, size, used in self.files():
+			os.remove(path)
+
+	def stats(self):
+		files = self.files()
+		return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+			'files': len(files), 'bytes': sum([size for (path, size, used) in files]),
+			'maxBytes': self.maxBytes}
+
+	def audio(self, plpy, audio_id, table='audio'):
+		"""(rate, samples) of a payload, transferred in chunks if not cached"""
+		digest, size, format = payloadInfo(plpy, table, audio_id)
+		def fetch(f):
+			for chunk in readChunks(plpy, table, audio_id, size):
+				f.write(chunk)
+		return self.load(digest, fetch)
+
+	def performance(self, plpy, perf_id):
+		"""(audio_id, rate, samples) of each recording of a performance"""
+		rows = plpy.execute(plpy.prepare("select id from audio where perf_id = $1 order by id",
+			["integer"]), [perf_id])
+		return [(row['id'],) + self.audio(plpy, row['id']) for row in rows]
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
@@ -0,0 +1,337 @@
+"""An inverted index of melodic interval n-grams, for motif search
+
+Finding a subject, or its transpositions, in the corpus otherwise means
+working out the melodic intervals of every voice and scanning them. The
+index maps each run of NGRAM successive melodic intervals of a voice
+(see melodicIntervals()) to the places it occurs. An interval is taken
+with its direction, as the token (direction, value, octave), so the
+n-grams, and the searches, are the same in every transposition:
+
+	from spoff import store, motifs, scoreNoteQuery
+	corpus = store.load('musicdb_dump.txt')
+	index = motifs.MotifIndex()
+	for work_id in corpus.notes_by_work:
+		index.addWork(work_id, corpus.plpy.execute(scoreNoteQuery, [[work_id]]))
+	index.search(motifs.subjectTokens(pitches), forms=motifs.FORMS)
+
+A search looks up the n-grams of the pattern and intersects their
+postings, which hold the position of the n-gram in its voice, so no
+voice is read. The pattern must be at least NGRAM intervals long.
+Occurrences of the inversion (every direction reversed), the
+retrograde (the notes reversed) and the retrograde inversion can be
+found in the same way.
+
+In the database the postings are kept in the interval_ngrams table and
+maintained by the functions in sql/motif_index.sql.
+
+The queries are answered by a store (spoff.store) through the handlers
+registered at the end of this module, which compute in Python what the
+SQL computes: the examples run against a store, so they do not exercise
+the SQL text.
+"""
+from itertools import groupby
+
+from spoff import (melodicIntervals, getInterval, asPitch, asScoreTime, scoreTimeKey,
+	text2interval, fetchRows, voiceNoteQuery, CURSOR_BATCH, _comparePitch)
+from spoff import store
+
+# Intervals in an n-gram
+NGRAM = 3
+
+PRIME = 'prime'
+INVERSION = 'inversion'
+RETROGRADE = 'retrograde'
+RETROGRADE_INVERSION = 'retrograde inversion'
+FORMS = (PRIME, INVERSION, RETROGRADE, RETROGRADE_INVERSION)
+
+class MotifError(Exception):
+	pass
+
+##################################
+# Tokens
+##################################
+
+def intervalToken(row):
+	"""The token of a spoff_interval_type row: (direction, value, octave),
+	or None if the interval is unknown"""
+	if row['value'] is None:
+		return None
+	return (row['direction'], row['value'], row['octave'])
+
+def subjectTokens(pitches):
+	"""The tokens of the melodic intervals of a sequence of pitches
+
+	>>> from spoff import text2pitch
+	>>> subjectTokens([text2pitch(p) for p in ('C4', 'D4', 'E4', 'C4')])
+	[(1, 2, 0), (1, 2, 0), (-1, 4, 0)]
+	"""
+	pitches = [asPitch(pitch) for pitch in pitches]
+	if None in pitches:
+		raise MotifError('a subject cannot contain rests')
+	tokens = []
+	for source, dest in zip(pitches[:-1], pitches[1:]):
+		interval = getInterval(source, dest)
+		if interval is None:
+			raise MotifError('no interval between %s and %s' % (source, dest))
+		tokens.append((_comparePitch(dest, source), interval[0], interval[2]))
+	return tokens
+
+_directions = {'+': 1, '-': -1, '=': 0}
+
+def text2tokens(text):
+	"""The tokens of a pattern written as intervals with their directions,
+	e.g. '+M2 +M2 -M3' ('=P1' for a repeated note, '+1+P1' for an octave)"""
+	tokens = []
+	for word in text.split():
+		if word[0] not in _directions:
+			raise MotifError('interval without a direction: %s' % word)
+		interval = text2interval(word[1:])
+		tokens.append((_directions[word[0]], interval[0], int(interval[2])))
+	return tokens
+
+def ngramKey(tokens):
+	"""The text key of a sequence of tokens
+
+	>>> ngramKey([(1, 2, 0), (-1, 4, 0)])
+	'1,2,0 -1,4,0'
+	"""
+	return ' '.join(['%d,%d,%d' % token for token in tokens])
+
+def inversion(tokens):
+	return [(-direction, value, octave) for (direction, value, octave) in tokens]
+
+def retrograde(tokens):
+	return inversion(tokens[::-1])
+
+def patternForms(tokens, forms=(PRIME,)):
+	"""The tokens of each of forms of a pattern, as (form, tokens)"""
+	transforms = {
+		PRIME: lambda tokens: list(tokens),
+		INVERSION: inversion,
+		RETROGRADE: retrograde,
+		RETROGRADE_INVERSION: lambda tokens: list(tokens[::-1]),
+	}
+	return [(form, transforms[form](tokens)) for form in forms]
+
+##################################
+# Postings
+##################################
+
+def voicePostings(notes, n=NGRAM):
+	"""Generate the postings of the n-grams of the voices of notes
+
+	notes are score_notes rows in the order of voiceNoteQuery. Yields
+	(key, work_id, part_id, voice, position, note_id) for every n
+	successive intervals of a voice, where note_id is the first note of
+	the n-gram and position counts the intervals of the voice. Rests, and
+	intervals without a token, break the voice: no n-gram spans them and
+	the position skips one, so that consecutive positions are always
+	consecutive intervals.
+
+	>>> from spoff import text2pitch
+	>>> def note(note_id, pitch):
+	...   return {'work_id':0, 'note_id':note_id, 'part_id':'P1', 'voice':1,
+	...           'pitch':text2pitch(pitch) if pitch else '(,1,)'}
+	>>> notes = [note(i, p) for i, p in enumerate(['C4', 'D4', 'E4', 'C4', None, 'G4', 'A4'])]
+	>>> [(key, position, note_id) for (key, w, p, v, position, note_id) in voicePostings(notes, 2)]
+	[('1,2,0 1,2,0', 0, 0), ('1,2,0 -1,4,0', 1, 1)]
+	"""
+	for (work_id, part_id, voice), voiceNotes in groupby(notes,
+			lambda note: (note['work_id'], note['part_id'], note['voice'])):
+		run = []	# (token, first note_id) of the intervals since the last break
+		position = 0
+		lastNote = None
+		for row in melodicIntervals(voiceNotes):
+			if lastNote is not None and row['source_note_id'] != lastNote:
+				run = []
+				position += 1
+			lastNote = row['dest_note_id']
+			token = intervalToken(row)
+			if token is None:
+				run = []
+			else:
+				run.append((token, row['source_note_id']))
+				if len(run) >= n:
+					yield (ngramKey([token for (token, note_id) in run[-n:]]),
+						work_id, part_id, voice, position - n + 1, run[-n][1])
+			position += 1
+
+def searchPostings(tokens, lookup, n=NGRAM):
+	"""The occurrences of a sequence of tokens, from the postings of its n-grams
+
+	lookup(keys) returns the postings, as from voicePostings(), of the
+	given keys. Returns (work_id, part_id, voice, note_id) of the first
+	note of each occurrence, sorted.
+	"""
+	if len(tokens) < n:
+		raise MotifError('a pattern needs at least %d intervals' % n)
+	offsets = {}
+	for offset in range(len(tokens) - n + 1):
+		offsets.setdefault(ngramKey(tokens[offset:offset + n]), []).append(offset)
+	postings = {}
+	for key, work_id, part_id, voice, position, note_id in lookup(sorted(offsets)):
+		postings.setdefault(key, []).append((work_id, part_id, voice, position, note_id))
+	# every n-gram of the pattern must occur at its offset from the start
+	starts = None
+	noteIds = {}
+	for key in sorted(offsets, key=lambda key: len(postings.get(key, ()))):
+		for offset in offsets[key]:
+			found = set()
+			for work_id, part_id, voice, position, note_id in postings.get(key, ()):
+				start = (work_id, part_id, voice, position - offset)
+				found.add(start)
+				if offset == 0:
+					noteIds[start] = note_id
+			starts = found if starts is None else starts & found
+			if not starts:
+				return []
+	return sorted((work_id, part_id, voice, noteIds[(work_id, part_id, voice, position)])
+		for (work_id, part_id, voice, position) in starts)
+
+def search(tokens, lookup, forms=(PRIME,), n=NGRAM):
+	"""Every occurrence of each of forms of a pattern, as dictionaries of
+	work_id, part_id, voice, note_id (the first note) and form"""
+	occurrences = []
+	for form, formTokens in patternForms(tokens, forms):
+		for work_id, part_id, voice, note_id in searchPostings(formTokens, lookup, n):
+			occurrences.append({'work_id': work_id, 'part_id': part_id, 'voice': voice,
+				'note_id': note_id, 'form': form})
+	return occurrences
+
+##################################
+# In memory
+##################################
+
+class MotifIndex(object):
+	"""The n-gram postings of a set of works, in memory
+
+	>>> from spoff import text2pitch
+	>>> def voice(work_id, pitches):
+	...   return [{'work_id':work_id, 'note_id':i, 'part_id':'P1', 'voice':1,
+	...            'onset':(i, 4), 'pitch':text2pitch(p)} for i, p in enumerate(pitches)]
+	>>> index = MotifIndex(n=2)
+	>>> index.addWork(0, voice(0, ['C4', 'D4', 'E4', 'C4', 'E4', 'D4', 'C4']))
+	>>> index.addWork(1, voice(1, ['G4', 'A4', 'B4', 'G4']))
+	>>> subject = subjectTokens([text2pitch(p) for p in ('C4', 'D4', 'E4', 'C4')])
+	>>> [(o['work_id'], o['note_id'], o['form']) for o in index.search(subject, FORMS)]
+	[(0, 0, 'prime'), (1, 0, 'prime'), (0, 3, 'retrograde')]
+	>>> index.removeWork(1)
+	>>> [(o['work_id'], o['note_id']) for o in index.search(subject)]
+	[(0, 0)]
+	"""
+
+	def __init__(self, n=NGRAM):
+		self.n = n
+		self.postings = {}	# key -> postings
+		self.works = {}		# work_id -> keys of its postings
+
+	def addWork(self, work_id, notes):
+		"""Index the score_notes rows of a work, replacing any postings it had
+
+		The rows are sorted as voiceNoteQuery sorts them.
+		"""
+		self.removeWork(work_id)
+		notes = sorted(notes, key=lambda note: (note['part_id'], note['voice'],
+			scoreTimeKey(asScoreTime(note['onset'])), note['note_id']))
+		keys = set()
+		for posting in voicePostings(notes, self.n):
+			self.postings.setdefault(posting[0], []).append(posting)
+			keys.add(posting[0])
+		self.works[work_id] = keys
+
+	def removeWork(self, work_id):
+		for key in self.works.pop(work_id, ()):
+			postings = [posting for posting in self.postings[key] if posting[1] != work_id]
+			if postings:
+				self.postings[key] = postings
+			else:
+				del self.postings[key]
+
+	def lookup(self, keys):
+		return [posting for key in keys for posting in self.postings.get(key, ())]
+
+	def search(self, tokens, forms=(PRIME,)):
+		return search(tokens, self.lookup, forms, self.n)
+
+##################################
+# In the database
+##################################
+
+ngramQuery = """select key, work_id, part_id, voice, position, note_id
+	from interval_ngrams where key = any($1);"""
+
+deleteQuery = "delete from interval_ngrams where work_id = $1"
+
+insertQuery = """insert into interval_ngrams (key, work_id, part_id, voice, position, note_id)
+	select $1[i], $2, $3[i], $4[i], $5[i], $6[i] from generate_subscripts($1, 1) as i;"""
+
+def databaseLookup(plpy):
+	"""A lookup for search() from the interval_ngrams table"""
+	plan = plpy.prepare(ngramQuery, ["text[]"])
+	def lookup(keys):
+		return [(row['key'], row['work_id'], row['part_id'], row['voice'], row['position'],
+			row['note_id']) for row in plpy.execute(plan, [keys])]
+	return lookup
+
+def indexWork(plpy, work_id, n=NGRAM, batch=CURSOR_BATCH):
+	"""Replace the postings of a work in interval_ngrams, reading its notes
+	through a cursor and inserting batch postings at a time. Returns the
+	number of postings."""
+	plpy.execute(plpy.prepare(deleteQuery, ["integer"]), [work_id])
+	insert = plpy.prepare(insertQuery, ["text[]", "integer", "text[]", "integer[]",
+		"integer[]", "integer[]"])
+	notes = fetchRows(plpy, plpy.prepare(voiceNoteQuery, ["integer"]), [work_id], batch)
+	count = 0
+	postings = []
+	for posting in voicePostings(notes, n):
+		postings.append(posting)
+		if len(postings) == batch:
+			count += _insertPostings(plpy, insert, work_id, postings)
+			postings = []
+	return count + _insertPostings(plpy, insert, work_id, postings)
+
+def _insertPostings(plpy, plan, work_id, postings):
+	if postings:
+		keys, work_ids, part_ids, voices, positions, note_ids = zip(*postings)
+		plpy.execute(plan, [list(keys), work_id, list(part_ids), list(voices),
+			list(positions), list(note_ids)])
+	return len(postings)
+
+##################################
+# In a store
+##################################
+
+# What the queries above compute, for spoff.store; the SQL is not run.
+
+def _storePostings(plpy):
+	# interval_ngrams: key -> postings
+	return plpy.state.setdefault('interval_ngrams', {})
+
+def _storeNgrams(plpy, keys):
+	postings = _storePostings(plpy)
+	return [dict(posting) for key in keys for posting in postings.get(key, ())]
+
+def _storeDelete(plpy, work_id):
+	postings = _storePostings(plpy)
+	for key in list(postings):
+		kept = [posting for posting in postings[key] if posting['work_id'] != work_id]
+		if kept:
+			postings[key] = kept
+		else:
+			del postings[key]
+	return []
+
+def _storeInsert(plpy, keys, work_id, part_ids, voices, positions, note_ids):
+	postings = _storePostings(plpy)
+	for key, part_id, voice, position, note_id in zip(keys, part_ids, voices, positions, note_ids):
+		postings.setdefault(key, []).append({'key': key, 'work_id': work_id,
+			'part_id': part_id, 'voice': voice, 'position': position, 'note_id': note_id})
+	return []
+
+store.registerQuery(ngramQuery, _storeNgrams)
+store.registerQuery(deleteQuery, _storeDelete)
+store.registerQuery(insertQuery, _storeInsert)
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
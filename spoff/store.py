@@ -0,0 +1,409 @@
+"""An in-memory corpus store loaded from a pg_dump file
+
+For analysis without a running database. load() reads the COPY sections
+of a plain-text pg_dump such as musicdb_dump.txt in one streaming pass,
+taking the column types from the dump's CREATE TABLE statements, and
+holds each table column by column:
+
+	integer columns without NULLs	array('l')
+	other integer, numeric, text	lists of int, Decimal, str (or None)
+	spoff_pitch, spoff_score_time	lists of SpoffPitch, SpoffScoreTime
+	integer[]			lists of lists of int
+
+The pitch of a rest, '(,1,)', is None. Score notes are indexed by
+(work_id, note_id) and note groups by the notes they belong to.
+
+Store.plpy answers the queries the spoff functions make through plpy, so
+the same code runs against the store as inside the database: those of
+buildDocument(), doc2lilypond() and the voices read by
+melodicIntervals(), and those of spoff.motifs, spoff.timed,
+spoff.expressive and spoff.align, which register their own handlers
+(registerQuery()) when imported:
+
+	from spoff import store, buildDocument, doc2lilypond, motifs
+	corpus = store.load('musicdb_dump.txt')
+	lily = doc2lilypond(buildDocument(corpus.plpy, [0]), corpus.plpy)
+	motifs.indexWork(corpus.plpy, 0)
+
+Each handler computes in Python what its query computes in SQL, so the
+SQL text of the queries is not exercised by running against a store,
+nor by the examples which do. Updates (the interval_ngrams postings of
+spoff.motifs, the matches of spoff.align) are held in memory, and lost
+with the store.
+"""
+from array import array
+from decimal import Decimal
+import re
+import warnings
+
+from spoff import (asPitch, asScoreTime, asInterval, asIntArray, scoreTimeKey,
+	scoreNoteQuery, noteGroupQuery, voiceNoteQuery)
+
+# The tables loaded by default
+TABLES = ('score_notes', 'note_groups', 'note_groups__score_notes', 'work',
+	'segments', 'timed_data')
+
+class StoreError(Exception):
+	pass
+
+##################################
+# COPY text format
+##################################
+
+_escapes = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+_escapePattern = re.compile(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)')
+
+def _unescapeMatch(match):
+	code = match.group(1)
+	if code in _escapes:
+		return _escapes[code]
+	if code[0] == 'x':
+		return chr(int(code[1:], 16))
+	if code[0] in '01234567':
+		return chr(int(code, 8))
+	return code
+
+def unescape(field):
+	"""Undo the backslash escapes of a COPY text field
+
+	>>> unescape('a\\\\tb\\\\\\\\c')
+	'a\\tb\\\\c'
+	"""
+	if '\\' not in field:
+		return field
+	return _escapePattern.sub(_unescapeMatch, field)
+
+def _integer(text):
+	return int(text)
+
+def _text(text):
+	return unescape(text)
+
+def _tuning(text):
+	# tuning_type: (divisions_per_octave, temperament)
+	divisions, temperament = unescape(text)[1:-1].split(',', 1)
+	return {'divisions_per_octave': int(divisions) if divisions else None,
+		'temperament': temperament.strip('"') or None}
+
+# Column type (as in CREATE TABLE) to parser of its COPY text
+_parsers = {
+	'integer': _integer, 'smallint': _integer, 'bigint': _integer, 'oid': _integer,
+	'numeric': Decimal, 'double precision': float, 'real': float,
+	'boolean': lambda text: text == 't',
+	'spoff_pitch': asPitch, 'spoff_score_time': asScoreTime, 'spoff_interval': asInterval,
+	'integer[]': asIntArray, 'smallint[]': asIntArray,
+	'tuning_type': _tuning,
+}
+_integerTypes = set(['integer', 'smallint', 'bigint', 'oid'])
+
+def _parser(columnType):
+	return _parsers.get(columnType, _text)
+
+##################################
+# Tables
+##################################
+
+class Table(object):
+	"""One table of the store, held column by column"""
+
+	def __init__(self, name, columns, types):
+		self.name = name
+		self.columns = list(columns)
+		self.types = list(types)
+		self.data = dict((column, []) for column in columns)
+
+	def __len__(self):
+		return len(self.data[self.columns[0]]) if self.columns else 0
+
+	def column(self, name):
+		"""The values of a column, in row order"""
+		return self.data[name]
+
+	def row(self, index):
+		"""Row index as a dictionary"""
+		data = self.data
+		return dict((column, data[column][index]) for column in self.columns)
+
+	def rows(self, indices=None):
+		"""Generate the rows (all of them, or those at indices) as dictionaries"""
+		if indices is None:
+			indices = range(len(self))
+		for index in indices:
+			yield self.row(index)
+
+	def _append(self, fields, parsers, share):
+		for column, parse, field in zip(self.columns, parsers, fields):
+			if field == '\\N':
+				value = None
+			else:
+				value = parse(field)
+				try:
+					value = share(value, value)
+				except TypeError:
+					pass	# unhashable, e.g. an array
+			self.data[column].append(value)
+
+	def _compact(self):
+		# integer columns without NULLs become arrays
+		for column, columnType in zip(self.columns, self.types):
+			values = self.data[column]
+			if columnType in _integerTypes and None not in values:
+				self.data[column] = array('l', values)
+
+##################################
+# Store
+##################################
+
+_createTable = re.compile(r'CREATE TABLE (\w+) \(')
+_columnDefinition = re.compile(r'\s+"?(\w+)"? ([^,]+?)( NOT NULL)?,?$')
+_copy = re.compile(r'COPY (\w+) \(([^)]*)\) FROM stdin;')
+
+def copySections(lines, tables=None):
+	"""Generate (table name, columns, column types, rows) for the COPY
+	section of each of tables (or of every table) in the lines of a dump
+
+	The column types are those of the table's CREATE TABLE ('text' if it
+	has none). rows generates the fields of each row as a list of COPY
+	text ('\\N' for NULL), reading the lines, so it must be used before
+	the next section is.
+
+	>>> dump = ['CREATE TABLE t (', '    a integer,', '    b text', ');',
+	...	'COPY t (a, b) FROM stdin;', '1\\tx\\n', '2\\t\\\\N\\n', '\\.\\n']
+	>>> [(name, types, list(rows)) for (name, columns, types, rows) in copySections(dump)]
+	[('t', ['integer', 'text'], [['1', 'x'], ['2', '\\\\N']])]
+	"""
+	types = {}
+	columnTypes = None
+	lines = iter(lines)
+	for line in lines:
+		if line.startswith('CREATE TABLE '):
+			match = _createTable.match(line)
+			columnTypes = types[match.group(1)] = {}
+		elif line.startswith('    ') and columnTypes is not None:
+			match = _columnDefinition.match(line.rstrip('\n'))
+			if match:
+				columnTypes[match.group(1)] = match.group(2)
+		elif line.startswith(');'):
+			columnTypes = None
+		elif line.startswith('COPY '):
+			columnTypes = None
+			match = _copy.match(line)
+			if match is None:
+				continue
+			name = match.group(1)
+			rows = _copyRows(lines)
+			if tables is None or name in tables:
+				columns = [c.strip().strip('"') for c in match.group(2).split(',')]
+				tableTypes = types.get(name, {})
+				yield name, columns, [tableTypes.get(c, 'text') for c in columns], rows
+			for fields in rows:
+				pass	# the rest of the section
+
+def _copyRows(lines):
+	for line in lines:
+		if line.startswith('\\.'):
+			return
+		yield line.rstrip('\n').split('\t')
+
+class Store(object):
+	"""Tables loaded from a pg_dump, with indexes on the score notes and
+	note groups"""
+
+	def __init__(self):
+		self.tables = {}
+		self.note_index = {}		# (work_id, note_id) -> score_notes row
+		self.notes_by_work = {}		# work_id -> score_notes rows, by note_id
+		self.groups_by_note = {}	# (work_id, note_id) -> note_groups rows, by id
+		self.group_index = {}		# note_groups id -> row
+		self.plpy = StorePlpy(self)
+
+	def load(self, lines, tables=TABLES):
+		"""Load the COPY sections of tables from the lines of a dump"""
+		for name, columns, types, rows in copySections(lines, tables):
+			table = Table(name, columns, types)
+			self.tables[name] = table
+			parsers = [_parser(t) for t in table.types]
+			share = {}.setdefault
+			for fields in rows:
+				table._append(fields, parsers, share)
+			table._compact()
+		self._index()
+		return self
+
+	def _index(self):
+		notes = self.tables.get('score_notes')
+		if notes is not None:
+			work_ids = notes.column('work_id')
+			note_ids = notes.column('note_id')
+			self.note_index = dict(((work_id, note_id), row) for (row, (work_id, note_id))
+				in enumerate(zip(work_ids, note_ids)))
+			self.notes_by_work = {}
+			for key in sorted(self.note_index):
+				self.notes_by_work.setdefault(key[0], []).append(self.note_index[key])
+		groups = self.tables.get('note_groups')
+		links = self.tables.get('note_groups__score_notes')
+		if groups is not None:
+			self.group_index = dict((group_id, row) for (row, group_id)
+				in enumerate(groups.column('id')))
+		if groups is not None and links is not None:
+			self.groups_by_note = {}
+			for group_id, work_id, note_id in zip(links.column('note_group_id'),
+					links.column('score_note_work_id'), links.column('score_note_note_id')):
+				self.groups_by_note.setdefault((work_id, note_id), []).append(self.group_index[group_id])
+			for rows in self.groups_by_note.values():
+				rows.sort()
+
+	def note(self, work_id, note_id):
+		"""The score_notes row of a note, as a dictionary"""
+		return self.tables['score_notes'].row(self.note_index[(work_id, note_id)])
+
+	def noteGroups(self, work_id, note_id):
+		"""The note_groups rows of a note, as dictionaries"""
+		return list(self.tables['note_groups'].rows(self.groups_by_note.get((work_id, note_id), ())))
+
+def load(source, tables=TABLES):
+	"""Load a Store from a pg_dump file (a path or an iterable of lines)
+
+	>>> dump = ['CREATE TABLE score_notes (',
+	...	'    work_id integer NOT NULL,', '    note_id integer NOT NULL,',
+	...	'    onset spoff_score_time,', '    pitch spoff_pitch', ');',
+	...	'COPY score_notes (work_id, note_id, onset, pitch) FROM stdin;',
+	...	'0\\t1\\t(1,4)\\t(,1,)', '0\\t0\\t(0,1)\\t(1,1,4)', '\\\\.']
+	>>> corpus = load(dump)
+	>>> corpus.note(0, 0)['pitch'], corpus.note(0, 1)['pitch']
+	(SpoffPitch(pitch=1, divisions_per_semitone=1, octave=4), None)
+	>>> corpus.tables['score_notes'].column('note_id')
+	array('l', [1, 0])
+	"""
+	store = Store()
+	if isinstance(source, str):
+		with open(source) as lines:
+			return store.load(lines, tables)
+	return store.load(source, tables)
+
+##################################
+# plpy
+##################################
+
+# The handler answering each query from a store, by its text
+_handlers = {}
+
+def registerQuery(query, handler):
+	"""Answer query (its text, as given to plpy.prepare()) from a store
+	with handler(plpy, *args), plpy being the store's StorePlpy
+
+	Each module whose functions make queries registers handlers for them
+	when it is imported, so a store answers the queries of the modules in
+	use. A handler reimplements its query in Python: code run against a
+	store does not exercise the SQL text of its queries.
+	"""
+	_handlers[query] = handler
+
+def nullsLast(value):
+	"""A sort key ordering values as ORDER BY does, NULLs after every value"""
+	return (value is None, value)
+
+def timeKey(t):
+	"""A sort key ordering score times as ORDER BY spoff_time_key() does"""
+	return (True, 0.0) if t is None else (False, scoreTimeKey(t))
+
+class StorePlpy(object):
+	"""Stands in for plpy, answering the queries which the spoff functions
+	make from a Store, with the handlers registered for them
+
+	Handlers which update the store keep what they need in state, a
+	dictionary by name.
+
+	>>> from spoff import motifs
+	>>> dump = ['CREATE TABLE score_notes (', '    work_id integer NOT NULL,',
+	...	'    note_id integer NOT NULL,', '    voice smallint,', '    part_id character(10),',
+	...	'    type character(10),', '    onset spoff_score_time,', '    duration spoff_score_time,',
+	...	'    pitch spoff_pitch', ');',
+	...	'COPY score_notes (work_id, note_id, voice, part_id, type, onset, duration, pitch) FROM stdin;']
+	>>> dump += ['0\\t%d\\t1\\tP1\\tpitch\\t(%d,1)\\t(1,1)\\t(%d,1,4)' % (n, n, p)
+	...	for n, p in enumerate([1, 3, 5, 1, 3, 5])] + ['\\.']
+	>>> corpus = load(dump)
+	>>> motifs.indexWork(corpus.plpy, 0, n=2)
+	4
+	>>> subject = motifs.text2tokens('+M2 +M2')
+	>>> [(o['work_id'], o['part_id'], o['note_id']) for o in
+	...	motifs.search(subject, motifs.databaseLookup(corpus.plpy), n=2)]
+	[(0, 'P1', 0), (0, 'P1', 3)]
+	"""
+
+	def __init__(self, store):
+		self.store = store
+		self.state = {}
+
+	def prepare(self, query, types=None):
+		if query not in _handlers:
+			raise StoreError('query not supported by the store: %s' % query)
+		return query
+
+	def execute(self, plan, args=()):
+		if plan not in _handlers:
+			raise StoreError('query not supported by the store: %s' % plan)
+		return _handlers[plan](self, *args)
+
+	def error(self, message):
+		raise StoreError(message)
+
+	def warning(self, message):
+		warnings.warn(message)
+
+	def rows(self, name):
+		"""Generate the rows of a table as dictionaries (none if it is not loaded)"""
+		table = self.store.tables.get(name)
+		return table.rows() if table is not None else ()
+
+	def scoreNotes(self, work_ids):
+		"""The score_notes rows of work_ids, by work_id and note_id"""
+		store = self.store
+		notes = store.tables['score_notes']
+		rows = []
+		for work_id in sorted(set(work_ids)):
+			rows.extend(notes.rows(store.notes_by_work.get(work_id, ())))
+		return rows
+
+	def matchedSegments(self, select):
+		"""The segments for which select(segment) is true which are matched
+		with a note of the store, with its work_id, note_id and onset"""
+		store = self.store
+		rows = []
+		for segment in self.rows('segments'):
+			key = (segment['matched_work_id'], segment['matched_note_id'])
+			if key[1] is None or key not in store.note_index or not select(segment):
+				continue
+			note = store.note(*key)
+			segment.update(work_id=key[0], note_id=key[1], onset=note['onset'])
+			rows.append(segment)
+		return rows
+
+def _noteGroups(plpy, work_ids):
+	store = plpy.store
+	groups = store.tables['note_groups']
+	rows = []
+	for work_id in sorted(set(work_ids)):
+		for row in store.notes_by_work.get(work_id, ()):
+			note_id = store.tables['score_notes'].column('note_id')[row]
+			for group in groups.rows(store.groups_by_note.get((work_id, note_id), ())):
+				group['work_id'] = work_id
+				group['note_id'] = note_id
+				rows.append(group)
+	return rows
+
+def _voiceNotes(plpy, work_id):
+	rows = plpy.scoreNotes([work_id])
+	rows.sort(key=lambda row: (nullsLast(row['part_id']), nullsLast(row['voice']),
+		timeKey(row['onset']), row['note_id']))
+	return rows
+
+registerQuery(scoreNoteQuery, StorePlpy.scoreNotes)
+registerQuery(noteGroupQuery, _noteGroups)
+registerQuery(voiceNoteQuery, _voiceNotes)
+
+if __name__ == "__main__":
+	# test the imported module, which the feature modules register with
+	import doctest
+	from spoff import store
+	doctest.testmod(store)
@@ -0,0 +1,195 @@
+"""Per-note aggregates of timed_data, for bar and line graphs under notes
+
+timed_data holds continuous measurements of a performance (metadata_id,
+time, value). To show them under the notes, the samples falling within
+each note's span (from the segments aligned with it, see spoff.align)
+are reduced to a value, or to a curve of a fixed number of points
+whatever the sample rate. noteWindows() does this for every note at
+once: the samples are read once in time order, each note's window is
+found by binary search, and the sums, extremes and curves come from
+cumulative sums and numpy reductions, not a Python call per sample.
+
+	windows = noteWindows(starts, ends, times, values, points=16)
+	addLineGraphs(doc, 'pitch_curve', notes, windows['curve'])
+	addBarGraphs(doc, 'mean_velocity', notes, windows['mean'])
+
+where notes are the (work_id, note_id) of each span; each graph is
+shown under the part and voice the document has for its note.
+In the database, addtimeddataundernotes() (sql/timed_data.sql) does
+all of this for a performance.
+
+The queries are answered by a store (spoff.store) through the handlers
+registered at the end of this module, which compute in Python what the
+SQL computes: the examples run against a store, so they do not exercise
+the SQL text.
+"""
+import numpy
+
+from spoff import fetchRows, annotate
+from spoff import store
+
+# Points in the curve of each note
+POINTS = 16
+
+STATISTICS = ('mean', 'min', 'max', 'count')
+
+def noteWindows(starts, ends, times, values, points=POINTS):
+	"""Aggregate the samples (times, values) in each window [start, end)
+
+	times must be in increasing order. Returns a dictionary of arrays with
+	an entry per window: 'count', 'mean', 'min' and 'max' (NaN for a
+	window without samples), and 'curve', of points values per window,
+	each the mean of the samples in its part of the window or, where
+	there are none, the value interpolated at its middle (all NaN for a
+	window without samples).
+
+	>>> windows = noteWindows([0, 2, 10], [2, 4, 11], [0, 0.5, 1, 1.5, 2, 3], [1, 2, 3, 4, 10, 20], 2)
+	>>> windows['count'].tolist(), windows['mean'].tolist(), windows['max'].tolist()[:2]
+	([4, 2, 0], [2.5, 15.0, nan], [4.0, 20.0])
+	>>> windows['curve'].tolist()
+	[[1.5, 3.5], [10.0, 20.0], [nan, nan]]
+	"""
+	starts = numpy.asarray(starts, dtype=float)
+	ends = numpy.asarray(ends, dtype=float)
+	times = numpy.asarray(times, dtype=float)
+	values = numpy.asarray(values, dtype=float)
+	first = numpy.searchsorted(times, starts, 'left')
+	last = numpy.searchsorted(times, ends, 'left')
+	count = last - first
+	sums = numpy.concatenate(([0.0], numpy.cumsum(values)))
+	empty = count == 0
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		mean = (sums[last] - sums[first]) / count
+	mean[empty] = numpy.nan
+	minimum = numpy.full(len(starts), numpy.nan)
+	maximum = numpy.full(len(starts), numpy.nan)
+	nonEmpty = numpy.flatnonzero(~empty)
+	if len(nonEmpty):
+		# reduceat reduces from each index to the next: pairs of (first,
+		# last) give the windows, and the reductions between pairs are
+		# dropped. The padding keeps every index below the length.
+		bounds = numpy.empty(2 * len(nonEmpty), dtype=numpy.int64)
+		bounds[0::2] = first[nonEmpty]
+		bounds[1::2] = last[nonEmpty]
+		padded = numpy.concatenate((values, [0.0]))
+		minimum[nonEmpty] = numpy.minimum.reduceat(padded, bounds)[0::2]
+		maximum[nonEmpty] = numpy.maximum.reduceat(padded, bounds)[0::2]
+
+	# the curves: the mean of each of points equal parts of the window
+	fractions = numpy.linspace(0.0, 1.0, points + 1)
+	edges = starts[:, None] + (ends - starts)[:, None] * fractions[None, :]
+	edgeIndex = numpy.searchsorted(times, edges, 'left')
+	binCount = edgeIndex[:, 1:] - edgeIndex[:, :-1]
+	with numpy.errstate(invalid='ignore', divide='ignore'):
+		curve = (sums[edgeIndex[:, 1:]] - sums[edgeIndex[:, :-1]]) / binCount
+	middles = (edges[:, 1:] + edges[:, :-1]) / 2
+	interpolated = numpy.full(middles.shape, numpy.nan)
+	if len(nonEmpty):
+		interpolated[nonEmpty] = numpy.interp(middles[nonEmpty], times, values)
+	curve = numpy.where(binCount > 0, curve, interpolated)
+	return {'count': count, 'mean': mean, 'min': minimum, 'max': maximum, 'curve': curve}
+
+##################################
+# Documents
+##################################
+
+def _addGraphs(doc, kind, valname, notes, values):
+	work_ids = [work_id for (work_id, note_id) in notes]
+	note_ids = [note_id for (work_id, note_id) in notes]
+	return annotate(doc, valname, kind, work_ids, note_ids, values)
+
+def addBarGraphs(doc, valname, notes, values):
+	"""Set the valname bar graph value of each of notes, (work_id,
+	note_id), to its value; NaNs are left out. The graph is shown under
+	the part and voice of each note in doc. Returns the number of notes
+	given values.
+
+	>>> from spoff import documentFromRows
+	>>> doc = documentFromRows([{'work_id':0, 'note_id':n, 'voice':1, 'part_id':'XPart 0',
+	...   'type':'pitch', 'onset':(n,1), 'duration':'(1,1)', 'pitch':'(1,1,4)'} for n in (1, 2)])
+	>>> addBarGraphs(doc, 'mean', [(0, 1), (0, 2)], [64.5, float('nan')])
+	1
+	>>> doc['barGraphList'], doc['noteData'][0][1]['mean'], doc['noteData'][0][2].get('mean')
+	({'XPart 0': {1: ['mean']}}, 64.5, None)
+	"""
+	return _addGraphs(doc, 'bar', valname, notes,
+		[None if numpy.isnan(value) else float(value) for value in values])
+
+def addLineGraphs(doc, valname, notes, curves, digits=3):
+	"""Set the valname line graph of each of notes, (work_id, note_id),
+	to its curve, rounded to digits places; points which are NaN (no
+	samples at all) leave the note without a graph. The graph is shown
+	under the part and voice of each note in doc. Returns the number of
+	notes given graphs."""
+	return _addGraphs(doc, 'line', valname, notes,
+		[None if numpy.isnan(curve).any() else [round(float(point), digits) for point in curve]
+			for curve in curves])
+
+##################################
+# In the database
+##################################
+
+# The span of every note matched with a segment of a performance
+noteSpanQuery = """select s.matched_work_id as work_id, s.matched_note_id as note_id,
+		s.start_time, s.start_time + s.duration as end_time
+	from segments as s
+		inner join score_notes as sn
+		on (sn.work_id = s.matched_work_id and sn.note_id = s.matched_note_id)
+	where s.perf_id = $1 and s.matched_note_id is not null
+	order by s.start_time, s.id;"""
+
+# The samples of a measurement between two times, by the (metadata_id,
+# time) index
+sampleQuery = """select "time", value from timed_data
+	where metadata_id = $1 and "time" >= $2 and "time" < $3
+	order by "time";"""
+
+def addTimedDataUnderNotes(plpy, doc, valname, perf_id, metadata_id, statistic='curve', points=POINTS):
+	"""Aggregate the metadata_id samples under the notes of doc matched
+	with segments of performance perf_id: as a line graph of points
+	points if statistic is 'curve', otherwise as a bar graph of one of
+	STATISTICS. Returns the number of notes annotated."""
+	if statistic != 'curve' and statistic not in STATISTICS:
+		raise ValueError('unknown statistic: %s' % statistic)
+	spans = plpy.execute(plpy.prepare(noteSpanQuery, ["integer"]), [perf_id])
+	if not spans:
+		return 0
+	starts = numpy.array([float(span['start_time']) for span in spans])
+	ends = numpy.array([float(span['end_time']) for span in spans])
+	plan = plpy.prepare(sampleQuery, ["integer", "numeric", "numeric"])
+	times = []
+	values = []
+	for row in fetchRows(plpy, plan, [metadata_id, float(starts.min()), float(ends.max())]):
+		times.append(float(row['time']))
+		values.append(float(row['value']))
+	windows = noteWindows(starts, ends, times, values, points)
+	notes = [(span['work_id'], span['note_id']) for span in spans]
+	if statistic == 'curve':
+		return addLineGraphs(doc, valname, notes, windows['curve'])
+	return addBarGraphs(doc, valname, notes, windows[statistic])
+
+##################################
+# In a store
+##################################
+
+# What the queries above compute, for spoff.store; the SQL is not run.
+
+def _storeSpans(plpy, perf_id):
+	rows = plpy.matchedSegments(lambda segment: segment['perf_id'] == perf_id)
+	for row in rows:
+		row['end_time'] = row['start_time'] + row['duration']
+	rows.sort(key=lambda row: (store.nullsLast(row['start_time']), row['id']))
+	return rows
+
+def _storeSamples(plpy, metadata_id, start, end):
+	rows = [row for row in plpy.rows('timed_data') if row['metadata_id'] == metadata_id
+		and row['time'] is not None and start <= row['time'] < end]
+	rows.sort(key=lambda row: row['time'])
+	return rows
+
+store.registerQuery(noteSpanQuery, _storeSpans)
+store.registerQuery(sampleQuery, _storeSamples)
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
@@ -0,0 +1,31 @@
+--
+-- Score to performance alignment: fill segments.matched_note_id and
+-- matched_work_id (see spoff.align).
+--
+-- align_performances(perf_ids, perfparts, work_ids, part_ids) aligns the
+-- segments of each performance (perf_id, perfpart; a NULL perfpart takes
+-- every part) with the notes of a work (part_id; NULL for every part) by
+-- a banded dynamic programming alignment on pitch and onset order, and
+-- writes the matches of all of them back with one update. Segments
+-- matched with no note (extra or wrong notes) get NULLs. A performance
+-- which cannot be aligned is left as it was, with a WARNING. It returns
+-- the number of segments matched, e.g.
+--
+--   select align_performances('{3,4}', '{1,1}', '{0,0}', '{XPart 0,XPart 0}');
+--
+-- The alignments are computed one after another: the backend is not
+-- forked. For many performances, spoff.align.alignPerformances() does
+-- the same from outside the database with a pool of processes.
+--
+
+CREATE OR REPLACE FUNCTION align_performances(perf_ids integer[], perfparts integer[], work_ids integer[], part_ids text[]) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff.align import alignPerformances
+if not len(perf_ids) == len(perfparts) == len(work_ids) == len(part_ids):
+	plpy.error('align_performances: arrays must be the same length')
+return alignPerformances(plpy, zip(perf_ids, perfparts, work_ids, part_ids))
+$$;
+
+
+ALTER FUNCTION public.align_performances(perf_ids integer[], perfparts integer[], work_ids integer[], part_ids text[]) OWNER TO pgsuper;
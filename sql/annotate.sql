@@ -0,0 +1,83 @@
+--
+-- Bulk annotation of the notes of a document (see spoff.annotate()).
+--
+-- annotate(doc, layer, kind, work_id, note_id, value) attaches a whole
+-- layer in one call: value[i] annotates note (work_id[i], note_id[i]),
+-- as a 'text' under the note, a 'bar' graph value or a 'line' graph
+-- point, in one pass over the arrays. A NULL value, or a note which is
+-- not in the document, annotates nothing.
+-- The texts and points of a note are its values in order, replacing any
+-- the layer had, and the layer is shown under the part and voice of
+-- every note annotated. Returns the number of notes annotated, e.g.
+--
+--   select build_document('inv', array[0]);
+--   select annotate('inv', 'MIDI_velocity', 'bar', array_agg(matched_work_id),
+--       array_agg(matched_note_id), array_agg(midi_velocity))
+--     from segments where perf_id = 3 and matched_note_id is not null;
+--   select getlilypond('inv');
+--
+-- It replaces the addtextundernotes(), addbargraphundernotes() and
+-- addlinegraphundernotes() aggregates, which call a state function per
+-- row. Those are kept, their state functions redefined here to share
+-- the registration of annotate(): before, the first row of an aggregate
+-- cleared the layers already shown under its part, and the first point
+-- of each line graph was dropped.
+--
+
+CREATE OR REPLACE FUNCTION annotate(doc text, layer text, kind text, work_id integer[], note_id integer[], value anyarray) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff import annotate
+return annotate(GD[doc], layer, kind, work_id, note_id, value)
+$$;
+
+
+ALTER FUNCTION public.annotate(doc text, layer text, kind text, work_id integer[], note_id integer[], value anyarray) OWNER TO pgsuper;
+
+
+CREATE OR REPLACE FUNCTION addbargraphtonote(cond boolean, doc text, valname text, value spoff_value_type) RETURNS boolean
+    LANGUAGE plpythonu
+    AS $$
+from spoff import addBarGraphToNote
+addBarGraphToNote(GD[doc], valname, value['work_id'], value['note_id'], value['voice'], value['part_id'], value['value'])
+return True
+$$;
+
+
+ALTER FUNCTION public.addbargraphtonote(cond boolean, doc text, valname text, value spoff_value_type) OWNER TO pgsuper;
+
+
+CREATE OR REPLACE FUNCTION addlinegraphtonote(cond boolean, doc text, valname text, value spoff_value_type) RETURNS boolean
+    LANGUAGE plpythonu
+    AS $$
+from spoff import addLineGraphToNote
+addLineGraphToNote(GD[doc], valname, value['work_id'], value['note_id'], value['voice'], value['part_id'], value['value'])
+return True
+$$;
+
+
+ALTER FUNCTION public.addlinegraphtonote(cond boolean, doc text, valname text, value spoff_value_type) OWNER TO pgsuper;
+
+
+CREATE OR REPLACE FUNCTION addtexttonote(cond boolean, doc text, valname text, value spoff_value_type) RETURNS boolean
+    LANGUAGE plpythonu
+    AS $$
+from spoff import addTextToNote
+addTextToNote(GD[doc], valname, value['work_id'], value['note_id'], value['voice'], value['part_id'], value['value'])
+return True
+$$;
+
+
+ALTER FUNCTION public.addtexttonote(cond boolean, doc text, valname text, value spoff_value_type) OWNER TO pgsuper;
+
+
+CREATE OR REPLACE FUNCTION addtexttonote(cond boolean, doc text, valname text, value spoff_text_type) RETURNS boolean
+    LANGUAGE plpythonu
+    AS $$
+from spoff import addTextToNote
+addTextToNote(GD[doc], valname, value['work_id'], value['note_id'], value['voice'], value['part_id'], value['value'])
+return True
+$$;
+
+
+ALTER FUNCTION public.addtexttonote(cond boolean, doc text, valname text, value spoff_text_type) OWNER TO pgsuper;
@@ -0,0 +1,25 @@
+--
+-- build_document(doc, work_ids): build the document doc (in GD, as used
+-- by getlilypond() and the addtextundernotes() family) from all the
+-- score_notes of the given works, with a single query, instead of one
+-- addscorenotetodocument() call per row through the populatedocument()
+-- aggregate. The notes of each work are held column by column in a
+-- spoff.NoteColumns. Returns the number of notes.
+--
+--   select build_document('inv', array[0, 1]);
+--
+-- replaces
+--
+--   select populatedocument('inv', score_notes) from score_notes where work_id in (0, 1);
+--
+
+CREATE OR REPLACE FUNCTION build_document(doc text, work_ids integer[]) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff import buildDocument
+GD[doc] = buildDocument(plpy, work_ids)
+return sum([len(notes) for notes in GD[doc]["noteData"].values()])
+$$;
+
+
+ALTER FUNCTION public.build_document(doc text, work_ids integer[]) OWNER TO pgsuper;
@@ -0,0 +1,76 @@
+--
+-- Expressive timing features of the performances of a work (see
+-- spoff.expressive).
+--
+-- The segments of every performance of a work matched with its notes
+-- (see sql/align.sql) are read with one query, and for each performance
+-- the features of all its notes are computed together:
+--
+--   ioi            performed inter-onset interval to the next onset
+--   tempo          local tempo, crotchets a minute, to the next onset
+--   MIDI_velocity  midi_velocity of the note's segment
+--   centsdiff      centsdiff of the note's segment
+--   asynchrony     time after the earliest note of its chord
+--
+-- addexpressivetiming(doc, work_id, perf_ids, features, graph) attaches
+-- features (NULL for all) of the performances perf_ids (NULL for all) to
+-- the notes of doc as 'bar' or 'line' graphs, named for the feature and
+-- the performance, e.g. ioi_3. Returns the number of values attached:
+--
+--   select build_document('perf', array[0]);
+--   select addexpressivetiming('perf', 0, array[3], array['ioi', 'MIDI_velocity'], 'bar');
+--   select getlilypond('perf');
+--
+-- expressive_timing_statistics(work_id, perf_ids) summarises each
+-- feature of each performance:
+--
+--   select * from expressive_timing_statistics(0, NULL) where feature = 'tempo';
+--
+
+CREATE OR REPLACE FUNCTION addexpressivetiming(doc text, work_id integer, perf_ids integer[], features text[], graph text) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff.expressive import addExpressiveTiming, FEATURES
+return addExpressiveTiming(plpy, GD[doc], work_id, perf_ids, features or FEATURES, graph)
+$$;
+
+
+ALTER FUNCTION public.addexpressivetiming(doc text, work_id integer, perf_ids integer[], features text[], graph text) OWNER TO pgsuper;
+
+-- Created only if missing, so that the file can be run again
+DO $$
+BEGIN
+	IF to_regtype('public.expressive_timing_statistic_type') IS NULL THEN
+		CREATE TYPE expressive_timing_statistic_type AS (
+			perf_id integer,
+			feature text,
+			count integer,
+			mean double precision,
+			std double precision,
+			min double precision,
+			max double precision
+		);
+	END IF;
+END
+$$;
+
+
+ALTER TYPE public.expressive_timing_statistic_type OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION expressive_timing_statistics(work_id integer, perf_ids integer[]) RETURNS SETOF expressive_timing_statistic_type
+    LANGUAGE plpythonu
+    STABLE
+    AS $$
+from spoff.expressive import workFeatures, statistics, FEATURES
+rows = []
+for perf_id, (notes, features) in sorted(workFeatures(plpy, work_id, perf_ids).items()):
+	summary = statistics(features)
+	for feature in FEATURES:
+		row = dict(summary[feature])
+		row.update(perf_id=perf_id, feature=feature)
+		rows.append(row)
+return rows
+$$;
+
+
+ALTER FUNCTION public.expressive_timing_statistics(work_id integer, perf_ids integer[]) OWNER TO pgsuper;
@@ -0,0 +1,43 @@
+--
+-- The cache of rendered voices kept by doc2lilypond() in each backend
+-- (see spoff.FragmentCache). Calling getlilypond() again after adding a
+-- layer of annotations only renders the voices which changed:
+--
+--   select getlilypond('inv');
+--   select addtextundernotes('inv', ...);
+--   select getlilypond('inv');
+--   select * from spoff_fragment_cache_stats();
+--
+-- spoff_fragment_cache_size(n) keeps at most n voices (0 turns the cache
+-- off), empties the cache and returns the previous size.
+--
+
+CREATE OR REPLACE FUNCTION spoff_fragment_cache_size(maxsize integer) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff import setFragmentCacheSize
+return setFragmentCacheSize(maxsize)
+$$;
+
+
+ALTER FUNCTION public.spoff_fragment_cache_size(maxsize integer) OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_fragment_cache_clear() RETURNS void
+    LANGUAGE plpythonu
+    AS $$
+from spoff import fragmentCache
+fragmentCache.clear()
+$$;
+
+
+ALTER FUNCTION public.spoff_fragment_cache_clear() OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_fragment_cache_stats() RETURNS TABLE(hits integer, misses integer, evictions integer, fragments integer, maxsize integer)
+    LANGUAGE plpythonu
+    AS $$
+from spoff import fragmentCache
+return [fragmentCache.stats()]
+$$;
+
+
+ALTER FUNCTION public.spoff_fragment_cache_stats() OWNER TO pgsuper;
@@ -0,0 +1,27 @@
+--
+-- getintervals(spoff_pitch[], spoff_pitch[]): the interval between each
+-- pair of notes in two aligned arrays, computed in one call by
+-- spoff.getIntervals(). Elements for which getinterval() would return
+-- NULL (e.g. rests) are NULL.
+--
+-- e.g. the melodic intervals of a voice:
+--
+--   select getintervals(pitches[1:n-1], pitches[2:n])
+--     from (select array_agg(pitch order by onset) as pitches,
+--                  count(*) as n
+--             from score_notes
+--            where work_id = 0 and part_id = 'XPart 0' and voice = 1) as v;
+--
+
+CREATE OR REPLACE FUNCTION getintervals(s spoff_pitch[], d spoff_pitch[]) RETURNS spoff_interval[]
+    LANGUAGE plpythonu
+    IMMUTABLE
+    AS $$
+from spoff import getIntervals, pitches2arrays, arrays2intervals
+if len(s) != len(d):
+        plpy.error('getintervals: arrays must be the same length')
+return arrays2intervals(*getIntervals(*(pitches2arrays(s) + pitches2arrays(d))))
+$$;
+
+
+ALTER FUNCTION public.getintervals(s spoff_pitch[], d spoff_pitch[]) OWNER TO pgsuper;
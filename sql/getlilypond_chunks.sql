@@ -0,0 +1,24 @@
+--
+-- getlilypond_chunks(doc): the lilypond markup of a document, as
+-- getlilypond(doc) returns it, but as a set of text chunks (the header,
+-- each voice with its \addlyrics lines, the end of each score) produced
+-- by spoff.doc2lilypondChunks() as they are needed. The complete output
+-- is never held in the backend at once. Stream it to a file with
+--
+--   \t\a\o out.ly
+--   select getlilypond_chunks('inv');
+--
+-- Each chunk ends with its own line break, so the file is the same as
+-- the one written from getlilypond(), give or take the newlines psql
+-- writes between rows.
+--
+
+CREATE OR REPLACE FUNCTION getlilypond_chunks(doc text) RETURNS SETOF text
+    LANGUAGE plpythonu
+    AS $$
+from spoff import doc2lilypondChunks
+return doc2lilypondChunks(GD[doc], plpy)
+$$;
+
+
+ALTER FUNCTION public.getlilypond_chunks(doc text) OWNER TO pgsuper;
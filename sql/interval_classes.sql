@@ -0,0 +1,70 @@
+--
+-- Classifying intervals with one lookup each, instead of comparing them
+-- with equateIntervalType() against every member of a set.
+--
+-- interval_class_of(i, classification) is the class of i (ignoring
+-- octaves) in one of the classifications defined in spoff:
+--
+--   consonance    consonant (P1 m3 M3 P5 m6 M6), dissonant
+--   perfection    perfect (P1 P5), imperfect (m3 M3 m6 M6), dissonant
+--
+-- interval_class_text(i, classification) is interval2text(i) marked in
+-- the colour of its class (dissonances in red).
+--
+-- The addintervalclassesundernotes() aggregate adds the coloured text of
+-- every row's interval under its note in one pass, replacing a scan of
+-- the dissonances and another of the consonances:
+--
+--   select addintervalclassesundernotes('inv', 'intervs', 'consonance',
+--                                       work_id, note_id, voice, part_id, value)
+--       from bi where value is not null;
+--
+-- part_id is character(10), as in score_notes: cast to text it would
+-- lose its padding and the layer would be shown under a part name no
+-- note has.
+--
+
+CREATE OR REPLACE FUNCTION interval_class_of(i spoff_interval, classification text) RETURNS text
+    LANGUAGE plpythonu IMMUTABLE
+    AS $$
+from spoff import intervalClassOf
+return intervalClassOf(i, classification)
+$$;
+
+
+ALTER FUNCTION public.interval_class_of(i spoff_interval, classification text) OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION interval_class_text(i spoff_interval, classification text) RETURNS text
+    LANGUAGE plpythonu IMMUTABLE
+    AS $$
+from spoff import intervalClassText
+return intervalClassText(i, classification)
+$$;
+
+
+ALTER FUNCTION public.interval_class_text(i spoff_interval, classification text) OWNER TO pgsuper;
+
+DROP AGGREGATE IF EXISTS addintervalclassesundernotes(text, text, text, integer, integer, integer, text, spoff_interval);
+DROP FUNCTION IF EXISTS addintervalclasstonote(boolean, text, text, text, integer, integer, integer, text, spoff_interval);
+
+CREATE OR REPLACE FUNCTION addintervalclasstonote(cond boolean, doc text, valname text, classification text, work_id integer, note_id integer, voice integer, part_id character(10), value spoff_interval) RETURNS boolean
+    LANGUAGE plpythonu
+    AS $$
+from spoff import addIntervalClassToNote
+addIntervalClassToNote(GD[doc], valname, classification, work_id, note_id, voice, part_id, value)
+return True
+$$;
+
+
+ALTER FUNCTION public.addintervalclasstonote(cond boolean, doc text, valname text, classification text, work_id integer, note_id integer, voice integer, part_id character(10), value spoff_interval) OWNER TO pgsuper;
+
+DROP AGGREGATE IF EXISTS addintervalclassesundernotes(text, text, text, integer, integer, integer, character(10), spoff_interval);
+
+CREATE AGGREGATE addintervalclassesundernotes(text, text, text, integer, integer, integer, character(10), spoff_interval) (
+    SFUNC = public.addintervalclasstonote,
+    STYPE = boolean,
+    INITCOND = 'false'
+);
+
+
+ALTER AGGREGATE public.addintervalclassesundernotes(text, text, text, integer, integer, integer, character(10), spoff_interval) OWNER TO pgsuper;
@@ -0,0 +1,64 @@
+--
+-- Key membership and key fractions from the key tables of spoff.
+--
+-- spoff holds the pitch set of every mode on every keynote from Cb to
+-- C#, computed once at import, as bitsets. inkey(p, key) tests a pitch,
+-- in any octave, against one with a shift and a mask, instead of
+-- comparing it with each pitch of scale(key) as p <~ scale(key) does.
+-- Keys are named as for scale(), 'CM' and 'Am' (the major and natural
+-- minor), or by keynote and mode, e.g. 'A harmonic minor', 'A melodic
+-- minor', 'D dorian', 'G mixolydian'.
+--
+-- key_fractions(work_id, keys, weighted) is the fraction of the notes of
+-- a work in each of keys (by default, NULL, every major and harmonic
+-- minor key), counted in one pass over the notes, weighted by duration
+-- if weighted is true, highest first:
+--
+--   select * from key_fractions(0, NULL, true) limit 3;
+--   select count(*) from score_notes where work_id = 0 and inkey(pitch, 'CM');
+--
+
+CREATE OR REPLACE FUNCTION inkey(p spoff_pitch, key text) RETURNS boolean
+    LANGUAGE plpythonu IMMUTABLE
+    AS $$
+from spoff import inKey
+return inKey(p, key)
+$$;
+
+
+ALTER FUNCTION public.inkey(p spoff_pitch, key text) OWNER TO pgsuper;
+
+-- Created only if missing, so that the file can be run again
+DO $$
+BEGIN
+	IF to_regtype('public.key_fraction_type') IS NULL THEN
+		CREATE TYPE key_fraction_type AS (
+			key text,
+			fraction double precision
+		);
+	END IF;
+END
+$$;
+
+
+ALTER TYPE public.key_fraction_type OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION key_fractions(work_id integer, keys text[], weighted boolean) RETURNS SETOF key_fraction_type
+    LANGUAGE plpythonu
+    STABLE
+    AS $$
+from spoff import keyFractions, pitches2arrays, asPitch, asScoreTime
+plan = plpy.prepare("SELECT pitch, duration FROM score_notes WHERE work_id = $1", ["integer"])
+rows = plpy.execute(plan, [work_id])
+weights = None
+if weighted:
+	weights = []
+	for row in rows:
+		duration = asScoreTime(row['duration'])
+		weights.append(float(duration[0]) / duration[1] if duration is not None else 0.0)
+pitch = pitches2arrays([asPitch(row['pitch']) for row in rows])[0]
+return keyFractions(pitch, keys, weights)
+$$;
+
+
+ALTER FUNCTION public.key_fractions(work_id integer, keys text[], weighted boolean) OWNER TO pgsuper;
@@ -0,0 +1,72 @@
+--
+-- Byte ranges of audio and binary_files payloads (see spoff.media).
+--
+-- audio.file is a bytea; stored EXTERNAL (uncompressed out of line),
+-- substring() of it reads only the TOAST chunks of the range rather
+-- than the whole recording. Recordings stored before the ALTER TABLE
+-- are compressed until rewritten, e.g.
+--
+--   update audio set file = file || ''::bytea;
+--
+-- binary_files.file is a large object, read with lo_get().
+--
+-- audio.digest, the MD5 of file, is set by a trigger whenever file is
+-- written, so that spoff.media.PCMCache can tell whether its copy of a
+-- recording is current without the server reading the recording.
+--
+-- audio_range(id, offset, length) and binary_file_range(id, offset,
+-- length) return length bytes from offset (from 0) of a payload, e.g.
+-- the WAV header and then a few seconds of samples:
+--
+--   select audio_range(7, 0, 44);
+--   select audio_range(7, 44 + 10 * 44100 * 4, 2 * 44100 * 4);
+--
+-- Outside the database spoff.media.PCMCache keeps recordings locally,
+-- transferred in chunks once, by the MD5 of their content.
+--
+
+ALTER TABLE audio ALTER COLUMN file SET STORAGE EXTERNAL;
+
+ALTER TABLE audio ADD COLUMN IF NOT EXISTS digest text;
+
+
+CREATE OR REPLACE FUNCTION audio_digest() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+	NEW.digest := md5(NEW.file);
+	RETURN NEW;
+END
+$$;
+
+
+ALTER FUNCTION public.audio_digest() OWNER TO pgsuper;
+
+DROP TRIGGER IF EXISTS audio_digest ON audio;
+
+CREATE TRIGGER audio_digest BEFORE INSERT OR UPDATE OF file, digest ON audio
+    FOR EACH ROW EXECUTE PROCEDURE audio_digest();
+
+UPDATE audio SET digest = md5(file) WHERE digest IS NULL;
+
+
+CREATE OR REPLACE FUNCTION audio_range(id integer, "offset" bigint, length integer) RETURNS bytea
+    LANGUAGE sql
+    STABLE
+    AS $$
+select substring(file from $2 + 1 for $3) from audio where id = $1;
+$$;
+
+
+ALTER FUNCTION public.audio_range(id integer, "offset" bigint, length integer) OWNER TO pgsuper;
+
+
+CREATE OR REPLACE FUNCTION binary_file_range(id integer, "offset" bigint, length integer) RETURNS bytea
+    LANGUAGE sql
+    STABLE
+    AS $$
+select lo_get(file, $2, $3) from binary_files where id = $1;
+$$;
+
+
+ALTER FUNCTION public.binary_file_range(id integer, "offset" bigint, length integer) OWNER TO pgsuper;
@@ -0,0 +1,50 @@
+--
+-- spoff_melodic_interval(): the melodic interval between each pair of
+-- successive notes in every voice of a work, as spoff_interval_type rows.
+--
+-- The notes are ordered by part_id, voice and onset in the query and
+-- read through an SPI cursor, CURSOR_BATCH rows at a time, by
+-- spoff.melodicIntervals(), which yields the rows as it goes: neither
+-- the notes nor the intervals of the work are ever held in memory as a
+-- whole. No interval spans two voices. Rests end the melodic line, so
+-- no interval spans one, unless bridge_rests is true, when the notes
+-- either side of a rest are paired.
+--
+--   select * from spoff_melodic_interval(0, false);
+--
+-- spoff_interval(text, boolean), which read a whole table into a list,
+-- is redefined in the same way over any table or view of score_notes
+-- rows: if ordered is false the rows are ordered in the query (it used
+-- to return nothing), otherwise they are taken in the table's order.
+-- Rests are skipped.
+--
+-- The ORDER BY uses spoff_time_key(), see sql/sort_keys.sql.
+--
+
+CREATE OR REPLACE FUNCTION spoff_melodic_interval(work_id integer, bridge_rests boolean) RETURNS SETOF spoff_interval_type
+    LANGUAGE plpythonu
+    STABLE
+    AS $$
+from spoff import melodicIntervals, fetchRows, voiceNoteQuery
+plan = plpy.prepare(voiceNoteQuery, ["integer"])
+return melodicIntervals(fetchRows(plpy, plan, [work_id]), bridge_rests)
+$$;
+
+
+ALTER FUNCTION public.spoff_melodic_interval(work_id integer, bridge_rests boolean) OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_interval(text, boolean) RETURNS SETOF spoff_interval_type
+    LANGUAGE plpythonu
+    AS $$
+from spoff import melodicIntervals, fetchRows
+tablename, ordered = args
+if ordered:
+	plan = plpy.prepare("SELECT * FROM %s" % tablename)
+else:
+	plan = plpy.prepare("""SELECT * FROM %s
+		ORDER BY work_id, part_id, voice, spoff_time_key(onset), note_id""" % tablename)
+return melodicIntervals(fetchRows(plpy, plan))
+$$;
+
+
+ALTER FUNCTION public.spoff_interval(text, boolean) OWNER TO pgsuper;
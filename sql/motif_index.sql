@@ -0,0 +1,152 @@
+--
+-- An inverted index of melodic interval n-grams, for finding a subject,
+-- its transpositions, inversion and retrograde anywhere in the corpus
+-- without working out the intervals of every voice (see spoff.motifs).
+--
+-- interval_ngrams holds a posting for every run of spoff.motifs.NGRAM
+-- successive melodic intervals of every voice: its key, which depends
+-- only on the directed intervals, its position in the voice and the
+-- note it starts on. A trigger on score_notes marks the works whose
+-- notes change in interval_ngrams_stale, and motif_index_refresh()
+-- indexes them again, so the index is kept up to date work by work.
+-- To build it:
+--
+--   psql musicdb -f sql/motif_index.sql
+--   insert into interval_ngrams_stale select distinct work_id from score_notes;
+--   select motif_index_refresh();
+--
+-- motif_search() returns the first note of every occurrence of a
+-- pattern, given as directed intervals or as the pitches of a subject,
+-- in each of forms ('prime', 'inversion', 'retrograde' and
+-- 'retrograde inversion'), e.g.
+--
+--   select * from motif_search('+M2 +M2 -M3', '{prime,inversion}');
+--   select * from motif_search(array(select text2pitch(p)
+--                                      from unnest('{C4,D4,E4,C4}'::text[]) as p),
+--                              '{prime,retrograde}');
+--
+-- A pattern needs at least NGRAM intervals. Searches warn if any work is
+-- waiting to be indexed again.
+--
+
+BEGIN;
+
+CREATE TABLE interval_ngrams (
+    key text NOT NULL,
+    work_id integer NOT NULL,
+    part_id character(10),
+    voice smallint,
+    "position" integer NOT NULL,
+    note_id integer NOT NULL
+);
+
+
+ALTER TABLE public.interval_ngrams OWNER TO pgsuper;
+
+CREATE INDEX interval_ngrams__key_index ON interval_ngrams USING btree (key);
+
+CREATE INDEX interval_ngrams__work_id_index ON interval_ngrams USING btree (work_id);
+
+CREATE TABLE interval_ngrams_stale (
+    work_id integer NOT NULL PRIMARY KEY
+);
+
+
+ALTER TABLE public.interval_ngrams_stale OWNER TO pgsuper;
+
+CREATE TYPE motif_occurrence_type AS (
+	work_id integer,
+	part_id character(10),
+	voice smallint,
+	note_id integer,
+	form text
+);
+
+
+ALTER TYPE public.motif_occurrence_type OWNER TO pgsuper;
+
+--
+-- Maintenance
+--
+
+CREATE OR REPLACE FUNCTION interval_ngrams_mark_stale() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO interval_ngrams_stale (work_id)
+            SELECT OLD.work_id
+            WHERE NOT EXISTS (SELECT 1 FROM interval_ngrams_stale WHERE work_id = OLD.work_id);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO interval_ngrams_stale (work_id)
+            SELECT NEW.work_id
+            WHERE NOT EXISTS (SELECT 1 FROM interval_ngrams_stale WHERE work_id = NEW.work_id);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+ALTER FUNCTION public.interval_ngrams_mark_stale() OWNER TO pgsuper;
+
+CREATE TRIGGER score_notes__interval_ngrams_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON score_notes
+    FOR EACH ROW EXECUTE PROCEDURE interval_ngrams_mark_stale();
+
+-- Index the notes of a work again; returns the number of postings
+CREATE OR REPLACE FUNCTION motif_index_work(work_id integer) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff.motifs import indexWork
+return indexWork(plpy, work_id)
+$$;
+
+
+ALTER FUNCTION public.motif_index_work(work_id integer) OWNER TO pgsuper;
+
+-- Index every work marked stale again; returns the number of works
+CREATE OR REPLACE FUNCTION motif_index_refresh() RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff.motifs import indexWork
+rows = plpy.execute("DELETE FROM interval_ngrams_stale RETURNING work_id")
+for row in rows:
+	indexWork(plpy, row['work_id'])
+return len(rows)
+$$;
+
+
+ALTER FUNCTION public.motif_index_refresh() OWNER TO pgsuper;
+
+--
+-- Search
+--
+
+CREATE OR REPLACE FUNCTION motif_search(pattern text, forms text[]) RETURNS SETOF motif_occurrence_type
+    LANGUAGE plpythonu
+    STABLE
+    AS $$
+from spoff.motifs import search, text2tokens, databaseLookup
+if plpy.execute("SELECT 1 FROM interval_ngrams_stale LIMIT 1"):
+	plpy.warning('motif_search: some works are not indexed, see motif_index_refresh()')
+return search(text2tokens(pattern), databaseLookup(plpy), forms)
+$$;
+
+
+ALTER FUNCTION public.motif_search(pattern text, forms text[]) OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION motif_search(subject spoff_pitch[], forms text[]) RETURNS SETOF motif_occurrence_type
+    LANGUAGE plpythonu
+    STABLE
+    AS $$
+from spoff.motifs import search, subjectTokens, databaseLookup
+if plpy.execute("SELECT 1 FROM interval_ngrams_stale LIMIT 1"):
+	plpy.warning('motif_search: some works are not indexed, see motif_index_refresh()')
+return search(subjectTokens(subject), databaseLookup(plpy), forms)
+$$;
+
+
+ALTER FUNCTION public.motif_search(subject spoff_pitch[], forms text[]) OWNER TO pgsuper;
+
+COMMIT;
@@ -0,0 +1,265 @@
+--
+-- Python-free ordering, equality and hashing for spoff_pitch and
+-- spoff_score_time.
+--
+-- spoff_pitch_key() maps each pitch to an integer which sorts and
+-- compares exactly as the plpythonu comparison functions did (see
+-- pitchKey() in spoff). spoff_time_key() maps each score time to a
+-- float8, numerator / denominator (see scoreTimeKey()): equal times
+-- always get equal keys, but two different times get different keys,
+-- and so compare as they did, only while the product of their
+-- denominators and their value stays below 2^52. Beyond that, far beyond
+-- the times of any score, they may share a key and compare equal. The
+-- comparison operators, the btree support functions comparepitch() and
+-- comparetime() and new hash functions are all rewritten as immutable SQL
+-- functions of the keys, so building an index, sorting by onset, merge
+-- and hash joins and autovacuum never enter the Python interpreter.
+--
+-- This is also the migration for an existing database: it rebuilds the
+-- operator classes, recreates the = operators so that they can be used
+-- for hash and merge joins, rebuilds score_notes__onset_index and
+-- score_notes__duration_index with the new operator classes, and adds
+-- expression indexes on the keys beside them. Queries such as ORDER BY
+-- onset or WHERE onset = ... keep using the plain indexes; those which
+-- order and compare by the keys, e.g. ORDER BY spoff_time_key(onset),
+-- use the expression indexes, whose comparisons are cheaper still.
+--
+--   psql musicdb -f sql/sort_keys.sql
+--
+-- Only the two score_notes indexes are dropped and rebuilt. If anything
+-- else (another index, a constraint, a view comparing pitches or times)
+-- uses the operator classes or the = operators, the script fails and
+-- changes nothing; drop those objects first, and recreate them after.
+-- They are listed, with the entries of the operator classes themselves, by
+--
+--   select pg_describe_object(classid, objid, objsubid) from pg_depend
+--    where refobjid in (select oid from pg_opclass
+--                        where opcname in ('spoff_pitch_ops', 'spoff_score_time_ops'))
+--       or refobjid in (select oid from pg_operator where oprname = '='
+--                        and oprleft in ('spoff_pitch'::regtype, 'spoff_score_time'::regtype));
+--
+
+BEGIN;
+
+--
+-- Sort keys
+--
+
+-- 64 * octave plus the position of the pitch within its octave: pitch
+-- classes in pitch_order, then flatter before sharper. Rests sort lowest.
+CREATE OR REPLACE FUNCTION spoff_pitch_key(p spoff_pitch) RETURNS integer
+    LANGUAGE sql
+    IMMUTABLE
+    STRICT
+    AS $$
+SELECT CASE
+    WHEN ($1).pitch IS NULL OR ($1).octave IS NULL THEN -2147483648
+    ELSE 64 * ($1).octave
+         + 8 * (ARRAY[3, 0, 4, 1, 5, 2, 6])[(($1).pitch % 7 + 7) % 7 + 1]
+         - (ARRAY[3, 0, 4, 1, 5, 2, 6])[
+               ((((($1).pitch - (($1).pitch % 7 + 7) % 7) / 7) % 7) + 7) % 7 + 1]
+END
+$$;
+
+
+ALTER FUNCTION public.spoff_pitch_key(p spoff_pitch) OWNER TO pgsuper;
+
+-- Division is correctly rounded, so equal fractions give equal keys;
+-- fractions a/b and c/d differ by at least 1/bd, so unequal ones give
+-- unequal keys while b * d * a/b < 2^52
+CREATE OR REPLACE FUNCTION spoff_time_key(t spoff_score_time) RETURNS double precision
+    LANGUAGE sql
+    IMMUTABLE
+    STRICT
+    AS $$
+SELECT ($1).crotchet_numerator::double precision / ($1).crotchet_denominator
+$$;
+
+
+ALTER FUNCTION public.spoff_time_key(t spoff_score_time) OWNER TO pgsuper;
+
+--
+-- Comparison functions
+--
+
+CREATE OR REPLACE FUNCTION comparepitch(p1 spoff_pitch, p2 spoff_pitch) RETURNS integer
+    LANGUAGE sql
+    IMMUTABLE
+    RETURNS NULL ON NULL INPUT
+    AS $$ SELECT btint4cmp(spoff_pitch_key($1), spoff_pitch_key($2)) $$;
+
+CREATE OR REPLACE FUNCTION lessthanpitch(p1 spoff_pitch, p2 spoff_pitch) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_pitch_key($1) < spoff_pitch_key($2) $$;
+
+CREATE OR REPLACE FUNCTION lessthanorequaltopitch(p1 spoff_pitch, p2 spoff_pitch) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_pitch_key($1) <= spoff_pitch_key($2) $$;
+
+CREATE OR REPLACE FUNCTION equatepitch(p1 spoff_pitch, p2 spoff_pitch) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_pitch_key($1) = spoff_pitch_key($2) $$;
+
+CREATE OR REPLACE FUNCTION greaterthanorequaltopitch(p1 spoff_pitch, p2 spoff_pitch) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_pitch_key($1) >= spoff_pitch_key($2) $$;
+
+CREATE OR REPLACE FUNCTION greaterthanpitch(p1 spoff_pitch, p2 spoff_pitch) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_pitch_key($1) > spoff_pitch_key($2) $$;
+
+CREATE OR REPLACE FUNCTION comparetime(t1 spoff_score_time, t2 spoff_score_time) RETURNS integer
+    LANGUAGE sql
+    IMMUTABLE
+    RETURNS NULL ON NULL INPUT
+    AS $$ SELECT btfloat8cmp(spoff_time_key($1), spoff_time_key($2)) $$;
+
+CREATE OR REPLACE FUNCTION lessthantime(t1 spoff_score_time, t2 spoff_score_time) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_time_key($1) < spoff_time_key($2) $$;
+
+CREATE OR REPLACE FUNCTION lessthanorequaltotime(t1 spoff_score_time, t2 spoff_score_time) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_time_key($1) <= spoff_time_key($2) $$;
+
+CREATE OR REPLACE FUNCTION equatetime(t1 spoff_score_time, t2 spoff_score_time) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_time_key($1) = spoff_time_key($2) $$;
+
+CREATE OR REPLACE FUNCTION greaterthanorequaltotime(t1 spoff_score_time, t2 spoff_score_time) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_time_key($1) >= spoff_time_key($2) $$;
+
+CREATE OR REPLACE FUNCTION greaterthantime(t1 spoff_score_time, t2 spoff_score_time) RETURNS boolean
+    LANGUAGE sql
+    IMMUTABLE
+    AS $$ SELECT spoff_time_key($1) > spoff_time_key($2) $$;
+
+--
+-- Hash functions, consistent with equatepitch() and equatetime()
+--
+
+CREATE OR REPLACE FUNCTION spoff_pitch_hash(p spoff_pitch) RETURNS integer
+    LANGUAGE sql
+    IMMUTABLE
+    STRICT
+    AS $$ SELECT hashint4(spoff_pitch_key($1)) $$;
+
+
+ALTER FUNCTION public.spoff_pitch_hash(p spoff_pitch) OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_time_hash(t spoff_score_time) RETURNS integer
+    LANGUAGE sql
+    IMMUTABLE
+    STRICT
+    AS $$ SELECT hashfloat8(spoff_time_key($1)) $$;
+
+
+ALTER FUNCTION public.spoff_time_hash(t spoff_score_time) OWNER TO pgsuper;
+
+--
+-- Operator classes. The = operators are recreated with HASHES and MERGES,
+-- which cannot be added to an existing operator; the indexes which use
+-- the old operator classes are rebuilt below.
+--
+
+DROP INDEX IF EXISTS score_notes__onset_index;
+DROP INDEX IF EXISTS score_notes__duration_index;
+DROP INDEX IF EXISTS score_notes__onset_key_index;
+DROP INDEX IF EXISTS score_notes__duration_key_index;
+DROP OPERATOR FAMILY IF EXISTS spoff_pitch_ops USING btree;
+DROP OPERATOR FAMILY IF EXISTS spoff_score_time_ops USING btree;
+DROP OPERATOR FAMILY IF EXISTS spoff_pitch_hash_ops USING hash;
+DROP OPERATOR FAMILY IF EXISTS spoff_score_time_hash_ops USING hash;
+DROP OPERATOR IF EXISTS = (spoff_pitch, spoff_pitch);
+DROP OPERATOR IF EXISTS = (spoff_score_time, spoff_score_time);
+
+CREATE OPERATOR = (
+    PROCEDURE = equatepitch,
+    LEFTARG = spoff_pitch,
+    RIGHTARG = spoff_pitch,
+    COMMUTATOR = =,
+    RESTRICT = eqsel,
+    JOIN = eqjoinsel,
+    HASHES,
+    MERGES
+);
+
+
+ALTER OPERATOR public.= (spoff_pitch, spoff_pitch) OWNER TO pgsuper;
+
+CREATE OPERATOR = (
+    PROCEDURE = equatetime,
+    LEFTARG = spoff_score_time,
+    RIGHTARG = spoff_score_time,
+    COMMUTATOR = =,
+    RESTRICT = eqsel,
+    JOIN = eqjoinsel,
+    HASHES,
+    MERGES
+);
+
+
+ALTER OPERATOR public.= (spoff_score_time, spoff_score_time) OWNER TO pgsuper;
+
+CREATE OPERATOR CLASS spoff_pitch_ops
+    DEFAULT FOR TYPE spoff_pitch USING btree AS
+    OPERATOR 1 <(spoff_pitch,spoff_pitch) ,
+    OPERATOR 2 <=(spoff_pitch,spoff_pitch) ,
+    OPERATOR 3 =(spoff_pitch,spoff_pitch) ,
+    OPERATOR 4 >=(spoff_pitch,spoff_pitch) ,
+    OPERATOR 5 >(spoff_pitch,spoff_pitch) ,
+    FUNCTION 1 comparepitch(spoff_pitch,spoff_pitch);
+
+
+ALTER OPERATOR CLASS public.spoff_pitch_ops USING btree OWNER TO pgsuper;
+
+CREATE OPERATOR CLASS spoff_score_time_ops
+    DEFAULT FOR TYPE spoff_score_time USING btree AS
+    OPERATOR 1 <(spoff_score_time,spoff_score_time) ,
+    OPERATOR 2 <=(spoff_score_time,spoff_score_time) ,
+    OPERATOR 3 =(spoff_score_time,spoff_score_time) ,
+    OPERATOR 4 >=(spoff_score_time,spoff_score_time) ,
+    OPERATOR 5 >(spoff_score_time,spoff_score_time) ,
+    FUNCTION 1 comparetime(spoff_score_time,spoff_score_time);
+
+
+ALTER OPERATOR CLASS public.spoff_score_time_ops USING btree OWNER TO pgsuper;
+
+CREATE OPERATOR CLASS spoff_pitch_hash_ops
+    DEFAULT FOR TYPE spoff_pitch USING hash AS
+    OPERATOR 1 =(spoff_pitch,spoff_pitch) ,
+    FUNCTION 1 spoff_pitch_hash(spoff_pitch);
+
+
+ALTER OPERATOR CLASS public.spoff_pitch_hash_ops USING hash OWNER TO pgsuper;
+
+CREATE OPERATOR CLASS spoff_score_time_hash_ops
+    DEFAULT FOR TYPE spoff_score_time USING hash AS
+    OPERATOR 1 =(spoff_score_time,spoff_score_time) ,
+    FUNCTION 1 spoff_time_hash(spoff_score_time);
+
+
+ALTER OPERATOR CLASS public.spoff_score_time_hash_ops USING hash OWNER TO pgsuper;
+
+--
+-- Indexes
+--
+
+CREATE INDEX score_notes__onset_index ON score_notes USING btree (onset);
+CREATE INDEX score_notes__duration_index ON score_notes USING btree (duration);
+CREATE INDEX score_notes__onset_key_index ON score_notes USING btree (spoff_time_key(onset));
+CREATE INDEX score_notes__duration_key_index ON score_notes USING btree (spoff_time_key(duration));
+
+COMMIT;
+
+ANALYZE score_notes;
@@ -0,0 +1,34 @@
+--
+-- timed_data under notes, aggregated per note in one call (see
+-- spoff.timed).
+--
+-- addtimeddataundernotes(doc, valname, perf_id, metadata_id, statistic,
+-- points) takes the span of every note of doc matched with a segment of
+-- performance perf_id (see sql/align.sql) and the samples of
+-- metadata_id over all of them, read once in time order, and reduces the
+-- samples in each span to:
+--
+--   'curve'                          a line graph of points points, the
+--                                    mean of each part of the span; a
+--                                    span without samples gets none
+--   'mean', 'min', 'max', 'count'    a bar graph of that value
+--
+-- It replaces calling the addlinegraphundernotes() aggregate once per
+-- sample, and the graph of a note has the same number of points
+-- whatever the sample rate. Returns the number of notes annotated, e.g.
+--
+--   select build_document('perf', array[0]);
+--   select addtimeddataundernotes('perf', 'pitch_curve', 3, 12, 'curve', 16);
+--   select addtimeddataundernotes('perf', 'loudness', 3, 13, 'mean', 0);
+--   select getlilypond('perf');
+--
+
+CREATE OR REPLACE FUNCTION addtimeddataundernotes(doc text, valname text, perf_id integer, metadata_id integer, statistic text, points integer) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff.timed import addTimedDataUnderNotes
+return addTimedDataUnderNotes(plpy, GD[doc], valname, perf_id, metadata_id, statistic, points)
+$$;
+
+
+ALTER FUNCTION public.addtimeddataundernotes(doc text, valname text, perf_id integer, metadata_id integer, statistic text, points integer) OWNER TO pgsuper;
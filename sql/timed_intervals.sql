@@ -0,0 +1,52 @@
+--
+-- spoff_timed_interval(): the vertical interval between every pair of
+-- overlapping notes in two note streams, as spoff_timed_interval_type
+-- rows. Both streams are read once, in onset order, and swept by
+-- spoff.timedIntervals(), instead of joining score_notes to itself on
+-- the overlap predicates. Rests are skipped.
+--
+-- value and octave are those of getinterval(source pitch, dest pitch);
+-- direction is +1, -1 or 0 as the dest note is above, below or level
+-- with the source note; location and duration are the {numerator,
+-- denominator} of the time over which the two notes sound together.
+--
+-- spoff_timed_interval(text, text) takes the names of two tables (or
+-- views) of score_notes rows; spoff_timed_interval(integer, text, text)
+-- takes a work_id and the part_ids of the two parts, e.g.
+--
+--   select * from spoff_timed_interval(0, 'XPart 1', 'XPart 0');
+--
+-- The ORDER BY uses spoff_time_key(), see sql/sort_keys.sql.
+--
+
+CREATE OR REPLACE FUNCTION spoff_timed_interval(text, text) RETURNS SETOF spoff_timed_interval_type
+    LANGUAGE plpythonu
+    AS $$
+from spoff import timedIntervals
+source_table_name, dest_table_name = args
+plan = plpy.prepare("SELECT * FROM %s ORDER BY spoff_time_key(onset)" % source_table_name)
+source_table = plpy.execute(plan)
+
+plan = plpy.prepare("SELECT * FROM %s ORDER BY spoff_time_key(onset)" % dest_table_name)
+dest_table = plpy.execute(plan)
+
+return timedIntervals(source_table, dest_table)
+$$;
+
+
+ALTER FUNCTION public.spoff_timed_interval(text, text) OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_timed_interval(work_id integer, source_part text, dest_part text) RETURNS SETOF spoff_timed_interval_type
+    LANGUAGE plpythonu
+    STABLE
+    AS $$
+from spoff import timedIntervals
+plan = plpy.prepare("""SELECT * FROM score_notes
+			WHERE work_id = $1 AND part_id = $2 AND type = 'pitch'
+			ORDER BY spoff_time_key(onset)""", ["integer", "text"])
+return timedIntervals(plpy.execute(plan, [work_id, source_part]),
+		plpy.execute(plan, [work_id, dest_part]))
+$$;
+
+
+ALTER FUNCTION public.spoff_timed_interval(work_id integer, source_part text, dest_part text) OWNER TO pgsuper;
@@ -0,0 +1,50 @@
+--
+-- Tracing for the plpythonu functions in spoff. Tracing is off by
+-- default and is set per backend:
+--
+--   select spoff_trace_level(1);        -- 0 off, 1 timing, 2 + per voice, 3 + per note
+--   select getlilypond('inv');
+--   select * from spoff_trace_summary();
+--   select * from spoff_trace_messages();
+--   select spoff_trace_reset();
+--
+
+CREATE OR REPLACE FUNCTION spoff_trace_level(level integer) RETURNS integer
+    LANGUAGE plpythonu
+    AS $$
+from spoff import setTraceLevel
+return setTraceLevel(level)
+$$;
+
+
+ALTER FUNCTION public.spoff_trace_level(level integer) OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_trace_reset() RETURNS void
+    LANGUAGE plpythonu
+    AS $$
+from spoff import resetTrace
+resetTrace()
+$$;
+
+
+ALTER FUNCTION public.spoff_trace_reset() OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_trace_summary() RETURNS TABLE(phase text, work_id integer, part_id text, voice integer, calls integer, seconds double precision)
+    LANGUAGE plpythonu
+    AS $$
+from spoff import traceSummary
+return traceSummary()
+$$;
+
+
+ALTER FUNCTION public.spoff_trace_summary() OWNER TO pgsuper;
+
+CREATE OR REPLACE FUNCTION spoff_trace_messages() RETURNS SETOF text
+    LANGUAGE plpythonu
+    AS $$
+from spoff import traceMessages
+return traceMessages()
+$$;
+
+
+ALTER FUNCTION public.spoff_trace_messages() OWNER TO pgsuper;